@@ -0,0 +1,102 @@
+"""Throughput and p50/p99 latency of login, place_order, portfolio and order history against the local simulator.
+
+    python benchmarks/bench_brokerages.py --brokerage BSC CTS --accounts 1 10 100 1000 5000 --latency 0.02
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from simulator import BrokerageSimulator  # noqa: E402
+from trading_account.bsc_trading_account import BSCTradingAccount  # noqa: E402
+from trading_account.cts_trading_account import CTSTradingAccount  # noqa: E402
+from trading_account.datatypes import Order  # noqa: E402
+from trading_account.token_store import MemoryTokenStore  # noqa: E402
+
+OPERATIONS = ("login", "place_order", "portfolio", "order_history")
+
+
+def create_account(brokerage, i, token_store):
+    if brokerage == "BSC":
+        return BSCTradingAccount(
+            f"user{i}", "password", "123456", f"0001C{i:05d}", client_id="client", client_secret="secret",
+            url_callback="http://callback", token_store=token_store,
+        )
+    return CTSTradingAccount(f"user{i}", "password", "123456", f"0001C{i:05d}")
+
+
+def run_operation(operation, account):
+    if operation == "login":
+        account.login()
+    elif operation == "place_order":
+        account.place_order(Order(symbol="FPT", quantity=100, trading_account_id=account.trading_account_id,
+                                  trade_type="buy", order_type="LO", price=95.0, type="limit"))
+    elif operation == "portfolio":
+        account.fetch_current_portfolio()
+    else:
+        account.get_current_orders(date.today()) if account.brokerage == "CTS" else \
+            account.fetch_current_orders(date.today())
+
+
+def timed(operation, account):
+    start = time.perf_counter()
+    try:
+        run_operation(operation, account)
+        return time.perf_counter() - start, None
+    except Exception as e:
+        return time.perf_counter() - start, e
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def bench(simulator, brokerage, accounts, threads, rounds):
+    token_store = MemoryTokenStore()
+    created = [simulator.attach(create_account(brokerage, i, token_store)) for i in range(accounts)]
+    with ThreadPoolExecutor(max_workers=min(threads, accounts)) as executor:
+        for operation in OPERATIONS:
+            jobs = created * (1 if operation == "login" else rounds)
+            start = time.perf_counter()
+            results = list(executor.map(lambda account: timed(operation, account), jobs))
+            elapsed = time.perf_counter() - start
+            latencies = [latency for latency, _ in results]
+            errors = sum(1 for _, error in results if error is not None)
+            print(
+                f"{brokerage} {accounts:5d} accounts  {operation:13s} {len(jobs) / elapsed:9.0f} ops/s  "
+                f"p50 {statistics.median(latencies) * 1000:7.1f} ms  p99 {percentile(latencies, 0.99) * 1000:7.1f} ms"
+                + (f"  {errors} errors" if errors else "")
+            )
+    for account in created:
+        account.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--brokerage", nargs="+", default=["BSC", "CTS"], choices=["BSC", "CTS"])
+    parser.add_argument("--accounts", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--threads", type=int, default=64)
+    parser.add_argument("--rounds", type=int, default=3, help="calls per account of each operation but login")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated server latency, seconds")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with a 503")
+    parser.add_argument("--token-ttl", type=float, default=3600)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    with BrokerageSimulator(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                            token_ttl=args.token_ttl, seed=0) as simulator:
+        for brokerage in args.brokerage:
+            for accounts in args.accounts:
+                bench(simulator, brokerage, accounts, args.threads, args.rounds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Memory and construction time of 100k orders: plain dataclass vs slotted Order vs OrderBatch.
+
+    python benchmarks/bench_datatypes.py --orders 100000
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Literal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from trading_account.columnar import OrderBatch  # noqa: E402
+from trading_account.datatypes import Order  # noqa: E402
+
+
+@dataclass
+class DictOrder:
+    "Order as it was before __slots__"
+    symbol: str
+    quantity: float
+    trading_account_id: str
+    portfolio_proportion: float = 0
+    trade_type: Literal['buy', 'sell'] = 'sell'
+    order_type: Literal['LO', 'MP', 'ATO', 'ATC'] = 'LO'
+    price: float = 0
+    id: str = None
+    copy_from_order_id: str = None
+    avg_matched_price: float = 0
+    matched_quantity: float = 0
+    created_at: datetime = field(default_factory=datetime.now)
+    matched_at: datetime = None
+    type: Literal['market', 'limit'] = 'market'
+    status: Literal['placing', 'matched', 'cancelled', 'rejected'] = 'placing'
+    revived: bool = False
+
+
+SYMBOLS = ["FPT", "HPG", "VNM", "MWG", "SSI", "VCB", "TCB", "MBB", "VHM", "VIC"]
+
+
+def columns(n):
+    # Parsed API rows: fresh strings per row like json.loads produces
+    now = datetime.now().timestamp()
+    return {
+        "symbol": ["%s" % SYMBOLS[i % 10] for i in range(n)],
+        "quantity": [100 * (i % 50 + 1) for i in range(n)],
+        "trading_account_id": ["%06d" % (i % 2000) for i in range(n)],
+        "trade_type": ["buy" if i % 2 else "sell" for i in range(n)],
+        "price": [10.0 + i % 300 / 10 for i in range(n)],
+        "id": [str(1_000_000 + i) for i in range(n)],
+        "avg_matched_price": [10.0 + i % 300 / 10 for i in range(n)],
+        "matched_quantity": [100 * (i % 50) for i in range(n)],
+        "created_at": [datetime.fromtimestamp(now - i) for i in range(n)],
+        "status": ["matched" if i % 3 else "placing" for i in range(n)],
+    }
+
+
+def measure(label, build, n):
+    data = columns(n)
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build(data)
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del data
+    print(f"{label:<22} {elapsed * 1000:8.1f} ms  {current / 2 ** 20:8.1f} MiB  ({current / n:6.0f} B/order)")
+    return result
+
+
+def from_columns(cls):
+    def build(data):
+        names = list(data)
+        return [cls(**dict(zip(names, values))) for values in zip(*data.values())]
+    return build
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=100_000)
+    args = parser.parse_args()
+    n = args.orders
+    print(f"{n} orders, retained memory excludes the input columns")
+    measure("dataclass (__dict__)", from_columns(DictOrder), n)
+    orders = measure("Order (__slots__)", from_columns(Order), n)
+    batch = measure("OrderBatch", OrderBatch, n)
+
+    start = time.perf_counter()
+    OrderBatch.from_orders(orders)
+    print(f"{'Order -> OrderBatch':<22} {(time.perf_counter() - start) * 1000:8.1f} ms")
+    start = time.perf_counter()
+    batch.to_orders()
+    print(f"{'OrderBatch -> Order':<22} {(time.perf_counter() - start) * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Cold-start guard: time `import trading_account` in fresh interpreters.
+
+Fails (exit code 1) when the median import time exceeds --budget-ms or when a heavy dependency
+(pandas, sqlalchemy, aiohttp, a brokerage module...) is imported eagerly.
+
+    python benchmarks/bench_import.py --runs 20 --budget-ms 100
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Must not be loaded by a bare `import trading_account`
+LAZY_MODULES = [
+    "pandas",
+    "numpy",
+    "sqlalchemy",
+    "aiohttp",
+    "cachetools",
+    "common.database_connector",
+    "trading_account.bsc_trading_account",
+    "trading_account.cts_trading_account",
+    "trading_account.async_bsc_trading_account",
+    "trading_account.async_cts_trading_account",
+]
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import trading_account
+elapsed = time.perf_counter() - start
+print(json.dumps({"elapsed": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (LAZY_MODULES,)
+
+
+def run_once(env):
+    out = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--budget-ms", type=float, default=100.0)
+    args = parser.parse_args()
+
+    # No TOKEN_DB_* / BSC_* configuration: importing must not need it
+    env = {k: v for k, v in os.environ.items() if not k.startswith(("TOKEN_DB_", "BSC_"))}
+    results = [run_once(env) for _ in range(args.runs)]
+    times = sorted(r["elapsed"] * 1000 for r in results)
+    loaded = sorted({m for r in results for m in r["loaded"]})
+    median = statistics.median(times)
+    print(f"import trading_account: median {median:.1f} ms, min {times[0]:.1f} ms, max {times[-1]:.1f} ms "
+          f"over {args.runs} runs")
+
+    failed = False
+    if loaded:
+        print(f"FAIL: eagerly imported {', '.join(loaded)}")
+        failed = True
+    if median > args.budget_ms:
+        print(f"FAIL: median import time above the {args.budget_ms:.0f} ms budget")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Decoding and parsing time of ordersHistory (BSC) and findOrderByFilter (CTS) responses.
+
+Compares the stdlib json module with the jsonutil codec (orjson when installed), and parsing into a list of Order
+with parsing straight into an OrderBatch.
+
+    python benchmarks/bench_parse.py --rows 200 6400
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from trading_account import jsonutil  # noqa: E402
+from trading_account.bsc_trading_account import parse_orders as parse_bsc_orders  # noqa: E402
+from trading_account.cts_trading_account import parse_orders as parse_cts_orders  # noqa: E402
+
+SYMBOLS = ["FPT", "VNM", "HPG", "MWG", "VCB", "SSI", "TCB", "MSN"]
+
+
+def bsc_payload(rows) -> bytes:
+    return json.dumps({"s": "ok", "d": [
+        {"id": str(10000 + i), "instrument": SYMBOLS[i % len(SYMBOLS)], "qty": 100 * (1 + i % 5),
+         "side": "buy" if i % 2 else "sell", "type": "limit", "status": "filled" if i % 3 else "placing",
+         "avgPrice": 95000 + i, "lastModified": 1700000000 + i}
+        for i in range(rows)
+    ]}).encode()
+
+
+def cts_payload(rows) -> bytes:
+    return json.dumps({"errorCode": 0, "data": [
+        {"secCd": SYMBOLS[i % len(SYMBOLS)], "ordQty": 100, "ordType": "LO", "ordPrice": 95000, "orgOrderNo": i,
+         "matQty": 100 if i % 3 else 0, "matPriceAvg": 95000, "regDateTime": 1700000000000 + i,
+         "updDateTime": 1700000001000 + i, "extStatus": 5 if i % 3 else 2}
+        for i in range(rows)
+    ]}).encode()
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[200, 6400])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    print(f"jsonutil backend: {jsonutil.backend()}")
+    start_date = date(2023, 1, 1)
+    for rows in args.rows:
+        body = bsc_payload(rows)
+        data = jsonutil.loads(body)["d"]
+        cts_body = cts_payload(rows)
+        cts_rows = jsonutil.loads(cts_body)["data"]
+        trade_types = ["buy"] * len(cts_rows)
+        results = {
+            "decode ordersHistory, json": lambda: json.loads(body),
+            "decode ordersHistory, jsonutil": lambda: jsonutil.loads(body),
+            "parse ordersHistory -> [Order]": lambda: parse_bsc_orders(data, "acc", 1e9, start_date),
+            "parse ordersHistory -> OrderBatch": lambda: parse_bsc_orders(data, "acc", 1e9, start_date, "batch"),
+            "decode findOrderByFilter, json": lambda: json.loads(cts_body),
+            "decode findOrderByFilter, jsonutil": lambda: jsonutil.loads(cts_body),
+            "parse findOrderByFilter -> [Order]": lambda: parse_cts_orders(cts_rows, trade_types, "acc", 1e9),
+            "parse findOrderByFilter -> OrderBatch":
+                lambda: parse_cts_orders(cts_rows, trade_types, "acc", 1e9, "batch"),
+        }
+        print(f"\n{rows} rows, {len(body) / 1024:.0f} KiB")
+        for name, fn in results.items():
+            print(f"  {name:40s} {timed(fn, args.repeat):8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Time to rebalance N follower portfolios onto a master portfolio with trading_account.rebalance.
+
+    python benchmarks/bench_rebalance.py --followers 10000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from trading_account.columnar import PortfolioFrame  # noqa: E402
+from trading_account.datatypes import Portfolio, StockAllocation  # noqa: E402
+from trading_account.rebalance import rebalance  # noqa: E402
+
+SYMBOLS = [f"S{i:02d}" for i in range(40)]
+
+
+def random_portfolio(rng: random.Random, symbols, holdings) -> Portfolio:
+    allocations = []
+    for symbol in rng.sample(symbols, holdings):
+        quantity = rng.randrange(1, 50) * 100
+        price = 10 + SYMBOLS.index(symbol)
+        available = quantity - rng.choice([0, 0, 100])
+        allocations.append(StockAllocation(symbol, quantity, available, price, quantity * price))
+    cash = rng.uniform(1e4, 1e6)
+    return Portfolio(
+        total_cash=cash, total_loan=0, available_cash=cash * rng.uniform(0.5, 1), stock_allocations=allocations
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--followers", type=int, default=10000)
+    parser.add_argument("--holdings", type=int, default=8, help="stock allocations per follower")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    rng = random.Random(0)
+    master = random_portfolio(rng, SYMBOLS[:12], 10)
+    followers = {f"acc{i}": random_portfolio(rng, SYMBOLS, args.holdings) for i in range(args.followers)}
+    frame = PortfolioFrame.from_portfolios(followers)
+
+    for name, source in (("dict of Portfolio", followers), ("PortfolioFrame", frame)):
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            orders = rebalance(master, source, copy_from_order_id="master-1")
+            best = min(best, time.perf_counter() - start)
+        count = sum(len(v) for v in orders.values())
+        print(f"{args.followers} followers from {name:18s}: {best * 1000:7.1f} ms, {count} orders")
+
+
+if __name__ == "__main__":
+    main()
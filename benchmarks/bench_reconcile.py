@@ -0,0 +1,119 @@
+"""Reconciling copies of master orders on many followers: Reconciler vs the nested loop over each follower's orders.
+
+    python benchmarks/bench_reconcile.py --followers 1000 10000 --masters 5 50
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from trading_account.datatypes import Order  # noqa: E402
+from trading_account.reconciliation import Reconciler  # noqa: E402
+
+
+def make_orders(followers, masters, rng):
+    "Master orders, and per follower the broker listing of the day: copies (some lost, some partial) and other orders"
+    master_orders = [
+        Order(f"S{j:02d}", 10000, "MASTER", trade_type=rng.choice(("buy", "sell")), id=f"M{j}",
+              matched_quantity=10000, status="matched")
+        for j in range(masters)
+    ]
+    listings = {}
+    for i in range(followers):
+        account = f"F{i:05d}"
+        orders = []
+        for master in master_orders:
+            if rng.random() < 0.02:
+                continue # copy never placed
+            matched = 100 if rng.random() < 0.05 else 200
+            orders.append(Order(master.symbol, 200, account, trade_type=master.trade_type, id=f"{master.id}-{account}",
+                                copy_from_order_id=master.id, matched_quantity=matched,
+                                status="matched" if matched == 200 else "placing"))
+        orders += [Order("OTHER", 100, account, trade_type="buy", id=f"X-{account}-{k}") for k in range(5)]
+        listings[account] = orders
+    return master_orders, listings
+
+
+def nested_loop(master_orders, listings):
+    issues = []
+    for master in master_orders:
+        for account, orders in listings.items():
+            copies = [
+                order for order in orders
+                if order.copy_from_order_id == master.id and order.symbol == master.symbol
+                and order.trade_type == master.trade_type
+            ]
+            if not copies:
+                issues.append(("missing", master.id, account))
+            elif sum(order.matched_quantity for order in copies) < sum(order.quantity for order in copies):
+                issues.append(("partial", master.id, account))
+    return issues
+
+
+def issues(report):
+    return [("missing", s.master_order_id, s.trading_account_id) for s in report.missing] + \
+        [("partial", s.master_order_id, s.trading_account_id) for s in report.partial]
+
+
+def indexed(master_orders, listings):
+    reconciler = Reconciler()
+    for master in master_orders:
+        reconciler.expect(master, list(listings))
+    for orders in listings.values():
+        reconciler.update(orders)
+    return reconciler, issues(reconciler.report())
+
+
+def fill_some(listings, share, rng):
+    "Next snapshot: a share of the partially matched copies got filled, returns the changed orders"
+    changed = []
+    for orders in listings.values():
+        for k, order in enumerate(orders):
+            if order.copy_from_order_id and order.matched_quantity < order.quantity and rng.random() < share:
+                orders[k] = Order(order.symbol, order.quantity, order.trading_account_id, trade_type=order.trade_type,
+                                  id=order.id, copy_from_order_id=order.copy_from_order_id,
+                                  matched_quantity=order.quantity, status="matched")
+                changed.append(orders[k])
+    return changed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--followers", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--masters", type=int, default=5, help="master orders of the day")
+    parser.add_argument("--skip-nested", action="store_true", help="the nested loop is slow on large inputs")
+    args = parser.parse_args()
+    for followers in args.followers:
+        rng = random.Random(0)
+        master_orders, listings = make_orders(followers, args.masters, rng)
+        start = time.perf_counter()
+        reconciler, found = indexed(master_orders, listings)
+        elapsed = time.perf_counter() - start
+        line = f"{followers:6d} followers x {args.masters:3d} masters  full: Reconciler {elapsed * 1000:8.1f} ms"
+        if not args.skip_nested:
+            start = time.perf_counter()
+            expected = nested_loop(master_orders, listings)
+            line += f"  nested loop {(time.perf_counter() - start) * 1000:8.1f} ms"
+            assert sorted(found) == sorted(expected)
+        print(line + f"  {len(found)} issues")
+
+        # Next poll: only the orders that changed are fed to the Reconciler, the nested loop starts over
+        changed = fill_some(listings, 0.5, rng)
+        start = time.perf_counter()
+        reconciler.update(changed)
+        found = issues(reconciler.report())
+        elapsed = time.perf_counter() - start
+        line = f"{followers:6d} followers x {args.masters:3d} masters  next snapshot ({len(changed)} changed): " \
+            f"Reconciler {elapsed * 1000:8.1f} ms"
+        if not args.skip_nested:
+            start = time.perf_counter()
+            expected = nested_loop(master_orders, listings)
+            line += f"  nested loop {(time.perf_counter() - start) * 1000:8.1f} ms"
+            assert sorted(found) == sorted(expected)
+        print(line + f"  {len(found)} issues")
+
+if __name__ == "__main__":
+    main()
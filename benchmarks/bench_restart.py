@@ -0,0 +1,89 @@
+"""Restart time of a process managing many accounts: cold (every account logs in again) vs rehydrated from snapshots.
+
+    python benchmarks/bench_restart.py --brokerage BSC CTS --accounts 5000 --latency 0.05
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from simulator import BrokerageSimulator  # noqa: E402
+from trading_account.bsc_trading_account import BSCTradingAccount  # noqa: E402
+from trading_account.cts_trading_account import CTSTradingAccount  # noqa: E402
+from trading_account.factory import TradingAccountFactory  # noqa: E402
+from trading_account.snapshot_store import SnapshotStore  # noqa: E402
+from trading_account.token_store import MemoryTokenStore  # noqa: E402
+
+
+def make_factory(simulator, snapshot_store=None):
+    # A fresh token store each time: the restarted process only has what the snapshot kept
+    token_store = MemoryTokenStore()
+
+    def bsc(username, password, pin, trading_account_id):
+        return simulator.attach(BSCTradingAccount(username, password, pin, trading_account_id, client_id="client",
+                                                  client_secret="secret", url_callback="http://callback",
+                                                  token_store=token_store))
+
+    def cts(username, password, pin, trading_account_id):
+        return simulator.attach(CTSTradingAccount(username, password, pin, trading_account_id))
+
+    factory = TradingAccountFactory(max_pool_size=1 << 20, snapshot_store=snapshot_store)
+    factory.register_brokerage("BSC", bsc)
+    factory.register_brokerage("CTS", cts)
+    return factory
+
+
+def start(factory, specs, workers, prefetch):
+    started = time.perf_counter()
+    report = factory.rehydrate(specs, max_workers=workers, prefetch=prefetch)
+    return time.perf_counter() - started, report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--brokerage", nargs="+", default=["BSC", "CTS"], choices=["BSC", "CTS"])
+    parser.add_argument("--accounts", type=int, default=1000, help="per brokerage")
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.05, help="simulated server latency, seconds")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    path = os.path.join(tempfile.mkdtemp(), "snapshots.db")
+    with BrokerageSimulator(latency=args.latency, seed=0) as simulator:
+        for brokerage in args.brokerage:
+            specs = [
+                (brokerage, {"username": f"{brokerage}{i}", "password": "password", "pin": "123456",
+                             "trading_account_id": f"0001C{i:05d}"})
+                for i in range(args.accounts)
+            ]
+            # Cold start: log in and load the portfolio of every account, then save the snapshots as the running
+            # process would before shutting down
+            store = SnapshotStore(path)
+            factory = make_factory(simulator, store)
+            before = sum(simulator.requests.values())
+            elapsed, report = start(factory, specs, args.workers, prefetch=True)
+            requests = sum(simulator.requests.values()) - before
+            print(f"{brokerage} cold start of {args.accounts} accounts: {elapsed:7.2f}s  {requests:6d} requests  "
+                  f"{len(report.failed)} failed")
+            started = time.perf_counter()
+            saved = factory.save_snapshots()
+            print(f"{brokerage} saving {saved} snapshots: {(time.perf_counter() - started) * 1000:7.1f} ms  "
+                  f"{os.path.getsize(path) / 1024:.0f} KiB on disk")
+            factory.pool.clear()
+
+            factory = make_factory(simulator, SnapshotStore(path))
+            before = sum(simulator.requests.values())
+            # The portfolios come from the snapshots, nothing to prefetch
+            elapsed, report = start(factory, specs, args.workers, prefetch=False)
+            requests = sum(simulator.requests.values()) - before
+            print(f"{brokerage} rehydrated start:     {elapsed:7.2f}s  {requests:6d} requests  "
+                  f"{len(report.failed)} failed")
+            factory.pool.clear()
+
+
+if __name__ == "__main__":
+    main()
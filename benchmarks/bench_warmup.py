@@ -0,0 +1,71 @@
+"""Latency of the first order of each account, cold vs after warm_up, against the steady-state latency.
+
+    python benchmarks/bench_warmup.py --brokerage BSC CTS --accounts 100 --latency 0.02
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_brokerages import create_account, percentile  # noqa: E402
+from simulator import BrokerageSimulator  # noqa: E402
+from trading_account.datatypes import Order  # noqa: E402
+from trading_account.token_store import MemoryTokenStore  # noqa: E402
+from trading_account.warmup import warm_up  # noqa: E402
+
+
+def first_order(account):
+    # What a copy-trading fan-out does for each follower at the open
+    start = time.perf_counter()
+    account.get_current_portfolio()
+    account.place_order(Order(symbol="FPT", quantity=100, trading_account_id=account.trading_account_id,
+                              trade_type="buy", order_type="LO", price=95.0, type="limit"))
+    return time.perf_counter() - start
+
+
+def measure(accounts, threads):
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return list(executor.map(first_order, accounts))
+
+
+def report(label, latencies):
+    print(f"{label:28s} p50 {statistics.median(latencies) * 1000:7.1f} ms  "
+          f"p99 {percentile(latencies, 0.99) * 1000:7.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--brokerage", nargs="+", default=["BSC", "CTS"], choices=["BSC", "CTS"])
+    parser.add_argument("--accounts", type=int, default=100)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.02, help="simulated server latency, seconds")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    with BrokerageSimulator(latency=args.latency, seed=0) as simulator:
+        for brokerage in args.brokerage:
+            for warm in (False, True):
+                token_store = MemoryTokenStore()
+                accounts = [simulator.attach(create_account(brokerage, i, token_store)) for i in range(args.accounts)]
+                if warm:
+                    started = time.perf_counter()
+                    warmed = warm_up(accounts, max_workers=args.threads)
+                    print(f"{brokerage} warm_up of {args.accounts} accounts: {time.perf_counter() - started:.2f}s, "
+                          f"{len(warmed.failed)} failed")
+                report(f"{brokerage} first order, {'warm' if warm else 'cold'}", measure(accounts, args.threads))
+                if warm:
+                    # place_order dropped the cached portfolios, load them again as a running session would have
+                    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+                        list(executor.map(lambda account: account.get_current_portfolio(), accounts))
+                    report(f"{brokerage} steady state", measure(accounts, args.threads))
+                for account in accounts:
+                    account.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Throughput of WorkerRuntime with 1..N shard processes on a CPU-bound stand-in account.
+
+Each command parses an order-history sized JSON payload and runs the login regexes, the work that holds the
+GIL in the real clients, so a single process stops scaling long before the network does.
+
+    python benchmarks/bench_worker_runtime.py --accounts 64 --commands 2000
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from trading_account.base_trading_account import BaseTradingAccount  # noqa: E402
+from trading_account.worker_runtime import WorkerRuntime  # noqa: E402
+
+PAYLOAD = json.dumps({"d": [
+    {"id": str(i), "instrument": "FPT", "qty": 100, "side": "buy", "type": "limit", "status": "filled",
+     "avgPrice": 95000, "lastModified": 1700000000 + i}
+    for i in range(300)
+]})
+PAGE = '<input name="transactionID" value="abc"><input name="tokenID" value="def">' * 200
+
+
+class CPUBoundAccount(BaseTradingAccount):
+    def __init__(self, username, password=None, pin=None, trading_account_id=None):
+        super().__init__(username, password, pin, trading_account_id)
+
+    def place_order(self, order=None):
+        rows = json.loads(PAYLOAD)["d"]
+        re.findall('name="transactionID" value="(.+?)"', PAGE)
+        return sum(r["qty"] for r in rows)
+
+
+def run(processes, accounts, commands):
+    with WorkerRuntime(processes, brokerages={"FAKE": CPUBoundAccount}) as runtime:
+        keys = [runtime.add_account("FAKE", f"user{i}", f"acc{i}") for i in range(accounts)]
+        for key in keys: # warm up: create the accounts in their shards
+            runtime.place_order(key, None).result()
+        start = time.perf_counter()
+        futures = [runtime.place_order(keys[i % accounts], None) for i in range(commands)]
+        for future in futures:
+            future.result()
+        return commands / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--accounts", type=int, default=64)
+    parser.add_argument("--commands", type=int, default=2000)
+    parser.add_argument("--max-processes", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    baseline = None
+    processes = 1
+    while processes <= args.max_processes:
+        throughput = run(processes, args.accounts, args.commands)
+        baseline = baseline or throughput
+        print(f"{processes:3d} shards: {throughput:8.0f} commands/s  ({throughput / baseline:4.1f}x)")
+        processes *= 2
+
+
+if __name__ == "__main__":
+    main()
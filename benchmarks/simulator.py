@@ -0,0 +1,428 @@
+"""Local stand-in for the BSC and CTS APIs, to run the clients and benchmarks offline.
+
+Implements the endpoints the clients call: the BSC OAuth/HTML login flow, /accounts, /accounts/*/state, positions,
+ordersHistory and orders, and CTS third-party login/refresh-token, generateSmartOtp, submitOrder, cancelOrder,
+findOrderByFilter and inquiryAccountCashSec. Any username logs in, except with password "wrong". Accounts start with
+cash and no positions; orders fill at their limit price with probability fill_rate.
+
+    with BrokerageSimulator(latency=0.02, error_rate=0.01, token_ttl=300) as simulator:
+        account = BSCTradingAccount("user", "pass", "123456", "0001C00001", client_id="id", client_secret="secret",
+                                    url_callback="http://cb", token_store=MemoryTokenStore())
+        simulator.attach(account)
+        account.get_current_portfolio()
+"""
+import itertools
+import json
+import random
+import secrets
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+INITIAL_CASH = 1_000_000_000 # VND
+BSC_PREFIX = "/bsc"
+CTS_PREFIX = "/cts"
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024 # thousands of accounts connect at once, the default backlog of 5 resets them
+
+
+class SimulatedAccount:
+    def __init__(self, account_id, cash=INITIAL_CASH):
+        self.account_id = account_id
+        self.cash = cash # VND
+        self.positions = {} # symbol -> [quantity, average price in VND]
+        self.orders = [] # dicts, oldest first
+        self.lock = threading.Lock()
+
+    def fill(self, side, symbol, quantity, price):
+        # Must hold self.lock. price in VND
+        position = self.positions.setdefault(symbol, [0, 0.0])
+        if side == "buy":
+            cost = quantity * position[1] + quantity * price
+            position[0] += quantity
+            position[1] = cost / position[0] if position[0] else 0.0
+            self.cash -= quantity * price
+        else:
+            position[0] -= quantity
+            self.cash += quantity * price
+
+
+class BrokerageSimulator:
+    """Threaded HTTP server answering like BSC (under /bsc) and CTS (under /cts).
+
+    latency (+ uniform jitter) is slept before every answer, error_rate answers 503 (retried by the clients),
+    token_ttl is the access token lifetime in seconds (expired tokens get 401), reject_rate rejects placed orders.
+    """
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, token_ttl=3600, refresh_ttl=86400, reject_rate=0.0,
+                 fill_rate=1.0, price=20.0, host="127.0.0.1", port=0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.token_ttl = token_ttl
+        self.refresh_ttl = refresh_ttl
+        self.reject_rate = reject_rate
+        self.fill_rate = fill_rate
+        self.price = price # ĐVT: Nghìn đồng, used when an order has no price
+        self.random = random.Random(seed)
+        self.accounts = {} # account id -> SimulatedAccount
+        self.logins = {} # username -> account ids
+        self.tokens = {} # access token -> (username, expires at)
+        self.refresh_tokens = {} # refresh token -> (username, expires at)
+        self.codes = {} # OAuth code / transaction id -> username
+        self.requests = Counter() # (method, route) -> count
+        self.order_ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.server = _Server((host, port), self._handler())
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True, name="brokerage-simulator")
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def attach(self, account):
+        "Point a (sync or async) BSC/CTS client at this simulator"
+        if account.brokerage == "BSC":
+            account.sso_server = f"{self.url}{BSC_PREFIX}/sso"
+            account.trading_server = f"{self.url}{BSC_PREFIX}"
+        elif account.brokerage == "CTS":
+            account.auth_server = f"{self.url}{CTS_PREFIX}/auth"
+            account.trading_server = f"{self.url}{CTS_PREFIX}"
+        else:
+            raise ValueError(f"No simulated brokerage for {account!r}")
+        return account
+
+    def account(self, account_id) -> SimulatedAccount:
+        with self.lock:
+            account = self.accounts.get(account_id)
+            if account is None:
+                account = self.accounts[account_id] = SimulatedAccount(account_id)
+            return account
+
+    # Tokens
+
+    def issue_tokens(self, username) -> dict:
+        access_token, refresh_token = secrets.token_hex(16), secrets.token_hex(16)
+        now = time.time()
+        with self.lock:
+            self.tokens[access_token] = (username, now + self.token_ttl)
+            self.refresh_tokens[refresh_token] = (username, now + self.refresh_ttl)
+        return {
+            "access_token": access_token,
+            "refresh_token": refresh_token,
+            "token_type": "bearer",
+            "expires_in": self.token_ttl,
+            "refresh_expires_in": self.refresh_ttl,
+            "session_state": secrets.token_hex(8),
+        }
+
+    def expire_tokens(self):
+        "Revoke every access token, the next request of each client gets a 401"
+        with self.lock:
+            self.tokens.clear()
+
+    def refresh(self, refresh_token):
+        with self.lock:
+            username, expires_at = self.refresh_tokens.pop(refresh_token, (None, 0))
+        return self.issue_tokens(username) if expires_at > time.time() else None
+
+    def authorized(self, headers):
+        "Username of a valid bearer token, else None"
+        token = (headers.get("Authorization") or "").rpartition(" ")[2]
+        username, expires_at = self.tokens.get(token, (None, 0))
+        return username if expires_at > time.time() else None
+
+    # Orders
+
+    def place(self, account_id, side, symbol, quantity, price) -> dict:
+        "price in VND"
+        account = self.account(account_id)
+        order = {
+            "id": str(next(self.order_ids)), "symbol": symbol, "side": side, "qty": quantity, "price": price,
+            "status": "placing", "created": time.time(), "updated": time.time(),
+        }
+        if self.random.random() < self.reject_rate:
+            return None
+        with account.lock:
+            if self.random.random() < self.fill_rate:
+                order["status"] = "filled"
+                account.fill(side, symbol, quantity, price)
+            account.orders.append(order)
+        return order
+
+    def cancel(self, account_id, order_id) -> bool:
+        account = self.account(account_id)
+        with account.lock:
+            for order in account.orders:
+                if order["id"] == str(order_id) and order["status"] == "placing":
+                    order["status"] = "cancelled"
+                    order["updated"] = time.time()
+                    return True
+        return False
+
+    def _handler(self):
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # keep-alive, as with the real servers
+            disable_nagle_algorithm = True # headers and body are written separately
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self.dispatch()
+
+            do_POST = do_DELETE = do_PUT = do_GET
+
+            def dispatch(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                self.body = self.rfile.read(length) if length else b""
+                parts = urlsplit(self.path)
+                self.query = {k: v[-1] for k, v in parse_qs(parts.query, keep_blank_values=True).items()}
+                delay = simulator.latency + simulator.random.uniform(0, simulator.jitter)
+                if delay:
+                    time.sleep(delay)
+                if simulator.random.random() < simulator.error_rate:
+                    return self.reply(503, {"message": "Simulated outage"})
+                if parts.path.startswith(BSC_PREFIX):
+                    route = bsc_route(self, parts.path[len(BSC_PREFIX):])
+                elif parts.path.startswith(CTS_PREFIX):
+                    route = cts_route(self, parts.path[len(CTS_PREFIX):])
+                else:
+                    route = None
+                with simulator.lock:
+                    simulator.requests[(self.command, route or parts.path)] += 1
+                if route is None:
+                    self.reply(404, {"message": "Not found"})
+
+            def form(self) -> dict:
+                content_type = self.headers.get("Content-Type") or ""
+                if "json" in content_type or self.body[:1] == b"{":
+                    return json.loads(self.body or b"{}")
+                return {k: v[-1] for k, v in parse_qs(self.body.decode()).items()}
+
+            def reply(self, status, payload=None, content_type="application/json", headers=()):
+                body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def html(self, text):
+                self.reply(200, text.encode(), "text/html; charset=utf-8")
+
+        def bsc_route(handler, path):
+            method = handler.command
+            segments = path.strip("/").split("/")
+            if path == "/sso/oauth/authorize":
+                if method == "GET":
+                    handler.html('<form method="post"><input name="username"><input name="password"></form>')
+                    return path
+                form = handler.form()
+                if "username" in form:
+                    if form.get("password") == "wrong":
+                        handler.html("<p>Invalid username or password</p>")
+                        return path
+                    transaction_id = secrets.token_hex(8)
+                    with simulator.lock:
+                        simulator.codes[transaction_id] = form["username"]
+                    handler.html(
+                        f'<form method="post">\n<input type="hidden" name="transactionID" value="{transaction_id}">\n'
+                        f'<input type="hidden" name="tokenID" value="{secrets.token_hex(8)}">\n</form>'
+                    )
+                    return path
+                with simulator.lock:
+                    username = simulator.codes.pop(form.get("transactionID"), None)
+                    decision_id = secrets.token_hex(8)
+                    simulator.codes[decision_id] = username
+                if username is None:
+                    handler.html("<p>Invalid OTP</p>")
+                    return path
+                handler.html(
+                    f'<form action="decision" method="post">\n'
+                    f'<input type="hidden" name="transaction_id" id="transaction_id" value="{decision_id}">\n</form>'
+                )
+                return path
+            if path == "/sso/oauth/authorize/decision":
+                with simulator.lock:
+                    username = simulator.codes.pop(handler.form().get("transaction_id"), None)
+                    code = secrets.token_hex(8)
+                    simulator.codes[code] = username
+                handler.reply(302, {}, headers=[("Location", f"http://callback/?code={code}")])
+                return path
+            if path == "/sso/oauth/token":
+                form = handler.form()
+                if form.get("grant_type") == "refresh_token":
+                    tokens = simulator.refresh(form.get("refresh_token"))
+                else:
+                    with simulator.lock:
+                        username = simulator.codes.pop(form.get("code"), None)
+                    tokens = simulator.issue_tokens(username) if username else None
+                if tokens is None:
+                    handler.reply(400, {"error": "invalid_grant"})
+                else:
+                    handler.reply(200, tokens)
+                return path
+            username = simulator.authorized(handler.headers)
+            if username is None:
+                handler.reply(401, {"s": "error", "errmsg": "Unauthorized"})
+                return "/".join(["", *segments[:1], *["*"] * (len(segments) > 1), *segments[2:3]])
+            if segments == ["accounts"]:
+                with simulator.lock:
+                    account_ids = simulator.logins.setdefault(username, [f"{username}-1"])
+                handler.reply(200, {"s": "ok", "d": [{"id": account_id} for account_id in account_ids]})
+                return path
+            if len(segments) < 3 or segments[0] != "accounts":
+                return None
+            account = simulator.account(segments[1])
+            route = "/accounts/*/" + segments[2]
+            if segments[2] == "state":
+                with account.lock:
+                    state = {"balance": account.cash, "amData": [[[0]], [[0]], [[0]]]}
+                handler.reply(200, {"s": "ok", "d": state})
+            elif segments[2] == "positions":
+                with account.lock:
+                    positions = [
+                        {"instrument": symbol, "qty": quantity, "avgPrice": price, "unrealizedPl": 0,
+                         "customFields": [{"id": "1000", "value": 0}]}
+                        for symbol, (quantity, price) in account.positions.items() if quantity
+                    ]
+                handler.reply(200, {"s": "ok", "d": positions})
+            elif segments[2] == "ordersHistory":
+                max_count = int(handler.query.get("maxCount") or 200)
+                with account.lock:
+                    rows = [
+                        {"id": order["id"], "instrument": order["symbol"], "qty": order["qty"], "side": order["side"],
+                         "type": "limit", "status": order["status"], "avgPrice": order["price"],
+                         "lastModified": int(order["updated"])}
+                        for order in reversed(account.orders[-max_count:])
+                    ]
+                handler.reply(200, {"s": "ok", "d": rows})
+            elif segments[2] == "orders" and method == "POST":
+                form = handler.form()
+                order = simulator.place(
+                    account.account_id, form.get("side"), form.get("instrument"), int(float(form.get("qty") or 0)),
+                    float(form.get("limitPrice") or simulator.price * 1000),
+                )
+                if order is None:
+                    handler.reply(200, {"s": "error", "errmsg": "Simulated rejection"})
+                else:
+                    handler.reply(200, {"s": "ok", "d": {"orderid": order["id"]}})
+            elif segments[2] == "orders" and method == "DELETE" and len(segments) == 4:
+                route += "/*"
+                if simulator.cancel(account.account_id, segments[3]):
+                    handler.reply(200, {"s": "ok"})
+                else:
+                    handler.reply(200, {"s": "error", "errmsg": "Order cannot be cancelled"})
+            else:
+                return None
+            return route
+
+        def cts_route(handler, path):
+            if path == "/auth/api/third-party/login":
+                form = handler.form()
+                if form.get("password") == "wrong":
+                    handler.reply(400, {"errorCode": 400, "message": "Invalid credential"})
+                else:
+                    tokens = simulator.issue_tokens(form["username"])
+                    handler.reply(200, {"errorCode": 0, "message": "", "data": tokens})
+                return path
+            if path == "/auth/api/third-party/refresh-token":
+                tokens = simulator.refresh(handler.form().get("refresh_token"))
+                if tokens is None:
+                    handler.reply(400, {"errorCode": 400, "message": "Invalid refresh token"})
+                else:
+                    handler.reply(200, {"errorCode": 0, "message": "", "data": tokens})
+                return path
+            if simulator.authorized(handler.headers) is None:
+                handler.reply(401, {"statusCode": 401, "message": "Unauthorized"})
+                return path
+            account_id = handler.headers.get("subAccoNo")
+            if path == "/api/generateSmartOtp":
+                otp = f"{secrets.randbelow(10 ** 6):06d}"
+                handler.reply(200, {"statusCode": 0, "message": "", "data": {"otp": otp}})
+            elif path == "/api/submitOrder":
+                form = handler.form()
+                order = simulator.place(
+                    form.get("subAccoNo") or account_id, "buy" if form.get("tradeType") == 2 else "sell",
+                    form.get("secCd"), int(form.get("order_qty") or 0),
+                    float(form.get("order_price") or simulator.price) * 1000,
+                )
+                if order is None:
+                    handler.reply(200, {"statusCode": 1, "message": "Simulated rejection"})
+                else:
+                    handler.reply(200, {"statusCode": 0, "message": "", "data": {"orgOrderNo": int(order["id"])}})
+            elif path == "/api/cancelOrder":
+                if simulator.cancel(account_id, handler.form().get("orgOrderNo")):
+                    handler.reply(200, {"statusCode": 0, "message": ""})
+                else:
+                    handler.reply(200, {"statusCode": 1, "message": "Order cannot be cancelled"})
+            elif path == "/api/findOrderByFilter":
+                side = "buy" if handler.query.get("tradeType") == "2" else "sell"
+                account = simulator.account(account_id)
+                status = {"filled": 5, "cancelled": 7, "placing": 2}
+                with account.lock:
+                    rows = [
+                        {"secCd": order["symbol"], "ordQty": order["qty"], "ordType": "LO",
+                         "ordPrice": order["price"] / 1000, "orgOrderNo": int(order["id"]),
+                         "matQty": order["qty"] if order["status"] == "filled" else 0,
+                         "matPriceAvg": order["price"] / 1000, "regDateTime": int(order["created"] * 1000),
+                         "updDateTime": int(order["updated"] * 1000), "extStatus": status[order["status"]]}
+                        for order in account.orders if order["side"] == side
+                    ]
+                handler.reply(200, {"statusCode": 0, "message": "", "data": rows})
+            elif path == "/api/inquiryAccountCashSec":
+                account = simulator.account(handler.query.get("subAccoNo") or account_id)
+                with account.lock:
+                    data = {
+                        "casAmt": account.cash, "paymentTotal": 0, "buyingPower": account.cash,
+                        "secBalanceData2": [
+                            {"secCode": symbol, "total": quantity, "pendingReceive": 0, "availSale": quantity,
+                             "currentPrice": price}
+                            for symbol, (quantity, price) in account.positions.items() if quantity
+                        ],
+                    }
+                handler.reply(200, {"statusCode": 0, "message": "", "data": data})
+            else:
+                return None
+            return path
+
+        return Handler
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--token-ttl", type=float, default=3600)
+    args = parser.parse_args()
+    simulator = BrokerageSimulator(latency=args.latency, error_rate=args.error_rate, token_ttl=args.token_ttl,
+                                   port=args.port)
+    print(f"BSC: {simulator.url}{BSC_PREFIX}  CTS: {simulator.url}{CTS_PREFIX}")
+    simulator.server.serve_forever()
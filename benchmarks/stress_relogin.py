@@ -0,0 +1,101 @@
+"""N threads (or coroutines) sharing one account hit an expired token at once, and must cause a single re-login.
+
+    python benchmarks/stress_relogin.py --brokerage BSC CTS --callers 50 --latency 0.02
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from simulator import BrokerageSimulator  # noqa: E402
+from trading_account.async_bsc_trading_account import AsyncBSCTradingAccount  # noqa: E402
+from trading_account.async_cts_trading_account import AsyncCTSTradingAccount  # noqa: E402
+from trading_account.bsc_trading_account import BSCTradingAccount  # noqa: E402
+from trading_account.cts_trading_account import CTSTradingAccount  # noqa: E402
+from trading_account.token_store import MemoryTokenStore  # noqa: E402
+
+# Requests that issue a new token
+LOGIN_ROUTES = {
+    "BSC": [("POST", "/sso/oauth/token")],
+    "CTS": [("POST", "/auth/api/third-party/login"), ("POST", "/auth/api/third-party/refresh-token")],
+}
+
+
+def create_account(brokerage, asynchronous):
+    if brokerage == "BSC":
+        cls = AsyncBSCTradingAccount if asynchronous else BSCTradingAccount
+        return cls("user", "password", "123456", "0001C00001", client_id="client", client_secret="secret",
+                   url_callback="http://callback", token_store=MemoryTokenStore())
+    cls = AsyncCTSTradingAccount if asynchronous else CTSTradingAccount
+    return cls("user", "password", "123456", "0001C00001")
+
+
+def logins(simulator, brokerage):
+    return sum(simulator.requests[route] for route in LOGIN_ROUTES[brokerage])
+
+
+def stress(simulator, brokerage, callers):
+    account = simulator.attach(create_account(brokerage, asynchronous=False))
+    account.login()
+    account.fetch_current_portfolio()
+    simulator.expire_tokens()
+    before = logins(simulator, brokerage)
+    barrier = threading.Barrier(callers)
+
+    def call(_):
+        barrier.wait()
+        return account.fetch_current_portfolio()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=callers) as executor:
+        results = list(executor.map(call, range(callers)))
+    elapsed = time.perf_counter() - start
+    account.close()
+    return len(results), logins(simulator, brokerage) - before, elapsed
+
+
+async def async_stress(simulator, brokerage, callers):
+    account = simulator.attach(create_account(brokerage, asynchronous=True))
+    try:
+        await account.login()
+        await account.fetch_current_portfolio()
+        simulator.expire_tokens()
+        before = logins(simulator, brokerage)
+        start = time.perf_counter()
+        results = await asyncio.gather(*[account.fetch_current_portfolio() for _ in range(callers)])
+        elapsed = time.perf_counter() - start
+    finally:
+        await account.close()
+    return len(results), logins(simulator, brokerage) - before, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--brokerage", nargs="+", default=["BSC", "CTS"], choices=["BSC", "CTS"])
+    parser.add_argument("--callers", type=int, default=50, help="threads / coroutines sharing the account")
+    parser.add_argument("--latency", type=float, default=0.02, help="simulated server latency, seconds")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    failed = False
+    with BrokerageSimulator(latency=args.latency, seed=0) as simulator:
+        for brokerage in args.brokerage:
+            for mode in ("threads", "asyncio"):
+                if mode == "threads":
+                    calls, relogins, elapsed = stress(simulator, brokerage, args.callers)
+                else:
+                    calls, relogins, elapsed = asyncio.run(async_stress(simulator, brokerage, args.callers))
+                failed |= relogins != 1
+                print(f"{brokerage} {mode:8s} {calls:4d} callers after expiry  {relogins} re-login(s)  "
+                      f"{elapsed * 1000:7.1f} ms" + ("" if relogins == 1 else "  FAILED, expected 1"))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import threading
+import time
+
+from trading_account.base_trading_account import BaseTradingAccount
+from trading_account.copy_trading import fan_out
+from trading_account.datatypes import Order, Portfolio
+
+
+class SlowFollower(BaseTradingAccount):
+    brokerage = "TEST"
+
+    def __init__(self, i, delay):
+        super().__init__(f"user{i}", None, None, f"F{i:03d}")
+        self.delay = delay
+        self.placed = []
+
+    def place_order(self, order, *args, **kwargs):
+        time.sleep(self.delay)
+        order.id = f"{self.trading_account_id}-1"
+        self.placed.append(order)
+        return order
+
+
+def test_fan_out_timeout_does_not_place_queued_copies():
+    followers = [SlowFollower(i, delay=0.02) for i in range(200)]
+    portfolio = Portfolio(total_cash=1e6, total_loan=0, available_cash=1e6, stock_allocations=[])
+    master = Order("FPT", 1000, "MASTER", portfolio_proportion=0.1, trade_type="buy", price=95.0, id="M1")
+    saved = []
+
+    class Store:
+        def save_many(self, orders):
+            saved.extend(orders)
+
+    results = fan_out(master, followers, portfolios={f.trading_account_id: portfolio for f in followers},
+                      timeout=0.05, order_store=Store())
+    # Let the copies that were already running finish
+    deadline = time.monotonic() + 5
+    while threading.active_count() > 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    not_sent = [r for r in results if r.error is not None and "not sent" in str(r.error)]
+    unknown = [r for r in results if r.error is not None and "state unknown" in str(r.error)]
+    placed = {r.trading_account_id for r in results if r.order is not None}
+    assert not_sent, "followers still queued at the timeout must be reported as not sent"
+    assert len(not_sent) + len(unknown) + len(placed) == len(followers)
+    by_id = {f.trading_account_id: f for f in followers}
+    # A copy reported as not sent never reaches the broker
+    assert all(not by_id[r.trading_account_id].placed for r in not_sent)
+    # Every copy reported as placed was saved
+    assert {order.trading_account_id for order in saved} == placed
@@ -0,0 +1,37 @@
+import json
+
+from trading_account.cts_trading_account import CTSTradingAccount, submit_order_payload
+from trading_account.datatypes import Order
+
+
+class Response:
+    status_code = 200
+
+    def __init__(self, body):
+        self.content = json.dumps(body).encode()
+
+
+class FakeCTSAccount(CTSTradingAccount):
+    def request(self, method, url, **kwargs):
+        if url.endswith("/third-party/login"):
+            tokens = {"access_token": "t2", "refresh_token": "r2", "session_state": "s2", "expires_in": 300}
+            return Response({"errorCode": 0, "message": "", "data": tokens})
+        if url.endswith("/generateSmartOtp"):
+            self.otp_headers = kwargs["headers"]
+            # Another thread building an order payload while the OTP of the new session is generated
+            self.payload_during_login = json.loads(submit_order_payload(self, Order("FPT", 100, "A1"), 2))
+            return Response({"statusCode": 0, "data": {"otp": "otp2"}})
+        raise AssertionError(url)
+
+
+def test_payloads_never_mix_a_new_session_with_an_old_otp():
+    account = FakeCTSAccount("user", "password", "123456", "A1")
+    account.restore_session({"access_token": "t1", "refresh_token": "r1", "session_state": "s1", "smart_otp": "otp1"})
+    account.login()
+
+    assert account.otp_headers["Authorization"] == "Bearer t2"
+    during = account.payload_during_login
+    assert (during["sessionId"], during["otp"]) == ("s1", "otp1")
+    after = json.loads(submit_order_payload(account, Order("FPT", 100, "A1"), 2))
+    assert (after["sessionId"], after["otp"]) == ("s2", "otp2")
+    assert account.session.headers["Authorization"] == "Bearer t2"
@@ -0,0 +1,39 @@
+import asyncio
+
+from trading_account.factory import TradingAccountFactory
+
+
+class FakeAsyncAccount:
+    brokerage = "TEST"
+    created = []
+
+    def __init__(self, username, trading_account_id=None):
+        self.username = username
+        self.trading_account_id = trading_account_id
+        self.logins = 0
+        self.closed = False
+        FakeAsyncAccount.created.append(self)
+
+    async def ensure_session(self):
+        if not self.logins:
+            await asyncio.sleep(0.01)
+            self.logins += 1
+
+    async def close(self):
+        self.closed = True
+
+
+def test_concurrent_async_checkouts_share_one_account():
+    FakeAsyncAccount.created = []
+    factory = TradingAccountFactory()
+    factory.register_brokerage("TEST", FakeAsyncAccount)
+
+    async def main():
+        return await asyncio.gather(*[
+            factory.aget_pooled_trading_account("TEST", username="user", trading_account_id="A1") for _ in range(10)
+        ])
+
+    accounts = asyncio.run(main())
+    assert len(FakeAsyncAccount.created) == 1
+    assert all(account is accounts[0] for account in accounts)
+    assert not accounts[0].closed
@@ -0,0 +1,10 @@
+import requests
+
+from trading_account.metrics import body_size
+
+
+def test_body_size_matches_the_encoded_request_body():
+    for data in ({"username": "user", "password": "mật khẩu"}, [("a", "1"), ("a", "2")], "x=ố", b"{}"):
+        body = requests.Request("POST", "http://localhost/login", data=data).prepare().body
+        assert body_size(data) == len(body.encode() if isinstance(body, str) else body)
+    assert body_size(None) == 0
@@ -0,0 +1,38 @@
+from trading_account.datatypes import Order
+from trading_account.order_store import SQLiteOrderStore, WriteBehindOrderStore
+
+
+def rejected(symbol):
+    return Order(symbol, 100, "A1", status="rejected", reject_reason="Not enough cash")
+
+
+def test_id_less_orders_in_one_batch_keep_their_rows():
+    store = SQLiteOrderStore()
+    store.save_many([rejected("AAA"), rejected("BBB")])
+    assert sorted(order.symbol for order in store.load("A1")) == ["AAA", "BBB"]
+
+
+def test_order_saved_again_with_its_id_updates_its_row():
+    store = SQLiteOrderStore()
+    order = Order("FPT", 100, "A1")
+    store.save(order)
+    order.id = "1"
+    order.status = "matched"
+    store.save(order)
+    assert [(o.id, o.status) for o in store.load("A1")] == [("1", "matched")]
+
+
+def test_write_behind_merges_saves_without_losing_or_duplicating_rows():
+    store = WriteBehindOrderStore(SQLiteOrderStore(), flush_interval=1)
+    order = Order("FPT", 100, "A1")
+    store.save(order)
+    store.save(rejected("AAA"))
+    store.save(rejected("BBB"))
+    order.id = "1"
+    store.save(order)
+    # The four saves are written in one batch
+    store.flush()
+    try:
+        assert sorted((o.symbol, o.id) for o in store.load("A1")) == [("AAA", None), ("BBB", None), ("FPT", "1")]
+    finally:
+        store.close()
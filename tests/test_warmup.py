@@ -0,0 +1,54 @@
+import time
+from datetime import datetime, timedelta
+
+from trading_account.base_trading_account import BaseTradingAccount
+from trading_account.datatypes import Portfolio
+from trading_account.factory import TradingAccountFactory
+from trading_account.warmup import warm_up
+
+
+class FakeAccount(BaseTradingAccount):
+    brokerage = "TEST"
+
+    def __init__(self, username, trading_account_id=None):
+        super().__init__(username, None, None, trading_account_id)
+        self.fetches = 0
+        self.pings = 0
+
+    def fetch_current_portfolio(self):
+        self.fetches += 1
+        return Portfolio(total_cash=0, total_loan=0, available_cash=0, stock_allocations=[])
+
+    def ping(self):
+        self.pings += 1
+
+
+def make_factory(**kwargs):
+    factory = TradingAccountFactory(**kwargs)
+    factory.register_brokerage("TEST", FakeAccount)
+    return factory
+
+
+def specs(count):
+    return [("TEST", {"username": f"user{i}", "trading_account_id": f"A{i}"}) for i in range(count)]
+
+
+def test_warm_up_grows_the_pool_to_hold_every_spec():
+    factory = make_factory(max_pool_size=10)
+    report = warm_up(specs(30), factory=factory)
+    assert len(report.warmed) == 30
+    assert len(factory.pool) == 30
+
+
+def test_keep_alive_pings_cheaply_and_keeps_accounts_pooled():
+    factory = make_factory(idle_timeout=0.3)
+    report = warm_up(specs(5), factory=factory, until=datetime.now() + timedelta(seconds=2), keep_alive_interval=0.1)
+    try:
+        time.sleep(0.8)
+        assert factory.pool.evict_idle() == 0
+        assert len(factory.pool) == 5
+        assert all(account.pings > 0 for account in report.warmed)
+        # The portfolio is only fetched by the prefetch
+        assert all(account.fetches == 1 for account in report.warmed)
+    finally:
+        report.keep_alive.stop()
@@ -0,0 +1,20 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_default_order_store_is_flushed_at_exit(tmp_path):
+    path = tmp_path / "orders.db"
+    script = textwrap.dedent("""
+        from trading_account.datatypes import Order
+        Order.create_table()
+        Order("FPT", 100, "A1", id="1").upsert()
+    """)
+    env = {**os.environ, "ORDER_DB_URI": f"sqlite:///{path}", "PYTHONPATH": ROOT}
+    subprocess.run([sys.executable, "-c", script], env=env, check=True, timeout=60)
+
+    from trading_account.order_store import SQLiteOrderStore
+    assert [order.id for order in SQLiteOrderStore(str(path)).load("A1")] == ["1"]
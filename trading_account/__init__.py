@@ -1 +1 @@
-from .factory import trading_account_factory
\ No newline at end of file
+from .factory import trading_account_factory, async_trading_account_factory
\ No newline at end of file
@@ -0,0 +1,260 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import List
+from datetime import date, datetime, timedelta
+
+import aiohttp
+from requests.exceptions import RetryError
+
+from .base_trading_account import DEFAULT_HEADERS, RETRY_TOTAL, RETRY_BACKOFF_FACTOR, RETRY_STATUS_FORCELIST, \
+    BATCH_CONCURRENCY, placed_result, cancelled_result, error_result, timeout_result
+from .datatypes import Portfolio, Order, OrderResult
+from .cache import SnapshotCache
+from .order_sync import OrderSyncState
+from .rate_limit import rate_limiter, request_priority
+from .jsonutil import loads
+from .metrics import get_exporter, record_request, RELOGINS, LOGIN_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Same as urllib3's Retry.DEFAULT_ALLOWED_METHODS: only these are retried on a bad status or a read error
+RETRY_ALLOWED_METHODS = frozenset(["HEAD", "GET", "PUT", "DELETE", "OPTIONS", "TRACE"])
+
+
+class AsyncResponse:
+    "Buffered response exposing the subset of requests.Response used by the brokerage clients"
+    def __init__(self, status_code, headers, url, content, encoding=None) -> None:
+        self.status_code = status_code
+        self.headers = headers
+        self.url = url
+        self.content = content
+        self.encoding = encoding or "utf-8"
+        self.retries = 0 # attempts that failed before this response
+        self._json = None
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding, errors="replace")
+
+    def json(self):
+        # Parsed once, however many times the client reads it
+        if self._json is None:
+            self._json = loads(self.content)
+        return self._json
+
+
+def _backoff(errors: int) -> float:
+    # urllib3: no sleep before the first retry, then backoff_factor * 2 ** (errors - 1)
+    if errors <= 1:
+        return 0
+    return RETRY_BACKOFF_FACTOR * (2 ** (errors - 1))
+
+
+class AsyncBaseTradingAccount:
+    brokerage = None # metrics label
+    def __init__(self, username, password, pin, trading_account_id, session: aiohttp.ClientSession = None) -> None:
+        self.username = username
+        self.password = password
+        self.pin = pin
+        self.trading_account_id = trading_account_id # Mã tiểu khoản sử dụng để giao dịch
+        self.headers = dict(DEFAULT_HEADERS)
+        # A ClientSession must be created inside a running event loop, so it is opened lazily.
+        # Passing a shared session lets many accounts reuse one connection pool.
+        self._session = session
+        self._owns_session = session is None
+        self.portfolio_cache = SnapshotCache() # Invalidated by place_order/cancel_order
+        self.order_sync = OrderSyncState() # Watermark for sync_orders
+        self.rate_limiter = rate_limiter # Shared per brokerage host, None disables it
+        # Same single-flight login as BaseTradingAccount, for the coroutines sharing this account
+        self._login_lock = None
+        self.login_generation = 0
+        self._login_owner = None # task holding login_guard()
+
+    @property
+    def login_lock(self) -> asyncio.Lock:
+        # Created on first use, inside the running event loop
+        if self._login_lock is None:
+            self._login_lock = asyncio.Lock()
+        return self._login_lock
+
+    async def login(self, smart_otp=False):
+        raise NotImplementedError
+
+    async def place_order(self, order: Order, *args, **kwargs) -> Order:
+        raise NotImplementedError
+
+    async def cancel_order(self, *args, **kwargs) -> bool:
+        raise NotImplementedError
+
+    async def place_orders(self, orders: List[Order], timeout: float = None,
+                           max_concurrency=BATCH_CONCURRENCY) -> List[OrderResult]:
+        "BaseTradingAccount.place_orders on the event loop"
+        async def send(order):
+            return placed_result(await self.place_order(order))
+        return await self._dispatch(orders, send, timeout, max_concurrency)
+
+    async def cancel_orders(self, orders: List[Order], timeout: float = None,
+                            max_concurrency=BATCH_CONCURRENCY) -> List[OrderResult]:
+        async def send(order):
+            return cancelled_result(order, await self.cancel_order(order))
+        return await self._dispatch(orders, send, timeout, max_concurrency)
+
+    async def _dispatch(self, orders, send, timeout, max_concurrency) -> List[OrderResult]:
+        if not orders:
+            return []
+        await self.ensure_session()
+        semaphore = asyncio.Semaphore(max_concurrency)
+        sent = [False] * len(orders)
+
+        async def run(i, order):
+            async with semaphore:
+                sent[i] = True
+                try:
+                    return await send(order)
+                except Exception as e:
+                    logger.error(f"Batch order {order.symbol} on {self.trading_account_id} failed: {e!r}")
+                    return error_result(order, e)
+
+        tasks = [asyncio.ensure_future(run(i, order)) for i, order in enumerate(orders)]
+        await asyncio.wait(tasks, timeout=timeout)
+        results = []
+        for i, (order, task) in enumerate(zip(orders, tasks)):
+            if task.done():
+                results.append(task.result())
+            else:
+                task.cancel()
+                results.append(timeout_result(order, timeout, sent[i]))
+        return results
+
+    async def get_current_orders(self, start_date: date=(datetime.now() - timedelta(days=1)).date(), columnar=False) -> List[Order]:
+        raise NotImplementedError
+
+    async def sync_orders(self, start_date: date = None) -> List[Order]:
+        raise NotImplementedError
+
+    async def get_current_portfolio(self) -> Portfolio:
+        return await self.portfolio_cache.aget(self.fetch_current_portfolio)
+
+    async def fetch_current_portfolio(self) -> Portfolio:
+        raise NotImplementedError
+
+    async def ping(self):
+        self.portfolio_cache.set(await self.fetch_current_portfolio())
+
+    async def ensure_session(self):
+        pass
+
+    def export_session(self) -> dict:
+        return None
+
+    def restore_session(self, session: dict):
+        pass
+
+    def export_state(self) -> dict:
+        "Same as BaseTradingAccount.export_state, nothing is awaited"
+        from .snapshot_store import account_state
+        return account_state(self)
+
+    def restore_state(self, state: dict):
+        from .snapshot_store import restore_account_state
+        restore_account_state(self, state)
+
+    def create_session(self) -> aiohttp.ClientSession:
+        return aiohttp.ClientSession()
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = self.create_session()
+            self._owns_session = True
+        return self._session
+
+    async def close(self):
+        if self._owns_session and self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def request(self, method, url, retried=False, priority=None, **kwargs) -> AsyncResponse:
+        ## Sử dụng cho việc tự đăng nhập lại khi token hết hạn
+        ## data có thể là callable để payload (sessionId, otp...) được tạo lại sau khi đăng nhập lại
+        if self.rate_limiter is not None:
+            await self.rate_limiter.aacquire(url, priority or request_priority(method))
+        # Read before the payload is built: a login publishing its session meanwhile makes a 401 retry, not log in
+        generation = self.login_generation
+        data = kwargs.get("data")
+        send_kwargs = {**kwargs, "data": data()} if callable(data) else kwargs
+        metrics = get_exporter()
+        started = time.perf_counter() if metrics.enabled else None
+        resp = await self.send(self.session, method, url, **send_kwargs)
+        if started is not None:
+            record_request(metrics, self.brokerage, method.upper(), url, send_kwargs.get("data"), resp.status_code,
+                           len(resp.content), resp.retries, time.perf_counter() - started)
+        if resp.status_code == 401 and not retried:
+            with metrics.timer(LOGIN_SECONDS, brokerage=self.brokerage, reason="401"):
+                if await self.relogin(generation):
+                    metrics.increment(RELOGINS, brokerage=self.brokerage)
+            return await self.request(method, url, retried=True, priority=priority, **kwargs)
+        return resp
+
+    @asynccontextmanager
+    async def login_guard(self):
+        "Holds login_lock while the token changes. A 401 inside (e.g. from update_bsc_token) does not log in again"
+        async with self.login_lock:
+            owner, self._login_owner = self._login_owner, asyncio.current_task()
+            try:
+                yield
+            finally:
+                self._login_owner = owner
+
+    async def relogin(self, generation: int) -> bool:
+        "Log in again after a 401 unless another coroutine already did since generation"
+        if self._login_owner is not None and self._login_owner is asyncio.current_task():
+            return False
+        async with self.login_guard():
+            if self.login_generation != generation:
+                return False
+            await self.login()
+            return True
+
+    def token_changed(self):
+        # Called by set_token once the new token is in place
+        self.login_generation += 1
+
+    async def send(self, session: aiohttp.ClientSession, method, url, headers=None, verify=None,
+                   timeout=None, **kwargs) -> AsyncResponse:
+        # Mirrors the Retry adapter mounted by BaseTradingAccount.create_session
+        request_headers = {**self.headers, **(headers or {})}
+        if verify is False:
+            kwargs["ssl"] = False
+        if timeout is not None:
+            kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout)
+        method = method.upper()
+        errors = 0
+        while True:
+            try:
+                async with session.request(method, url, headers=request_headers, **kwargs) as resp:
+                    content = await resp.read()
+                    if resp.status not in RETRY_STATUS_FORCELIST or method not in RETRY_ALLOWED_METHODS:
+                        response = AsyncResponse(resp.status, resp.headers, str(resp.url), content, resp.charset)
+                        response.retries = errors
+                        return response
+                    error = RetryError(f"Max retries exceeded with url: {url} (too many {resp.status} error responses)")
+            except aiohttp.ClientConnectorError as e:
+                # Connection could not be established, safe to retry for every method
+                error = e
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if method not in RETRY_ALLOWED_METHODS:
+                    raise
+                error = e
+            errors += 1
+            if errors > RETRY_TOTAL:
+                raise error
+            logger.debug(f"Retrying {method} {url} after {error!r}")
+            await asyncio.sleep(_backoff(errors))
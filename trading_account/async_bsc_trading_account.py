@@ -0,0 +1,323 @@
+import asyncio
+import os
+import re
+import time
+import logging
+from datetime import datetime, date
+from typing import Dict, List
+
+import aiohttp
+
+from .async_base_trading_account import AsyncBaseTradingAccount
+from .bsc_trading_account import parse_portfolio, parse_orders, history_complete, order_payload, token_expires_at
+from .bsc_trading_account import ORDERS_PAGE_SIZE, SYNC_PAGE_SIZE
+from .bsc_trading_account import SUB_ACCOUNT_CONCURRENCY, bsc_token_valid, export_bsc_session, restore_bsc_session
+from .cache import SnapshotCache
+from .datatypes import Portfolio, Order
+from .errors import WrongCredentialError
+from .metrics import get_exporter, LOGIN_SECONDS
+from .token_store import TokenStore, get_default_token_store
+
+## API Document https://www.bsc.com.vn/Download/OpenApiDetail.html
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncBSCTradingAccount(AsyncBaseTradingAccount):
+    brokerage = "BSC"
+
+    def __init__(
+        self,
+        username,
+        password=None,
+        pin=None,
+        trading_account_id=None,
+        mode="prod",
+        client_id=None,
+        client_secret=None,
+        url_callback=None,
+        access_token=None,
+        refresh_token=None,
+        session: aiohttp.ClientSession = None,
+        token_store: TokenStore = None,
+    ) -> None:
+        super().__init__(username, password, pin, trading_account_id, session=session)
+        self.mode = mode
+        self._token_store = token_store
+        self.token_account_ids = None
+        self._sub_portfolio_caches = {}
+        self._token_loaded = False # token_store is read on the first request, not in __init__ like the sync client
+        self.access_token = None
+        self.refresh_token = refresh_token
+        self.token_expires_at = None
+        if access_token:
+            self.set_token({"access_token": access_token, "refresh_token": refresh_token})
+        if self.mode == "uat":
+            self.sso_server = "https://apiuat.bsc.com.vn/sso"
+            self.trading_server = "https://apiuat.bsc.com.vn/trading"
+        else:
+            self.sso_server = "https://api.bsc.com.vn/sso"
+            self.trading_server = "https://api.bsc.com.vn"
+        self.client_id = client_id or os.environ["BSC_CLIENT_ID"]
+        self.url_callback = url_callback or os.environ["BSC_URL_CALLBACK"]
+        self.client_secret = client_secret or os.environ["BSC_CLIENT_SECRET"]
+
+    async def login(self, smart_otp=False):
+        endpoint = (
+            f"{self.sso_server}/oauth/authorize?client_id={self.client_id}&response_type=code"
+            f"&redirect_uri={self.url_callback}&scope=general&ui_locales=en"
+        )
+        # The OAuth consent flow is cookie based, keep it away from the trading session
+        async with aiohttp.ClientSession(cookie_jar=aiohttp.CookieJar(unsafe=True)) as account_session:
+            resp = await self.send(account_session, "GET", endpoint, timeout=10)
+            login_payload = {"username": self.username, "password": self.password}
+            resp = await self.send(account_session, "POST", resp.url, data=login_payload)
+            try:
+                transaction_id = re.findall('name="transactionID" value="(.+)"', resp.text)[0]
+            except Exception:
+                raise WrongCredentialError
+            token_id = re.findall('name="tokenID" value="(.+)"', resp.text)[0]
+            if (self.pin is None) or smart_otp:
+                self.pin = input("Enter Smart OTP:")
+            verification_payload = {
+                "code": self.pin,
+                "transactionID": transaction_id,
+                "tokenID": token_id,
+                "signedBase64": "undefined",
+            }
+            resp = await self.send(account_session, "POST", resp.url, data=verification_payload)
+            try:
+                permission_transaction_id = re.findall('name="transaction_id" .+value="(.+)"', resp.text)[0]
+            except Exception:
+                raise WrongCredentialError
+
+            resp = await self.send(
+                account_session,
+                "POST",
+                f"{self.sso_server}/oauth/authorize/decision",
+                data={"transaction_id": permission_transaction_id},
+                allow_redirects=False,
+            )
+
+        self.consent_code = resp.headers["Location"].split("=")[-1]
+        payload = {
+            "client_id": self.client_id,
+            "client_secret": self.client_secret,
+            "grant_type": "authorization_code",
+            "redirect_uri": self.url_callback,
+            "code": str(self.consent_code),
+        }
+        resp = await self.send(self.session, "POST", f"{self.sso_server}/oauth/token", data=payload)
+        self.set_token(resp.json())
+        await self.update_bsc_token()
+
+    def set_token(self, data):
+        self.access_token = data["access_token"]
+        self.refresh_token = data.get("refresh_token") or self.refresh_token
+        self.token_expires_at = token_expires_at(data, time.monotonic())
+        self.headers = {**self.headers, "Authorization": f"Bearer {self.access_token}"}
+        self.token_changed()
+
+    async def request_token_refresh(self):
+        # Must hold login_guard()
+        payload = {
+            "client_id": self.client_id,
+            "client_secret": self.client_secret,
+            "grant_type": "refresh_token",
+            "refresh_token": self.refresh_token,
+        }
+        resp = await self.send(self.session, "POST", f"{self.sso_server}/oauth/token", json=payload, timeout=5)
+        self.set_token(resp.json())
+
+    async def refresh_access_token(self):
+        logger.info(f"Refresh BSC access token for {self.username}")
+        try:
+            async with self.login_guard():
+                await self.request_token_refresh()
+            await self.update_bsc_token(is_valid=True)
+        except Exception as e:
+            logger.error(f"Refresh BSC access token for {self.username} failed: {e!r}")
+            raise
+        return {"access_token": self.access_token, "refresh_token": self.refresh_token}
+
+    def export_session(self):
+        return export_bsc_session(self)
+
+    def restore_session(self, session):
+        restore_bsc_session(self, session)
+
+    @property
+    def token_valid(self) -> bool:
+        return bsc_token_valid(self)
+
+    async def request(self, method, url, *args, **kwargs):
+        # An account used without ensure_session() (e.g. an async_fan_out follower) starts from the stored token
+        # instead of getting a 401 and a full login
+        if self.access_token is None and not self._token_loaded:
+            async with self.login_guard():
+                if self.access_token is None and not self._token_loaded:
+                    await self.get_bsc_token()
+                    self._token_loaded = True
+        return await super().request(method, url, *args, **kwargs)
+
+    async def ensure_session(self):
+        # An expired token (e.g. restored from a snapshot) is refreshed before falling back to a full login
+        if self.token_valid:
+            return
+        async with self.login_guard():
+            if self.token_valid:
+                return
+            await self.get_bsc_token()
+            if self.token_valid:
+                return
+            if self.refresh_token:
+                try:
+                    with get_exporter().timer(LOGIN_SECONDS, brokerage=self.brokerage, reason="refresh"):
+                        await self.request_token_refresh()
+                    await self.update_bsc_token(is_valid=True)
+                    return
+                except Exception as e:
+                    logger.warning(f"Refresh BSC access token for {self.username} failed, login again: {e!r}")
+            with get_exporter().timer(LOGIN_SECONDS, brokerage=self.brokerage, reason="session"):
+                await self.login()
+
+    async def get_trading_accounts(self):
+        resp = await self.request("GET", url=f"{self.trading_server}/accounts")
+        return resp.json()["d"]
+
+    async def ping(self):
+        await self.get_trading_accounts()
+
+    async def get_sub_account_ids(self) -> List[str]:
+        if self.token_account_ids is None:
+            self.token_account_ids = [r['id'] for r in await self.get_trading_accounts()]
+        return self.token_account_ids
+
+    def portfolio_cache_of(self, trading_account_id) -> SnapshotCache:
+        if trading_account_id == self.trading_account_id:
+            return self.portfolio_cache
+        cache = self._sub_portfolio_caches.get(trading_account_id)
+        if cache is None:
+            cache = self._sub_portfolio_caches.setdefault(trading_account_id, SnapshotCache())
+        return cache
+
+    async def fetch_portfolio(self, trading_account_id) -> Portfolio:
+        state_resp, allocation_resp = await asyncio.gather(
+            self.request("GET", url=f"{self.trading_server}/accounts/{trading_account_id}/state"),
+            self.request("GET", url=f"{self.trading_server}/accounts/{trading_account_id}/positions"),
+        )
+        return parse_portfolio(state_resp.json()["d"], allocation_resp.json()["d"])
+
+    async def fetch_current_portfolio(self) -> Portfolio:
+        return await self.fetch_portfolio(self.trading_account_id)
+
+    async def fetch_all_portfolios(self, trading_account_ids: List[str] = None) -> Dict[str, Portfolio]:
+        await self.ensure_session()
+        ids = list(trading_account_ids or await self.get_sub_account_ids())
+        semaphore = asyncio.Semaphore(SUB_ACCOUNT_CONCURRENCY)
+
+        async def get(endpoint):
+            async with semaphore:
+                return (await self.request("GET", url=endpoint)).json()["d"]
+
+        data = await asyncio.gather(*[
+            get(f"{self.trading_server}/accounts/{i}/{kind}") for i in ids for kind in ("state", "positions")
+        ])
+        return {i: parse_portfolio(data[2 * k], data[2 * k + 1]) for k, i in enumerate(ids)}
+
+    async def get_all_portfolios(self, trading_account_ids: List[str] = None) -> Dict[str, Portfolio]:
+        "BSCTradingAccount.get_all_portfolios"
+        ids = list(trading_account_ids or await self.get_sub_account_ids())
+        portfolios = {i: self.portfolio_cache_of(i).peek() for i in ids}
+        stale = [i for i, portfolio in portfolios.items() if portfolio is None]
+        if stale:
+            fetched = await self.fetch_all_portfolios(stale)
+            for i, portfolio in fetched.items():
+                self.portfolio_cache_of(i).set(portfolio)
+            portfolios.update(fetched)
+        return portfolios
+
+    async def fetch_orders_history(self, since: datetime, page_size=ORDERS_PAGE_SIZE):
+        max_count = page_size
+        while True:
+            endpoint = f"{self.trading_server}/accounts/{self.trading_account_id}/ordersHistory?maxCount={max_count}"
+            data = (await self.request("GET", url=endpoint)).json()["d"]
+            if history_complete(data, max_count, since):
+                return data
+            max_count *= 2
+
+    async def get_current_orders(self, start_date: date, columnar=False):
+        data, portfolio = await asyncio.gather(
+            self.fetch_orders_history(datetime.combine(start_date, datetime.min.time())),
+            self.get_current_portfolio(),
+        )
+        return parse_orders(data, self.trading_account_id, portfolio.total_assets, start_date, columnar)
+
+    async def sync_orders(self, start_date: date = None):
+        since = self.order_sync.since(datetime.combine(start_date or date.today(), datetime.min.time()))
+        data = [
+            r for r in await self.fetch_orders_history(since, SYNC_PAGE_SIZE)
+            if r["lastModified"] >= since.timestamp()
+        ]
+        if not data:
+            return []
+        orders = parse_orders(data, self.trading_account_id, (await self.get_current_portfolio()).total_assets)
+        return self.order_sync.update(orders, [order.created_at for order in orders])
+
+    async def place_order(self, order: Order, *args, **kwargs) -> Order:
+        endpoint = f"{self.trading_server}/accounts/{self.trading_account_id}/orders"
+        logger.info(f"Placing order: {order}")
+        resp = (await self.request("POST", url=endpoint, data=order_payload(order))).json()
+        self.portfolio_cache.invalidate()
+
+        if resp["s"] == "error":
+            order.status = "rejected"
+            order.reject_reason = resp["errmsg"]
+            logger.error(f"Error placing order from bsc {resp['errmsg']}")
+            return order
+
+        order.id = resp["d"]["orderid"]
+        return order
+
+    async def cancel_order(self, order: Order, *args, **kwargs) -> bool:
+        endpoint = f"{self.trading_server}/accounts/{self.trading_account_id}/orders/{order.id}"
+        logger.info(f"Canceling order: {order}")
+        resp = (await self.request("DELETE", url=endpoint)).json()
+        self.portfolio_cache.invalidate()
+
+        if resp["s"] == "error":
+            logger.error(f"Error canceling order from bsc {resp['errmsg']}")
+            return False
+
+        return True
+
+    @property
+    def token_store(self) -> TokenStore:
+        if self._token_store is None:
+            self._token_store = get_default_token_store()
+        return self._token_store
+
+    async def update_bsc_token(self, is_valid: bool = True):
+        logger.info(f"START UPDATE BSC TOKEN FOR ACCOUNT {self.username}")
+        loop = asyncio.get_running_loop()
+        if not is_valid:
+            await loop.run_in_executor(None, self.token_store.invalidate, self.username)
+            return
+        account_ids = await self.get_sub_account_ids()
+        # The store may block on the database (or on backpressure), keep it off the event loop
+        await loop.run_in_executor(
+            None, self.token_store.save, self.username, account_ids, self.access_token, self.refresh_token
+        )
+
+    async def get_bsc_token(self):
+        if self.access_token:
+            return
+        try:
+            record = await asyncio.get_running_loop().run_in_executor(None, self.token_store.load, self.username)
+        except Exception as e:
+            logger.warning(f"Could not load BSC token for {self.username}: {e!r}")
+            return
+        if record is None:
+            logger.warning("NOT FOUND TOKEN FROM TOKEN STORE")
+            return
+        self.set_token({"access_token": record.access_token, "refresh_token": record.refresh_token})
@@ -0,0 +1,226 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, date
+from uuid import uuid4
+
+import aiohttp
+
+from .async_base_trading_account import AsyncBaseTradingAccount
+from .cts_trading_account import parse_orders, updated_rows, parse_portfolio, token_deadlines, TOKEN_REFRESH_MARGIN
+from .cts_trading_account import export_cts_session, restore_cts_session, CTSSession, cts_headers
+from .cts_trading_account import smart_otp_payload, submit_order_payload, cancel_order_payload
+from .datatypes import Portfolio, Order
+from .errors import WrongCredentialError, WrongTradingAccountID
+from .metrics import get_exporter, LOGIN_SECONDS, OTP_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncCTSTradingAccount(AsyncBaseTradingAccount):
+    brokerage = "CTS"
+
+    def __init__(self, username, password, pin, trading_account_id, session: aiohttp.ClientSession = None) -> None:
+        super().__init__(username, password, pin, trading_account_id, session=session)
+        self.cts_session = CTSSession()
+        self.refresh_token = None
+        self.token_expires_at = 0 # time.monotonic() deadlines
+        self.refresh_expires_at = None
+        self.trading_server = 'https://api-cts.datxasia.com'
+        self.auth_server = 'https://uaa-cts.datxasia.com'
+
+        self.deviceId = "bbe4a4e8032295d5" # required but doesn't matter
+        self.deviceInfo = "{\"name\":\"SM-N985F\",\"model\":\"SM-N985F\",\"systemVersion\":\"11\"}" # required but doesn't matter
+
+    @property
+    def today(self):
+        return date.today().strftime('%Y%m%d')
+
+    @property
+    def access_token(self):
+        return self.cts_session.access_token
+
+    @property
+    def session_state(self):
+        return self.cts_session.session_state
+
+    @property
+    def smart_otp(self):
+        return self.cts_session.smart_otp
+
+    async def login(self, smart_otp=False):
+        res = await self.request(
+            'POST',
+            f"{self.auth_server}/api/third-party/login",
+            headers={'subAccoNo': self.trading_account_id, 'Content-Type': 'application/x-www-form-urlencoded'},
+            data='username=' + self.username + '&password=' + self.password,
+            verify=False,
+            retried=True, # runs under login_lock, a 401 here is a failed login
+        )
+        if res.status_code != 200:
+            raise WrongCredentialError
+        res = res.json()
+        if res['errorCode'] == 401 and 'MSG3092' in res['message']:
+            raise WrongTradingAccountID
+
+        # The old session stays in use until the new one has its Smart OTP
+        data = res['data']
+        session_state = data.get('session_state', self.session_state)
+        self.set_token(data, await self.gen_smart_otp(data['access_token'], session_state))
+
+    def set_token(self, data, smart_otp=None):
+        self.token_expires_at, self.refresh_expires_at = token_deadlines(data, time.monotonic())
+        self.refresh_token = data['refresh_token']
+        self.headers = cts_headers(self, data['access_token'])
+        self.cts_session = CTSSession(data['access_token'], data.get('session_state', self.session_state), smart_otp)
+        self.token_changed()
+
+    @property
+    def token_valid(self) -> bool:
+        return self.access_token is not None and time.monotonic() < self.token_expires_at - TOKEN_REFRESH_MARGIN
+
+    async def refresh_session(self):
+        res = await self.request(
+            'POST',
+            f"{self.auth_server}/api/third-party/refresh-token",
+            headers={'subAccoNo': self.trading_account_id, 'Content-Type': 'application/x-www-form-urlencoded'},
+            data='refresh_token=' + self.refresh_token,
+            verify=False,
+            retried=True, # a rejected refresh_token falls back to login in ensure_session
+        )
+        assert res.status_code == 200, "Refresh token failed with error code " + str(res.status_code)
+        data = res.json()['data']
+        session_state = data.get('session_state', self.session_state)
+        smart_otp = self.smart_otp
+        if smart_otp is None or session_state != self.session_state:
+            smart_otp = await self.gen_smart_otp(data['access_token'], session_state)
+        self.set_token(data, smart_otp)
+
+    def export_session(self):
+        return export_cts_session(self)
+
+    def restore_session(self, session):
+        restore_cts_session(self, session)
+
+    async def ensure_session(self):
+        if self.token_valid and self.smart_otp is not None:
+            return
+        async with self.login_guard():
+            if self.token_valid and self.smart_otp is not None:
+                return
+            refreshable = self.refresh_token and self.refresh_expires_at
+            if refreshable and time.monotonic() < self.refresh_expires_at - TOKEN_REFRESH_MARGIN:
+                try:
+                    with get_exporter().timer(LOGIN_SECONDS, brokerage=self.brokerage, reason="refresh"):
+                        await self.refresh_session()
+                    return
+                except Exception as e:
+                    logger.warning(f"Refresh CTS session for {self.username} failed, login again: {e!r}")
+            with get_exporter().timer(LOGIN_SECONDS, brokerage=self.brokerage, reason="session"):
+                await self.login()
+
+    async def gen_smart_otp(self, access_token, session_state) -> str:
+        with get_exporter().timer(OTP_SECONDS, brokerage=self.brokerage):
+            res = await self.request(
+                'POST',
+                f"{self.trading_server}/api/generateSmartOtp",
+                headers=cts_headers(self, access_token),
+                data=smart_otp_payload(self, session_state),
+                verify=False,
+                retried=True,
+            )
+        assert res.status_code == 200, "Smart OTP failed with error code " + str(res.status_code)
+        return res.json()['data']['otp']
+
+    async def place_order(self, order: Order) -> Order:
+        await self.ensure_session()
+        res = await self.request(
+            'POST',
+            f"{self.trading_server}/api/submitOrder",
+            data=lambda: submit_order_payload(self, order, 2 if order.trade_type == 'buy' else 1),
+            verify=False
+        )
+        self.portfolio_cache.invalidate()
+        assert res.status_code == 200, "Place order failed with error code " + str(res.status_code)
+        res = res.json()
+
+        if res.get('statusCode') == 0:
+            order.id = res['data']['orgOrderNo']
+            return order
+
+        logger.info(res['message'])
+        order.status = 'rejected'
+        order.reject_reason = res.get('message')
+        return order
+
+    async def cancel_order(self, order: Order) -> bool:
+        await self.ensure_session()
+        res = await self.request(
+            'POST',
+            f"{self.trading_server}/api/cancelOrder",
+            data=lambda: cancel_order_payload(self, order),
+            verify=False
+        )
+        self.portfolio_cache.invalidate()
+        assert res.status_code == 200, "Cancel order failed"
+        res = res.json()
+
+        if res.get('statusCode') == 0:
+            return True
+
+        logger.error(f"Cancel Order from CTS got error {res}")
+        return False
+
+    async def _find_orders(self, trade_type, start_date: date, ticker=''):
+        url = f"{self.trading_server}/api/findOrderByFilter?requestId=" + str(uuid4()) + "&tradeType=" + trade_type + "&secCd=" + ticker + "&extStatus&fromDate=" + start_date.strftime("%Y%m%d") + "&toDate=" + self.today
+        res = await self.request('GET', url, verify=False)
+        assert res.status_code == 200, "Get orders failed with error code " + str(res.status_code)
+        res = res.json()
+
+        assert 'statusCode' in res, "Get orders failed: " + res['message']
+        assert res['statusCode'] == 0, "Get orders failed: statusCode " + str(res['statusCode']) + ' ' + res['message']
+        return res['data'] or []
+
+    async def get_orders(self, start_date: date, ticker='', columnar=False):
+        await self.ensure_session()
+        if start_date is None:
+            start_date = date.today()
+
+        # Buy and sell orders are served by separate requests, run them side by side
+        sell_data, buy_data, portfolio = await asyncio.gather(
+            self._find_orders('1', start_date, ticker),
+            self._find_orders('2', start_date, ticker),
+            self.get_current_portfolio(),
+        )
+        trade_types = ['sell'] * len(sell_data) + ['buy'] * len(buy_data)
+        return parse_orders(sell_data + buy_data, trade_types, self.trading_account_id, portfolio.total_assets, columnar)
+
+    async def sync_orders(self, start_date: date = None):
+        await self.ensure_session()
+        since = self.order_sync.since(datetime.combine(start_date or date.today(), datetime.min.time()))
+        since_ms = since.timestamp() * 1000
+        sell_data, buy_data = await asyncio.gather(
+            self._find_orders('1', since.date()),
+            self._find_orders('2', since.date()),
+        )
+        rows, trade_types = updated_rows(sell_data + buy_data, ['sell'] * len(sell_data) + ['buy'] * len(buy_data), since_ms)
+        if not rows:
+            return []
+        portfolio = await self.get_current_portfolio()
+        orders = parse_orders(rows, trade_types, self.trading_account_id, portfolio.total_assets)
+        return self.order_sync.update(orders, [order.matched_at for order in orders])
+
+    async def get_current_orders(self, start_date: date, columnar=False):
+        return await self.get_orders(start_date, columnar=columnar)
+
+    async def fetch_current_portfolio(self) -> Portfolio:
+        logger.info("Getting current portfolio from CTS")
+        await self.ensure_session()
+        url = f"{self.trading_server}/api/inquiryAccountCashSec?subAccoNo=" + self.trading_account_id + "&requestId=" + str(uuid4())
+        res = await self.request('GET', url, verify=False)
+        assert res.status_code == 200, "Portfolio inquiry failed"
+        res = res.json()
+
+        assert 'statusCode' in res, "Get portfolio failed: " + res['message']
+        assert res['statusCode'] == 0, "Get portfolio failed: statusCode " + str(res['statusCode']) + ' ' + res['message']
+        return parse_portfolio(res['data'])
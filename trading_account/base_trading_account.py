@@ -1,7 +1,16 @@
 import requests
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait
 from typing import List
 from requests.adapters import HTTPAdapter, Retry
-from .datatypes import Portfolio, Order
+from .datatypes import Portfolio, Order, OrderResult
+from .cache import SnapshotCache
+from .order_sync import OrderSyncState
+from .rate_limit import rate_limiter, request_priority
+from .metrics import get_exporter, record_request, RELOGINS, LOGIN_SECONDS
 from datetime import date, datetime, timedelta
 from urllib3.exceptions import InsecureRequestWarning
 requests.packages.urllib3.disable_warnings(category=InsecureRequestWarning)
@@ -21,13 +30,54 @@ DEFAULT_HEADERS = {
         'sec-ch-ua-platform': '"macOS"'
         }
 
+# Retry policy shared by the sync (urllib3) and async transports
+RETRY_TOTAL = 5
+RETRY_BACKOFF_FACTOR = 0.1
+RETRY_STATUS_FORCELIST = [500, 502, 503, 504]
+
+BATCH_CONCURRENCY = 4 # orders of one account sent at the same time by place_orders/cancel_orders
+
+logger = logging.getLogger(__name__)
+
+
+def placed_result(order: Order) -> OrderResult:
+    if order.status == 'rejected':
+        return OrderResult(order, 'rejected', order.reject_reason)
+    return OrderResult(order, 'placed')
+
+
+def cancelled_result(order: Order, cancelled: bool) -> OrderResult:
+    if cancelled:
+        return OrderResult(order, 'cancelled')
+    return OrderResult(order, 'rejected', "Cancel rejected by broker")
+
+
+def error_result(order: Order, error: Exception) -> OrderResult:
+    return OrderResult(order, 'error', repr(error), error)
+
+
+def timeout_result(order: Order, timeout, sent: bool) -> OrderResult:
+    if not sent:
+        return OrderResult(order, 'timeout', f"Not sent within {timeout}s", TimeoutError())
+    # The request may still reach the broker, the order state is unknown until the next sync
+    return OrderResult(order, 'timeout', f"No response within {timeout}s", TimeoutError())
+
 class BaseTradingAccount:
+    brokerage = None # metrics label
     def __init__(self, username, password, pin, trading_account_id) -> None:
         self.username = username 
         self.password = password
         self.pin = pin
         self.trading_account_id = trading_account_id # Mã tiểu khoản sử dụng để giao dịch
         self.session = self.create_session() # For DatX interaction with Brokerage purposes        
+        self.portfolio_cache = SnapshotCache() # Invalidated by place_order/cancel_order
+        self.order_sync = OrderSyncState() # Watermark for sync_orders
+        self.rate_limiter = rate_limiter # Shared per brokerage host, None disables it
+        # Every token change (login, refresh) holds login_lock and bumps login_generation, so threads sharing the
+        # account log in once per expiry. Readers never take the lock
+        self.login_lock = threading.RLock()
+        self.login_generation = 0
+        self._login_owner = None # thread holding login_guard()
 
     
     def login(self, smart_otp=False):
@@ -39,28 +89,147 @@ class BaseTradingAccount:
     def cancel_order(self, *args, **kwargs) -> bool:
         raise NotImplementedError
     
-    def get_current_orders(self, start_date: date=(datetime.now() - timedelta(days=1)).date()) -> List[Order]:
+    def place_orders(self, orders: List[Order], timeout: float = None,
+                     max_concurrency=BATCH_CONCURRENCY) -> List[OrderResult]:
+        """Place orders concurrently on the logged in session, one OrderResult per order in the same order.
+
+        A failing order does not stop the others. Orders still queued after timeout are not sent.
+        """
+        return self._dispatch(orders, lambda order: placed_result(self.place_order(order)), timeout, max_concurrency)
+
+    def cancel_orders(self, orders: List[Order], timeout: float = None,
+                      max_concurrency=BATCH_CONCURRENCY) -> List[OrderResult]:
+        return self._dispatch(
+            orders, lambda order: cancelled_result(order, self.cancel_order(order)), timeout, max_concurrency
+        )
+
+    def _dispatch(self, orders, send, timeout, max_concurrency) -> List[OrderResult]:
+        if not orders:
+            return []
+        # Log in (and get the OTP) once for the whole batch instead of racing on it from every worker
+        self.ensure_session()
+
+        def run(order):
+            try:
+                return send(order)
+            except Exception as e:
+                logger.error(f"Batch order {order.symbol} on {self.trading_account_id} failed: {e!r}")
+                return error_result(order, e)
+
+        executor = ThreadPoolExecutor(max_workers=min(len(orders), max_concurrency))
+        try:
+            futures = [executor.submit(run, order) for order in orders]
+            wait(futures, timeout=timeout)
+            sent = [not future.cancel() for future in futures]
+        finally:
+            executor.shutdown(wait=False)
+        return [
+            future.result() if not future.cancelled() and future.done() else timeout_result(order, timeout, was_sent)
+            for order, future, was_sent in zip(orders, futures, sent)
+        ]
+
+    def get_current_orders(self, start_date: date=(datetime.now() - timedelta(days=1)).date(), columnar=False) -> List[Order]:
         # Get today order of trading account
         raise NotImplementedError
     
+    def sync_orders(self, start_date: date = None) -> List[Order]:
+        # Orders new or changed since the previous call, the first call starts from start_date (default today)
+        raise NotImplementedError
+
     def get_current_portfolio(self) -> Portfolio:
+        return self.portfolio_cache.get(self.fetch_current_portfolio)
+
+    def fetch_current_portfolio(self) -> Portfolio:
+        # Uncached portfolio request, implemented by each brokerage
         raise NotImplementedError
+
+    def ping(self):
+        # Cheapest authenticated request, keeps the pooled connection open. Refreshes the portfolio by default
+        self.portfolio_cache.set(self.fetch_current_portfolio())
+
+    def ensure_session(self):
+        # Make sure the account holds usable credentials, logging in only when needed
+        pass
+
+    def export_session(self) -> dict:
+        # Tokens and session metadata of the brokerage, deadlines as wall clock time. None if not logged in
+        return None
+
+    def restore_session(self, session: dict):
+        pass
+
+    def export_state(self) -> dict:
+        "Session, last portfolio and order watermark, for a SnapshotStore"
+        from .snapshot_store import account_state
+        return account_state(self)
+
+    def restore_state(self, state: dict):
+        from .snapshot_store import restore_account_state
+        restore_account_state(self, state)
+
+    def close(self):
+        self.session.close()
     
     def create_session(self) -> requests.Session:
         session = requests.Session()
-        retries = Retry(total=5,
-                        backoff_factor=0.1,
-                        status_forcelist=[ 500, 502, 503, 504 ])
-        session.mount('https://', HTTPAdapter(max_retries=retries))
+        retries = Retry(total=RETRY_TOTAL,
+                        backoff_factor=RETRY_BACKOFF_FACTOR,
+                        status_forcelist=RETRY_STATUS_FORCELIST)
+        adapter = HTTPAdapter(max_retries=retries)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter) # local brokerage simulator
         session.headers.update(DEFAULT_HEADERS)
         return session
 
     def request(self, *args, **kwargs) -> requests.Response:
         ## Sử dụng cho việc tự đăng nhập lại khi token hết hạn
+        ## data có thể là callable để payload (sessionId, otp...) được tạo lại sau khi đăng nhập lại
+        ## priority: 'order' hoặc 'query', mặc định theo method (GET là query)
         retried = kwargs.pop("retried",False)
-        resp = self.session.request(*args, **kwargs)
+        priority = kwargs.pop("priority", None)
+        method = args[0] if args else kwargs["method"]
+        url = args[1] if len(args) > 1 else kwargs["url"]
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(url, priority or request_priority(method))
+        # Read before the payload is built: a login publishing its session meanwhile makes a 401 retry, not log in
+        generation = self.login_generation
+        data = kwargs.get("data")
+        send_kwargs = {**kwargs, "data": data()} if callable(data) else kwargs
+        metrics = get_exporter()
+        started = time.perf_counter() if metrics.enabled else None
+        resp = self.session.request(*args, **send_kwargs)
+        if started is not None:
+            retries = getattr(getattr(resp.raw, "retries", None), "history", None)
+            record_request(metrics, self.brokerage, method, url, send_kwargs.get("data"), resp.status_code,
+                           len(resp.content), len(retries or ()), time.perf_counter() - started)
         if resp.status_code == 401 and not retried:
-            self.login()
-            return self.request(*args, **kwargs, retried=True)
+            with metrics.timer(LOGIN_SECONDS, brokerage=self.brokerage, reason="401"):
+                if self.relogin(generation):
+                    metrics.increment(RELOGINS, brokerage=self.brokerage)
+            return self.request(*args, **kwargs, retried=True, priority=priority)
         return resp
+
+    @contextmanager
+    def login_guard(self):
+        "Holds login_lock while the token changes. A 401 inside (e.g. from update_bsc_token) does not log in again"
+        with self.login_lock:
+            owner, self._login_owner = self._login_owner, threading.get_ident()
+            try:
+                yield
+            finally:
+                self._login_owner = owner
+
+    def relogin(self, generation: int) -> bool:
+        "Log in again after a 401 unless another thread already did since generation, returns whether it logged in"
+        if self._login_owner == threading.get_ident():
+            return False
+        with self.login_guard():
+            if self.login_generation != generation:
+                return False
+            self.login()
+            return True
+
+    def token_changed(self):
+        # Called by set_token under login_lock once the new token is in place
+        self.login_generation += 1
         
@@ -0,0 +1,163 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+
+from .metrics import get_exporter, CACHE_REQUESTS
+
+PORTFOLIO_CACHE_TTL = 120 # seconds
+
+
+class SnapshotCache:
+    """Holds the latest snapshot (e.g. the Portfolio) of a single account.
+
+    Memory is bounded to one value per account. Concurrent callers missing the cache share one upstream
+    load (single-flight), invalidate() drops the value and any load started before it.
+    """
+    def __init__(self, ttl=PORTFOLIO_CACHE_TTL, name="portfolio"):
+        self.ttl = ttl
+        self.name = name # metrics label
+        self._value = None
+        self._loaded_at = None
+        self._generation = 0
+        self._inflight = None # concurrent.futures.Future shared by threads waiting on the running load
+        self._ainflight = None # asyncio.Future, same for coroutines
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0 # misses caused by an expired value
+        self.coalesced = 0 # callers that waited on another caller's load
+        self.invalidations = 0
+
+    @property
+    def age(self):
+        return None if self._loaded_at is None else time.monotonic() - self._loaded_at
+
+    def _fresh(self):
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    def peek(self):
+        "Current value if still fresh, without loading"
+        return self._value if self._fresh() else None
+
+    def set(self, value, age: float = 0):
+        "Store value as loaded age seconds ago, e.g. a portfolio restored from a snapshot"
+        with self._lock:
+            self._generation += 1
+            self._value = value
+            self._loaded_at = time.monotonic() - age
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._value = None
+            self._loaded_at = None
+            self._inflight = None
+            self._ainflight = None
+            self.invalidations += 1
+
+    def _count(self, result):
+        metrics = get_exporter()
+        if metrics.enabled:
+            metrics.increment(CACHE_REQUESTS, cache=self.name, result=result)
+
+    def _lookup(self):
+        # Must hold self._lock. Returns (hit, value)
+        if self._fresh():
+            self.hits += 1
+            self._count("hit")
+            return True, self._value
+        if self._loaded_at is not None:
+            self.stale += 1
+            self._count("stale")
+        return False, None
+
+    def _store(self, generation, value):
+        # Must hold self._lock. A load that raced with invalidate() is handed to its waiters but not kept
+        if generation == self._generation:
+            self._value = value
+            self._loaded_at = time.monotonic()
+
+    def get(self, loader):
+        with self._lock:
+            hit, value = self._lookup()
+            if hit:
+                return value
+            future = self._inflight
+            if future is not None:
+                self.coalesced += 1
+                self._count("coalesced")
+                leader = False
+            else:
+                self.misses += 1
+                self._count("miss")
+                future = self._inflight = Future()
+                generation = self._generation
+                leader = True
+        if not leader:
+            return future.result()
+
+        try:
+            value = loader()
+        except BaseException as e:
+            with self._lock:
+                if self._inflight is future:
+                    self._inflight = None
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._store(generation, value)
+            if self._inflight is future:
+                self._inflight = None
+        future.set_result(value)
+        return value
+
+    async def aget(self, loader):
+        "get() for a coroutine loader, callers must share one event loop"
+        with self._lock:
+            hit, value = self._lookup()
+            if hit:
+                return value
+            future = self._ainflight
+            if future is not None:
+                self.coalesced += 1
+                self._count("coalesced")
+                leader = False
+            else:
+                self.misses += 1
+                self._count("miss")
+                future = self._ainflight = asyncio.get_running_loop().create_future()
+                generation = self._generation
+                leader = True
+        if not leader:
+            return await asyncio.shield(future)
+
+        try:
+            value = await loader()
+        except BaseException as e:
+            with self._lock:
+                if self._ainflight is future:
+                    self._ainflight = None
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                # Retrieve it so an exception nobody else waited on is not reported as never retrieved
+                future.exception()
+            raise
+        with self._lock:
+            self._store(generation, value)
+            if self._ainflight is future:
+                self._ainflight = None
+        future.set_result(value)
+        return value
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "coalesced": self.coalesced,
+            "invalidations": self.invalidations,
+            "age": self.age,
+        }
@@ -0,0 +1,213 @@
+import sys
+from array import array
+from dataclasses import fields
+from datetime import datetime
+from math import isnan
+from typing import Dict, Iterable, List
+
+from .datatypes import Order, Portfolio, StockAllocation
+
+ORDER_FIELDS = tuple(f.name for f in fields(Order))
+# Stored as array('d'): 8 bytes per value instead of a float/int object per order
+ORDER_NUMERIC_FIELDS = ('quantity', 'portfolio_proportion', 'price', 'avg_matched_price', 'matched_quantity')
+# Share quantities are whole numbers, given back as int so order payloads stay unchanged
+ORDER_COUNT_FIELDS = ('quantity', 'matched_quantity')
+# Stored as array('d') of timestamps, NaN for None
+ORDER_DATETIME_FIELDS = ('created_at', 'matched_at')
+# Low cardinality strings, interned so every row shares one object per value
+ORDER_INTERNED_FIELDS = ('symbol', 'trading_account_id', 'trade_type', 'order_type', 'type', 'status')
+
+NAN = float('nan')
+
+
+def _timestamps(values) -> array:
+    # datetimes, or timestamps already (parse_orders(..., columnar="batch") never builds the datetimes)
+    return array('d', (NAN if v is None else v if isinstance(v, (int, float)) else v.timestamp() for v in values))
+
+
+def _datetimes(values: array) -> list:
+    return [None if isnan(v) else datetime.fromtimestamp(v) for v in values]
+
+
+def _counts(values: array) -> list:
+    return [int(v) if v.is_integer() else v for v in values]
+
+
+def _interned(values) -> list:
+    return [sys.intern(v) if type(v) is str else v for v in values]
+
+
+class OrderBatch:
+    """Column-oriented, array-backed list of orders, e.g. the order history of many accounts.
+
+    Numeric and datetime columns are array('d'), low cardinality strings are interned. Rows are materialized
+    as Order only on access.
+    """
+    __slots__ = ('columns',)
+
+    def __init__(self, columns: Dict[str, Iterable] = None):
+        columns = columns or {}
+        length = len(next(iter(columns.values()))) if columns else 0
+        self.columns = {}
+        for name in ORDER_FIELDS:
+            values = columns.get(name)
+            if name in ORDER_NUMERIC_FIELDS:
+                self.columns[name] = array('d', values) if values is not None else array('d', bytes(8 * length))
+            elif name in ORDER_DATETIME_FIELDS:
+                self.columns[name] = _timestamps(values) if values is not None else array('d', [NAN]) * length
+            elif name in ORDER_INTERNED_FIELDS:
+                self.columns[name] = _interned(values) if values is not None else [None] * length
+            elif values is not None:
+                self.columns[name] = list(values)
+            else:
+                self.columns[name] = [None] * length
+        if columns.get('revived') is None:
+            self.columns['revived'] = [False] * length
+
+    @classmethod
+    def from_orders(cls, orders: Iterable[Order]) -> "OrderBatch":
+        orders = list(orders)
+        return cls({name: [getattr(order, name) for order in orders] for name in ORDER_FIELDS})
+
+    @classmethod
+    def concat(cls, batches: Iterable["OrderBatch"]) -> "OrderBatch":
+        batch = cls()
+        for other in batches:
+            for name, column in batch.columns.items():
+                column.extend(other.columns[name])
+        return batch
+
+    def __len__(self):
+        return len(self.columns['symbol'])
+
+    def __getitem__(self, index) -> Order:
+        if index < 0:
+            index += len(self)
+        values = {name: column[index] for name, column in self.columns.items()}
+        for name in ORDER_DATETIME_FIELDS:
+            values[name] = None if isnan(values[name]) else datetime.fromtimestamp(values[name])
+        for name in ORDER_COUNT_FIELDS:
+            values[name] = _counts([values[name]])[0]
+        return Order(**values)
+
+    def __iter__(self):
+        return iter(self.to_orders())
+
+    def append(self, order: Order):
+        for name, column in self.columns.items():
+            value = getattr(order, name)
+            if name in ORDER_DATETIME_FIELDS:
+                value = NAN if value is None else value.timestamp()
+            elif name in ORDER_INTERNED_FIELDS and type(value) is str:
+                value = sys.intern(value)
+            column.append(value)
+
+    def column(self, name):
+        "The raw column, datetimes as timestamps"
+        return self.columns[name]
+
+    def to_orders(self) -> List[Order]:
+        columns = dict(self.columns)
+        for name in ORDER_DATETIME_FIELDS:
+            columns[name] = _datetimes(columns[name])
+        for name in ORDER_COUNT_FIELDS:
+            columns[name] = _counts(columns[name])
+        names = list(columns)
+        return [Order(**dict(zip(names, values))) for values in zip(*columns.values())]
+
+    def matched_values(self) -> array:
+        "matched_quantity * avg_matched_price of every order"
+        return array('d', (q * p for q, p in zip(self.columns['matched_quantity'], self.columns['avg_matched_price'])))
+
+    def to_pandas(self):
+        import pandas as pd
+        columns = dict(self.columns)
+        for name in ORDER_DATETIME_FIELDS:
+            columns[name] = pd.to_datetime(list(columns[name]), unit='s')
+        return pd.DataFrame(columns)
+
+
+class PortfolioFrame:
+    """Portfolios of many accounts as arrays: one row per account and one row per stock allocation.
+
+    allocation_account[i] is the row index of the account holding allocation i.
+    """
+    __slots__ = ('account_ids', 'total_cash', 'total_loan', 'available_cash', 'allocation_account', 'symbol',
+                 'quantity', 'available_quantity', 'avg_buy_price', 'current_value')
+
+    def __init__(self):
+        self.account_ids: List[str] = []
+        self.total_cash = array('d')
+        self.total_loan = array('d')
+        self.available_cash = array('d')
+        self.allocation_account = array('l')
+        self.symbol: List[str] = []
+        self.quantity = array('d')
+        self.available_quantity = array('d')
+        self.avg_buy_price = array('d')
+        self.current_value = array('d')
+
+    @classmethod
+    def from_portfolios(cls, portfolios: Dict[str, Portfolio]) -> "PortfolioFrame":
+        frame = cls()
+        for trading_account_id, portfolio in portfolios.items():
+            frame.add(trading_account_id, portfolio)
+        return frame
+
+    def __len__(self):
+        return len(self.account_ids)
+
+    def add(self, trading_account_id: str, portfolio: Portfolio):
+        row = len(self.account_ids)
+        self.account_ids.append(trading_account_id)
+        self.total_cash.append(portfolio.total_cash)
+        self.total_loan.append(portfolio.total_loan)
+        self.available_cash.append(portfolio.available_cash)
+        for allocation in portfolio.stock_allocations or ():
+            self.allocation_account.append(row)
+            self.symbol.append(sys.intern(allocation.symbol))
+            self.quantity.append(allocation.quantity)
+            self.available_quantity.append(allocation.available_quantity)
+            self.avg_buy_price.append(allocation.avg_buy_price)
+            self.current_value.append(allocation.current_value)
+
+    def total_stock_values(self) -> array:
+        totals = array('d', bytes(8 * len(self.account_ids)))
+        for row, value in zip(self.allocation_account, self.current_value):
+            totals[row] += value
+        return totals
+
+    def total_assets(self) -> array:
+        return array('d', (cash + stock for cash, stock in zip(self.total_cash, self.total_stock_values())))
+
+    def to_portfolios(self) -> Dict[str, Portfolio]:
+        allocations = [[] for _ in self.account_ids]
+        for i, row in enumerate(self.allocation_account):
+            allocations[row].append(StockAllocation(
+                symbol=self.symbol[i],
+                quantity=self.quantity[i],
+                available_quantity=self.available_quantity[i],
+                avg_buy_price=self.avg_buy_price[i],
+                current_value=self.current_value[i],
+            ))
+        return {
+            trading_account_id: Portfolio(
+                total_cash=self.total_cash[row],
+                total_loan=self.total_loan[row],
+                available_cash=self.available_cash[row],
+                stock_allocations=allocations[row],
+            )
+            for row, trading_account_id in enumerate(self.account_ids)
+        }
+
+    def to_pandas(self):
+        "One row per stock allocation"
+        import pandas as pd
+        return pd.DataFrame({
+            'trading_account_id': [self.account_ids[row] for row in self.allocation_account],
+            'symbol': self.symbol,
+            'quantity': self.quantity,
+            'available_quantity': self.available_quantity,
+            'avg_buy_price': self.avg_buy_price,
+            'current_value': self.current_value,
+        })
@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from .base_trading_account import BaseTradingAccount
+from .async_base_trading_account import AsyncBaseTradingAccount
+from .datatypes import Order, Portfolio, LOT_SIZE
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_WORKERS = 64
+
+
+@dataclass
+class FanOutResult:
+    trading_account_id: str
+    order: Order = None # child order as returned by place_order, None when nothing had to be placed
+    error: Exception = None
+    elapsed: float = 0 # seconds from dispatch of the fan-out until this follower finished
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and (self.order is None or self.order.status != 'rejected')
+
+
+def size_child_order(master_order: Order, portfolio: Portfolio, trading_account_id, lot_size=LOT_SIZE) -> Optional[Order]:
+    """Scale the master order to the follower portfolio, None when the follower ends up with less than a lot.
+
+    The copy is placed at the price it was sized with: broker listings (e.g. BSC) give no order price, only the
+    average matched price, and a copy at price 0 would be rejected.
+    """
+    price = master_order.price or master_order.avg_matched_price
+    if not price:
+        return None
+    value = master_order.portfolio_proportion * portfolio.total_assets
+    if master_order.trade_type == 'buy':
+        quantity = min(value, portfolio.available_cash) / price
+    else:
+        available_quantity = sum(
+            allocation.available_quantity
+            for allocation in portfolio.stock_allocations
+            if allocation.symbol == master_order.symbol
+        )
+        quantity = min(value / price, available_quantity)
+    quantity = int(quantity // lot_size * lot_size)
+    if quantity <= 0:
+        return None
+    return Order(
+        symbol=master_order.symbol,
+        quantity=quantity,
+        trading_account_id=trading_account_id,
+        portfolio_proportion=master_order.portfolio_proportion,
+        trade_type=master_order.trade_type,
+        order_type=master_order.order_type,
+        price=price,
+        copy_from_order_id=master_order.id,
+        type=master_order.type,
+        created_at=datetime.now(),
+    )
+
+
+def save_child_orders(results: List[FanOutResult], order_store):
+    "One save_many for the whole fan-out, a WriteBehindOrderStore turns it into a few batched upserts"
+    order_store.save_many([result.order for result in results if result.order is not None])
+
+
+def _copy_order(master_order, follower: BaseTradingAccount, portfolio, lot_size, started_at) -> FanOutResult:
+    result = FanOutResult(trading_account_id=follower.trading_account_id)
+    try:
+        if portfolio is None:
+            portfolio = follower.get_current_portfolio()
+        child_order = size_child_order(master_order, portfolio, follower.trading_account_id, lot_size)
+        if child_order is not None:
+            result.order = follower.place_order(child_order)
+    except Exception as e:
+        logger.error(f"Copy order {master_order.id} to {follower.trading_account_id} failed: {e!r}")
+        result.error = e
+    result.elapsed = time.perf_counter() - started_at
+    return result
+
+
+def fan_out(
+    master_order: Order,
+    followers: List[BaseTradingAccount],
+    portfolios: Dict[str, Portfolio] = None,
+    timeout: float = None,
+    lot_size: int = LOT_SIZE,
+    executor: ThreadPoolExecutor = None,
+    order_store=None,
+) -> List[FanOutResult]:
+    """Replicate master_order on every follower in parallel.
+
+    portfolios optionally maps trading_account_id to an already fetched Portfolio, otherwise each
+    follower's get_current_portfolio() is used. Followers not done after timeout are reported with a
+    TimeoutError and do not delay the others: those still queued are not sent, those already running may still
+    place their copy. Results keep the order of followers.
+    The child orders are saved to order_store (e.g. a WriteBehindOrderStore) when given.
+    """
+    portfolios = portfolios or {}
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=min(len(followers), DEFAULT_MAX_WORKERS) or 1)
+    started_at = time.perf_counter()
+    try:
+        futures = [
+            executor.submit(
+                _copy_order, master_order, follower, portfolios.get(follower.trading_account_id), lot_size, started_at
+            )
+            for follower in followers
+        ]
+        wait(futures, timeout=timeout)
+        # Followers still queued are never sent, the copy must not be placed after being reported as timed out
+        sent = [not future.cancel() for future in futures]
+    finally:
+        if own_executor:
+            executor.shutdown(wait=False)
+
+    results = []
+    for follower, future, was_sent in zip(followers, futures, sent):
+        if not future.cancelled() and future.done():
+            results.append(future.result())
+        else:
+            results.append(FanOutResult(
+                trading_account_id=follower.trading_account_id,
+                error=TimeoutError(
+                    f"Copy order not sent within {timeout}s" if not was_sent else
+                    # Still running: the copy may reach the broker, its state is unknown until the next sync
+                    f"Copy order did not finish within {timeout}s, state unknown"
+                ),
+                elapsed=time.perf_counter() - started_at,
+            ))
+    if order_store is not None:
+        save_child_orders(results, order_store)
+    return results
+
+
+async def _async_copy_order(master_order, follower: AsyncBaseTradingAccount, portfolio, lot_size, started_at, timeout):
+    result = FanOutResult(trading_account_id=follower.trading_account_id)
+
+    async def copy():
+        nonlocal portfolio
+        if portfolio is None:
+            portfolio = await follower.get_current_portfolio()
+        child_order = size_child_order(master_order, portfolio, follower.trading_account_id, lot_size)
+        if child_order is not None:
+            result.order = await follower.place_order(child_order)
+
+    try:
+        await asyncio.wait_for(copy(), timeout)
+    except asyncio.TimeoutError:
+        result.error = TimeoutError(f"Copy order did not finish within {timeout}s")
+    except Exception as e:
+        logger.error(f"Copy order {master_order.id} to {follower.trading_account_id} failed: {e!r}")
+        result.error = e
+    result.elapsed = time.perf_counter() - started_at
+    return result
+
+
+async def async_fan_out(
+    master_order: Order,
+    followers: List[AsyncBaseTradingAccount],
+    portfolios: Dict[str, Portfolio] = None,
+    timeout: float = None,
+    lot_size: int = LOT_SIZE,
+    order_store=None,
+) -> List[FanOutResult]:
+    "Event loop counterpart of fan_out for AsyncBaseTradingAccount followers"
+    portfolios = portfolios or {}
+    started_at = time.perf_counter()
+    results = await asyncio.gather(*[
+        _async_copy_order(
+            master_order, follower, portfolios.get(follower.trading_account_id), lot_size, started_at, timeout
+        )
+        for follower in followers
+    ])
+    if order_store is not None:
+        # A write-behind store only blocks on backpressure, a plain OrderStore writes the batch here
+        await asyncio.get_running_loop().run_in_executor(None, save_child_orders, results, order_store)
+    return results
@@ -1,15 +1,111 @@
 from .base_trading_account import BaseTradingAccount
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, date
+from typing import NamedTuple
 from .errors import WrongCredentialError, WrongTradingAccountID
+from .metrics import get_exporter, LOGIN_SECONDS, OTP_SECONDS
+from .jsonutil import loads
 from json import dumps
 from uuid import uuid4
-from .datatypes import StockAllocation, Portfolio, Order
-from cachetools import cached, TTLCache
+from .datatypes import StockAllocation, Portfolio, Order, portfolio_proportions, orders_from_columns
+from .snapshot_store import wall_deadline, monotonic_deadline
 
 logger = logging.getLogger(__name__)
+_query_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="cts-query")
 
-# Unlike BSC's, CTS's access_token expires in few minutes since login. So this class will automatically execute the login method before execute other method
+# Unlike BSC's, CTS's access_token expires in few minutes since login. So this class tracks the token lifetime and
+# renews the session (refresh_token first, full login as fallback) shortly before it expires. The login, access_token,
+# session_state and Smart OTP are reused by every call in between.
+
+class CTSSession(NamedTuple):
+    # Replaced as a whole once the Smart OTP of a new session is generated, a payload never mixes two sessions
+    access_token: str = None
+    session_state: str = None
+    smart_otp: str = None
+
+
+DEFAULT_TOKEN_TTL = 300 # seconds, used when the login response does not carry expires_in
+TOKEN_REFRESH_MARGIN = 30 # seconds before expiry at which the session is renewed
+
+def token_deadlines(data, now):
+    expires_at = now + data.get('expires_in', DEFAULT_TOKEN_TTL)
+    refresh_expires_in = data.get('refresh_expires_in')
+    refresh_expires_at = now + refresh_expires_in if refresh_expires_in else None
+    return expires_at, refresh_expires_at
+
+def export_cts_session(account) -> dict:
+    # Shared by CTSTradingAccount and AsyncCTSTradingAccount
+    if not account.access_token:
+        return None
+    return {
+        "access_token": account.access_token,
+        "refresh_token": account.refresh_token,
+        "session_state": account.session_state,
+        "smart_otp": account.smart_otp,
+        "expires_at": wall_deadline(account.token_expires_at),
+        "refresh_expires_at": wall_deadline(account.refresh_expires_at),
+    }
+
+
+def restore_cts_session(account, session: dict):
+    account.set_token({
+        "access_token": session["access_token"],
+        "refresh_token": session["refresh_token"],
+        "session_state": session.get("session_state"),
+    }, session.get("smart_otp"))
+    account.token_expires_at = monotonic_deadline(session.get("expires_at")) or 0
+    account.refresh_expires_at = monotonic_deadline(session.get("refresh_expires_at"))
+
+
+def cts_headers(account, access_token):
+    return {
+        'subAccoNo': account.trading_account_id,
+        'Authorization': 'Bearer ' + access_token,
+        'Content-Type': 'application/json'
+    }
+
+
+def smart_otp_payload(account, session_state):
+    return dumps({
+        "custNo": account.username,
+        "sessionId": session_state,
+        "deviceId": account.deviceId,
+        "deviceInfo": account.deviceInfo,
+        "requestId": str(uuid4()),
+        "pinCd": account.pin
+    })
+
+def submit_order_payload(account, order, trade_type):
+    # Built at send time from one CTSSession, so a re-login in between gives the new sessionId and otp together
+    session = account.cts_session
+    return dumps({
+        "subAccoNo": account.trading_account_id,
+        "tradeType": trade_type, # 1-sell, 2-buy
+        "secCd": order.symbol,
+        "order_type": order.order_type, # LO, ATO, ATC
+        "order_price": order.price,
+        "order_qty": order.quantity,
+        "sessionId": session.session_state,
+        "deviceId": account.deviceId,
+        "otp": session.smart_otp,
+        "deviceInfo": account.deviceInfo,
+        "requestId": str(uuid4())
+    })
+
+
+def cancel_order_payload(account, order):
+    session = account.cts_session
+    return dumps({
+        "tradeDate": int(account.today),
+        "orgOrderNo": order.id,
+        "otp": session.smart_otp,
+        "sessionId": session.session_state,
+        "deviceId": account.deviceId,
+        "deviceInfo": account.deviceInfo,
+        "requestId": str(uuid4())
+    })
 
 def code_2_status(code):
     if code in [1, 7, 8]:
@@ -18,11 +114,62 @@ def code_2_status(code):
         return 'matched'
     return 'placing'
 
+def parse_orders(rows, trade_types, trading_account_id, total_assets, columnar=False):
+    # trade_types[i] is 'buy' or 'sell' for rows[i], CTS serves them from separate queries
+    matched_quantity = [_r['matQty'] for _r in rows]
+    avg_matched_price = [_r['matPriceAvg'] for _r in rows]
+    return orders_from_columns({
+        'symbol': [_r['secCd'] for _r in rows],
+        'quantity': [_r['ordQty'] for _r in rows],
+        'trade_type': list(trade_types),
+        'order_type': [_r['ordType'] for _r in rows],
+        'price': [_r['ordPrice'] for _r in rows],
+        'id': [_r['orgOrderNo'] for _r in rows],
+        'avg_matched_price': avg_matched_price,
+        'matched_quantity': matched_quantity,
+        'created_at': [_r['regDateTime'] / 1000 for _r in rows],
+        'matched_at': [_r['updDateTime'] / 1000 for _r in rows],
+        'type': ['market'] * len(rows),
+        'status': [code_2_status(_r['extStatus']) for _r in rows],
+        'portfolio_proportion': portfolio_proportions(matched_quantity, avg_matched_price, total_assets),
+        'trading_account_id': [trading_account_id] * len(rows),
+    }, columnar)
+
+def updated_rows(rows, trade_types, since_ms):
+    # findOrderByFilter only filters by trade date, keep the rows updated since the watermark
+    kept = [i for i, _r in enumerate(rows) if _r['updDateTime'] >= since_ms]
+    return [rows[i] for i in kept], [trade_types[i] for i in kept]
+
+def parse_portfolio(res) -> Portfolio:
+    stock_allocations = []
+    if res['secBalanceData2'] is not None:
+        for stock in res['secBalanceData2']:
+            quantity = stock['total'] + stock['pendingReceive']
+            current_value = stock['currentPrice']/1000 * quantity
+            stock_allocations.append(StockAllocation(
+                symbol=stock['secCode'],
+                quantity=quantity,
+                available_quantity=stock['availSale'],
+                avg_buy_price=0,
+                current_value=current_value,
+            ))
+
+    return Portfolio(
+        total_cash=(res['casAmt'] - res['paymentTotal'])/1000,
+        total_loan=0,
+        available_cash=(res['buyingPower'])/1000,
+        stock_allocations=stock_allocations
+    )
+
 class CTSTradingAccount(BaseTradingAccount):
+    brokerage = "CTS"
+
     def __init__(self, username, password, pin, trading_account_id) -> None:
         super().__init__(username, password, pin, trading_account_id)
-        self.access_token = None
+        self.cts_session = CTSSession()
         self.refresh_token = None
+        self.token_expires_at = 0 # time.monotonic() deadlines
+        self.refresh_expires_at = None
         self.trading_server = 'https://api-cts.datxasia.com'
         self.auth_server = 'https://uaa-cts.datxasia.com'
 
@@ -33,52 +180,108 @@ class CTSTradingAccount(BaseTradingAccount):
     def today(self):
         return datetime.now().strftime('%Y%m%d')
     
+    @property
+    def access_token(self):
+        return self.cts_session.access_token
+
+    @property
+    def session_state(self):
+        return self.cts_session.session_state
+
+    @property
+    def smart_otp(self):
+        return self.cts_session.smart_otp
+
     def login(self, smart_otp=False):
         res = self.request(
             'POST',
             f"{self.auth_server}/api/third-party/login",
             headers={'subAccoNo': self.trading_account_id, 'Content-Type': 'application/x-www-form-urlencoded'}, 
             data='username=' + self.username + '&password=' + self.password, 
-            verify=False
+            verify=False,
+            retried=True, # runs under login_lock, a 401 here is a failed login
         )
         if res.status_code != 200:
             raise WrongCredentialError
         # assert res.status_code == 200, "Login failed with error code " + str(res.status_code)
-        res = res.json()
+        res = loads(res.content)
         if res['errorCode'] == 401 and 'MSG3092' in res['message']:
             raise WrongTradingAccountID
 
-        self.access_token = res['data']['access_token']
-        self.refresh_token = res['data']['refresh_token']
-        self.session_state = res['data']['session_state']
-        self.session.headers = {
-            'subAccoNo': self.trading_account_id, 
-            'Authorization': 'Bearer ' + self.access_token, 
-            'Content-Type': 'application/json'
-        }
-        self.gen_smart_otp()
-
-    def gen_smart_otp(self):
+        # The old session stays in use until the new one has its Smart OTP
+        data = res['data']
+        self.set_token(data, self.gen_smart_otp(data['access_token'], data.get('session_state', self.session_state)))
+
+    def set_token(self, data, smart_otp=None):
+        self.token_expires_at, self.refresh_expires_at = token_deadlines(data, time.monotonic())
+        self.refresh_token = data['refresh_token']
+        self.session.headers = cts_headers(self, data['access_token'])
+        self.cts_session = CTSSession(data['access_token'], data.get('session_state', self.session_state), smart_otp)
+        self.token_changed()
+
+    @property
+    def token_valid(self) -> bool:
+        return self.access_token is not None and time.monotonic() < self.token_expires_at - TOKEN_REFRESH_MARGIN
+
+    def refresh_session(self):
         res = self.request(
             'POST',
-            f"{self.trading_server}/api/generateSmartOtp",
-            data=dumps({
-                "custNo": self.username, 
-                "sessionId": self.session_state, 
-                "deviceId": self.deviceId, 
-                "deviceInfo": self.deviceInfo,
-                "requestId": str(uuid4()), 
-                "pinCd": self.pin
-            }), 
-            verify=False
+            f"{self.auth_server}/api/third-party/refresh-token",
+            headers={'subAccoNo': self.trading_account_id, 'Content-Type': 'application/x-www-form-urlencoded'},
+            data='refresh_token=' + self.refresh_token,
+            verify=False,
+            retried=True, # a rejected refresh_token falls back to login in ensure_session
         )
+        assert res.status_code == 200, "Refresh token failed with error code " + str(res.status_code)
+        data = loads(res.content)['data']
+        session_state = data.get('session_state', self.session_state)
+        smart_otp = self.smart_otp
+        if smart_otp is None or session_state != self.session_state:
+            smart_otp = self.gen_smart_otp(data['access_token'], session_state)
+        self.set_token(data, smart_otp)
+
+    def export_session(self):
+        return export_cts_session(self)
+
+    def restore_session(self, session):
+        restore_cts_session(self, session)
+
+    def ensure_session(self):
+        # Reuse access_token/session_state/smart_otp while valid; on expiry try refresh_token before a full login
+        if self.token_valid and self.smart_otp is not None:
+            return
+        with self.login_guard():
+            if self.token_valid and self.smart_otp is not None:
+                return
+            refreshable = self.refresh_token and self.refresh_expires_at
+            if refreshable and time.monotonic() < self.refresh_expires_at - TOKEN_REFRESH_MARGIN:
+                try:
+                    with get_exporter().timer(LOGIN_SECONDS, brokerage=self.brokerage, reason="refresh"):
+                        self.refresh_session()
+                    return
+                except Exception as e:
+                    logger.warning(f"Refresh CTS session for {self.username} failed, login again: {e!r}")
+            with get_exporter().timer(LOGIN_SECONDS, brokerage=self.brokerage, reason="session"):
+                self.login()
+
+    def gen_smart_otp(self, access_token, session_state) -> str:
+        "Smart OTP of a session that is not published yet, so it is requested with its own token"
+        with get_exporter().timer(OTP_SECONDS, brokerage=self.brokerage):
+            res = self.request(
+                'POST',
+                f"{self.trading_server}/api/generateSmartOtp",
+                headers=cts_headers(self, access_token),
+                data=smart_otp_payload(self, session_state),
+                verify=False,
+                retried=True,
+            )
         assert res.status_code == 200, "Smart OTP failed with error code " + str(res.status_code)
-        res = res.json()
-        self.smart_otp = res['data']['otp']
+        res = loads(res.content)
+        return res['data']['otp']
 
     # def place_order(self, tradeType, secCd, orderType, order_qty, order_price=0):
     def place_order(self, order: Order) -> Order:
-        self.login()
+        self.ensure_session()
         if order.trade_type == 'buy':
             trade_type = 2
         else:
@@ -86,23 +289,12 @@ class CTSTradingAccount(BaseTradingAccount):
         res = self.request(
             'POST',
             f"{self.trading_server}/api/submitOrder",
-            data=dumps({
-                "subAccoNo": self.trading_account_id,
-                "tradeType": trade_type, # 1-sell, 2-buy
-                "secCd": order.symbol,
-                "order_type": order.order_type, # LO, ATO, ATC
-                "order_price": order.price,
-                "order_qty": order.quantity,
-                "sessionId": self.session_state,
-                "deviceId": self.deviceId,
-                "otp": self.smart_otp,
-                "deviceInfo": self.deviceInfo,
-                "requestId": str(uuid4())
-            }),
+            data=lambda: submit_order_payload(self, order, trade_type),
             verify=False
         )
+        self.portfolio_cache.invalidate()
         assert res.status_code == 200, "Place order failed with error code " + str(res.status_code)
-        res = res.json()
+        res = loads(res.content)
 
         if 'statusCode' in res:
             if res['statusCode'] == 0:
@@ -111,31 +303,20 @@ class CTSTradingAccount(BaseTradingAccount):
 
         logger.info(res['message'])
         order.status = 'rejected'
+        order.reject_reason = res.get('message')
         return order
     
     def cancel_order(self, order: Order) -> Order:
-        self.login()
+        self.ensure_session()
         res = self.request(
             'POST',
             f"{self.trading_server}/api/cancelOrder",
-            headers={
-            'subAccoNo': self.trading_account_id, 
-            'Authorization': 'Bearer ' + self.access_token, 
-            'Content-Type': 'application/json'
-            },
-            data=dumps({
-                "tradeDate": int(self.today),
-                "orgOrderNo": order.id,
-                "otp": self.smart_otp,
-                "sessionId": self.session_state,
-                "deviceId": self.deviceId,
-                "deviceInfo": self.deviceInfo,
-                "requestId": str(uuid4())
-            }), 
+            data=lambda: cancel_order_payload(self, order),
             verify=False
         )
+        self.portfolio_cache.invalidate()
         assert res.status_code == 200, "Cancel order failed"
-        res = res.json()
+        res = loads(res.content)
 
         if 'statusCode' in res:
             if res['statusCode'] == 0:
@@ -145,101 +326,67 @@ class CTSTradingAccount(BaseTradingAccount):
         logger.error(f"Cancel Order from CTS got error {res}")
         return False
     
-    def get_orders(self, start_date:date, ticker=''):
-        self.login()
+    def _find_orders(self, trade_type, start_date: date, ticker=''):
+        url = f"{self.trading_server}/api/findOrderByFilter?requestId=" + str(uuid4()) + "&tradeType=" + trade_type + "&secCd=" + ticker + "&extStatus&fromDate=" + start_date.strftime("%Y%m%d") + "&toDate=" + self.today
 
-        orders = []
+        res = self.request(
+            'GET',
+            url,
+            data={},
+            verify=False
+        )
+        assert res.status_code == 200, "Get orders failed with error code " + str(res.status_code)
+        res = loads(res.content)
+
+        assert 'statusCode' in res, "Get orders failed: " + res['message']
+        assert res['statusCode'] == 0, "Get orders failed: statusCode " + str(res['statusCode']) + ' ' + res['message']
+        return res['data'] or []
+
+    def find_all_orders(self, start_date: date, ticker=''):
+        # Buy and sell orders are served by separate requests: run the buy query on the pool while this thread
+        # runs the sell query
+        buy_future = _query_executor.submit(self._find_orders, '2', start_date, ticker)
+        sell_data = self._find_orders('1', start_date, ticker)
+        buy_data = buy_future.result()
+        return sell_data + buy_data, ['sell'] * len(sell_data) + ['buy'] * len(buy_data)
+
+    def get_orders(self, start_date:date, ticker='', columnar=False):
+        self.ensure_session()
 
         if start_date is None:
-            start_date = self.today
+            start_date = datetime.now().date()
 
-        tt = 'sell'
-        for tradeType in ['1', '2']: # seperate request for buy and sell orders
+        rows, trade_types = self.find_all_orders(start_date, ticker)
+        # One portfolio snapshot for the whole listing
+        total_assets = self.get_current_portfolio().total_assets
+        return parse_orders(rows, trade_types, self.trading_account_id, total_assets, columnar)
 
-            url = "https://api-cts.datxasia.com/api/findOrderByFilter?requestId=" + str(uuid4()) + "&tradeType=" + tradeType + "&secCd=" + ticker + "&extStatus&fromDate=" + start_date.strftime("%Y%m%d") + "&toDate=" + self.today
+    def sync_orders(self, start_date: date = None):
+        self.ensure_session()
+        since = self.order_sync.since(datetime.combine(start_date or date.today(), datetime.min.time()))
+        since_ms = since.timestamp() * 1000
+        rows, trade_types = updated_rows(*self.find_all_orders(since.date()), since_ms)
+        if not rows:
+            return []
+        orders = parse_orders(rows, trade_types, self.trading_account_id, self.get_current_portfolio().total_assets)
+        return self.order_sync.update(orders, [order.matched_at for order in orders])
 
-            res = self.request(
-                'GET',
-                url,
-                # headers={'subAccoNo': self.trading_account_id, 'Authorization':  'Bearer ' + self.access_token},
-                data={},
-                verify=False
-            )
-            assert res.status_code == 200, "Get orders failed with error code " + str(res.status_code)
-            res = res.json()
-
-            assert 'statusCode' in res, "Get orders failed: " + res['message']
-            assert res['statusCode'] == 0, "Get orders failed: statusCode " + str(res['statusCode']) + ' ' + res['message']
-
-            if tradeType == '2':
-                tt = 'buy'
-            if res['data'] is not None:
-                for _r in res['data']:
-                    proportion = _r['matQty'] * _r['matPriceAvg'] / self.get_current_portfolio().total_assets
-                    order = Order(
-                        symbol=_r['secCd'], 
-                        quantity=_r['ordQty'], 
-                        trade_type=tt, 
-                        order_type=_r['ordType'], 
-                        price=_r['ordPrice'], 
-                        id=_r['orgOrderNo'],
-                        avg_matched_price=_r['matPriceAvg'],
-                        matched_quantity=_r['matQty'],
-                        created_at=datetime.fromtimestamp(_r['regDateTime'] / 1000),
-                        matched_at=datetime.fromtimestamp(_r['updDateTime'] / 1000),
-                        type='market',
-                        status=code_2_status(_r['extStatus']),
-                        portfolio_proportion=proportion,
-                        trading_account_id=self.trading_account_id
-                    )
-                    orders.append(order)
-        return orders
-
-    def get_current_orders(self, start_date: date):
-        return self.get_orders(start_date)
+    def get_current_orders(self, start_date: date, columnar=False):
+        return self.get_orders(start_date, columnar=columnar)
     
-    @cached(cache=TTLCache(maxsize=1024, ttl=120))
-    def get_current_portfolio(self):
+    def fetch_current_portfolio(self):
         logger.info("Getting current portfolio from CTS")
-        self.login()
-        url = "https://api-cts.datxasia.com/api/inquiryAccountCashSec?subAccoNo=" + self.trading_account_id + "&requestId=" + str(uuid4())
+        self.ensure_session()
+        url = f"{self.trading_server}/api/inquiryAccountCashSec?subAccoNo=" + self.trading_account_id + "&requestId=" + str(uuid4())
         res = self.request(
             'GET',
             url,
-            headers={'subAccoNo': self.trading_account_id, 'Authorization':  'Bearer ' + self.access_token},
             verify=False
         )
         assert res.status_code == 200, "Portfolio inquiry failed"
-        res = res.json()
+        res = loads(res.content)
 
         assert 'statusCode' in res, "Get portfolio failed: " + res['message']
         assert res['statusCode'] == 0, "Get portfolio failed: statusCode " + str(res['statusCode']) + ' ' + res['message']
 
-        res = res['data']
-        print(res)
-        
-        stock_total_val = 0
-        if res['secBalanceData2'] is not None:
-            stock_allocations = []
-            for stock in res['secBalanceData2']:
-
-                quantity = stock['total'] + stock['pendingReceive']
-                current_value = stock['currentPrice']/1000 * quantity
-                stock_total_val += current_value
-
-                stock_allocations.append(StockAllocation(
-                    symbol=stock['secCode'],
-                    quantity=quantity,
-                    available_quantity=stock['availSale'],
-                    avg_buy_price=0,
-                    current_value=current_value,
-                ))
-        else:
-            stock_allocations = []
-        
-        return Portfolio(
-            total_cash=(res['casAmt'] - res['paymentTotal'])/1000,
-            total_loan=0,
-            available_cash=(res['buyingPower'])/1000,
-            stock_allocations=stock_allocations
-        )
+        return parse_portfolio(res['data'])
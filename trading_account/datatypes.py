@@ -1,7 +1,29 @@
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, fields
 from typing import List, Literal
 from datetime import datetime
 
+LOT_SIZE = 100 # HOSE/HNX board lot
+
+
+def hose_tick_size(price: float) -> float:
+    "Price step of HOSE for a price in nghìn đồng, HNX and UPCoM use 0.1 at every price"
+    if price < 10:
+        return 0.01
+    if price < 50:
+        return 0.05
+    return 0.1
+
+
+def slotted(cls):
+    "dataclass(slots=True) that also works on Python 3.8/3.9: no per-instance __dict__"
+    names = tuple(f.name for f in fields(cls))
+    namespace = {k: v for k, v in cls.__dict__.items() if k not in names + ("__dict__", "__weakref__")}
+    namespace["__slots__"] = names
+    new_cls = type(cls)(cls.__name__, cls.__bases__, namespace)
+    new_cls.__qualname__ = cls.__qualname__
+    return new_cls
+
+@slotted
 @dataclass
 class StockAllocation:
     symbol: str
@@ -10,6 +32,7 @@ class StockAllocation:
     avg_buy_price: float # ĐVT: Nghìn đồng
     current_value: float # ĐVT: Nghìn đồng: Giá trị hiện tại của số cổ phiêu đang nắm giữ
 
+@slotted
 @dataclass
 class Portfolio:
     total_assets: float = field(init=False) # ĐVT: Nghìn đồng
@@ -20,9 +43,10 @@ class Portfolio:
     total_stock_value: float = field(init=False) # ĐVT: Nghìn đồng
 
     def __post_init__(self):
-        self.total_stock_value = sum([allocation.current_value for allocation in self.stock_allocations]) if self.stock_allocations else 0
+        self.total_stock_value = sum(allocation.current_value for allocation in self.stock_allocations or ())
         self.total_assets = self.total_cash + self.total_stock_value
 
+@slotted
 @dataclass
 class Order:
     __table_name__ = 'copy_trading_order'
@@ -37,15 +61,57 @@ class Order:
     copy_from_order_id: str = None
     avg_matched_price: float = 0
     matched_quantity: float = 0 # matched quantity
-    created_at: datetime = datetime.now()
+    created_at: datetime = field(default_factory=datetime.now)
     matched_at: datetime = None
     type: Literal['market', 'limit'] = 'market'
     status: Literal['placing', 'matched', 'cancelled', 'rejected'] = 'placing'
     revived: bool = False
+    reject_reason: str = None # broker message when status is rejected
+    client_order_id: str = None # set by the order store on first save, identifies the row while id is None
     
     def upsert(self):
-        print(f"Upsert order {self} to table {self.__table_name__}")
-        pass
+        "Queue the order for the background batch writer of the default order store"
+        from .order_store import get_default_order_store
+        get_default_order_store().save(self)
+
+    @classmethod
+    def create_table(cls):
+        from .order_store import get_default_order_store
+        get_default_order_store().create_table()
+
+
+@slotted
+@dataclass
+class OrderResult:
+    "Outcome of one order of a place_orders/cancel_orders batch"
+    order: Order
+    outcome: Literal['placed', 'cancelled', 'rejected', 'timeout', 'error']
+    message: str = None # broker reject message or error description
+    error: Exception = None
+
+    @property
+    def ok(self) -> bool:
+        return self.outcome in ('placed', 'cancelled')
+
+
+def portfolio_proportions(matched_quantity: List[float], avg_matched_price: List[float], total_assets: float) -> List[float]:
+    # Computed for a whole listing against one portfolio snapshot
+    if not total_assets:
+        return [0] * len(matched_quantity)
+    return [quantity * price / total_assets for quantity, price in zip(matched_quantity, avg_matched_price)]
+
 
-    def create_table(self):
-        pass
+def orders_from_columns(columns: dict, columnar=False):
+    """columns: Order field name -> list of values, all of the same length. created_at and matched_at hold POSIX
+    timestamps (None for no value), converted to datetime unless columnar="batch", which returns an OrderBatch"""
+    if columnar == "batch":
+        from .columnar import OrderBatch
+        return OrderBatch(columns)
+    for name in ("created_at", "matched_at"):
+        if name in columns:
+            columns[name] = [None if ts is None else datetime.fromtimestamp(ts) for ts in columns[name]]
+    if columnar:
+        import pandas as pd
+        return pd.DataFrame(columns)
+    fields = list(columns)
+    return [Order(**dict(zip(fields, values))) for values in zip(*columns.values())]
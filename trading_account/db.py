@@ -0,0 +1,32 @@
+import threading
+
+# SQLAlchemy is imported on first use, importing this module stays cheap
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(uri: str):
+    """One pooled engine per uri for the whole process.
+
+    An in-memory SQLite uri gets a new engine, hence a database of its own, on every call: stores created with it
+    do not see each other's rows.
+    """
+    from sqlalchemy import create_engine
+    from sqlalchemy.pool import StaticPool
+    if uri in ("sqlite://", "sqlite:///:memory:"):
+        # Every connection of the engine must see the same in-memory database
+        return create_engine(uri, connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    with _engines_lock:
+        engine = _engines.get(uri)
+        if engine is None:
+            if uri.startswith("sqlite"):
+                engine = create_engine(uri, connect_args={"check_same_thread": False})
+            else:
+                engine = create_engine(uri, pool_pre_ping=True, pool_recycle=3600)
+            _engines[uri] = engine
+        return engine
+
+
+def sqlite_uri(path: str = ":memory:") -> str:
+    return "sqlite://" if path == ":memory:" else f"sqlite:///{path}"
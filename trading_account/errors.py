@@ -8,3 +8,9 @@ class WrongTradingAccountID(Exception):
     "Raise when trading account id is invalid!"
     def __init__(self, message="The given trading account id is invalid!"):
         super().__init__(message)
+
+
+class ShardCrashedError(Exception):
+    "Raise when the worker process owning an account exits before answering"
+    def __init__(self, message="The worker shard crashed before answering!"):
+        super().__init__(message)
@@ -1,19 +1,283 @@
-from .base_trading_account import BaseTradingAccount
-from .bsc_trading_account import BSCTradingAccount
-from .cts_trading_account  import CTSTradingAccount
+import importlib
+import inspect
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING: # kept out of the import path, see benchmarks/bench_import.py
+    from .base_trading_account import BaseTradingAccount
+    from .snapshot_store import SnapshotStore
+    from .token_refresher import TokenRefreshScheduler
+    from .warmup import WarmUpReport
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 1024
+DEFAULT_IDLE_TIMEOUT = 30 * 60 # seconds
+POOL_LOCK_STRIPES = 256 # accounts being created at the same time only wait on each other when their keys collide
+
+
+def close_account(account):
+    try:
+        result = account.close()
+        if inspect.isawaitable(result):
+            import asyncio
+            try:
+                asyncio.get_running_loop().create_task(result)
+            except RuntimeError:
+                result.close()
+    except Exception as e:
+        logger.warning(f"Closing account {account.username} failed: {e!r}")
+
+
+class AccountRegistry:
+    "Bounded LRU registry of live accounts, idle entries are evicted and their sessions closed"
+    def __init__(self, max_size=DEFAULT_POOL_SIZE, idle_timeout=DEFAULT_IDLE_TIMEOUT, on_evict=None):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.on_evict = on_evict # called with every account leaving the registry, before it is closed
+        self._accounts = OrderedDict() # key -> [account, last_used]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._accounts)
+
+    def __contains__(self, key):
+        return key in self._accounts
+
+    def get(self, key):
+        evicted = []
+        now = time.monotonic()
+        with self._lock:
+            entry = self._accounts.get(key)
+            if entry is not None and now - entry[1] > self.idle_timeout:
+                evicted.append(self._accounts.pop(key)[0])
+                entry = None
+            if entry is not None:
+                entry[1] = now
+                self._accounts.move_to_end(key)
+        for account in evicted:
+            self._close(account)
+        return entry[0] if entry is not None else None
+
+    def put(self, key, account):
+        evicted = []
+        now = time.monotonic()
+        with self._lock:
+            previous = self._accounts.pop(key, None)
+            if previous is not None and previous[0] is not account:
+                evicted.append(previous[0])
+            self._accounts[key] = [account, now]
+            evicted += self._evict(now)
+        for account in evicted:
+            self._close(account)
+
+    def touch(self, key, account) -> bool:
+        "Mark the entry as just used without a checkout, returns False if key no longer holds account"
+        now = time.monotonic()
+        with self._lock:
+            entry = self._accounts.get(key)
+            if entry is None or entry[0] is not account or now - entry[1] > self.idle_timeout:
+                return False
+            entry[1] = now
+            self._accounts.move_to_end(key)
+            return True
+
+    def reserve(self, size):
+        "Grow max_size to hold size accounts, e.g. every account warmed up before the session open"
+        with self._lock:
+            if size <= self.max_size:
+                return
+            logger.warning(f"Account pool grows from {self.max_size} to {size} accounts")
+            self.max_size = size
+
+    def remove(self, key):
+        with self._lock:
+            entry = self._accounts.pop(key, None)
+        if entry is not None:
+            self._close(entry[0])
+
+    def evict_idle(self):
+        with self._lock:
+            evicted = self._evict(time.monotonic())
+        for account in evicted:
+            self._close(account)
+        return len(evicted)
+
+    def clear(self):
+        with self._lock:
+            accounts = [entry[0] for entry in self._accounts.values()]
+            self._accounts.clear()
+        for account in accounts:
+            self._close(account)
+
+    def accounts(self):
+        with self._lock:
+            return [entry[0] for entry in self._accounts.values()]
+
+    def _close(self, account):
+        if self.on_evict is not None:
+            try:
+                self.on_evict(account)
+            except Exception as e:
+                logger.warning(f"Eviction hook failed for {account.username}: {e!r}")
+        close_account(account)
+
+    def _evict(self, now):
+        evicted = []
+        # Least recently used entries sit at the front
+        while self._accounts:
+            key, (account, last_used) = next(iter(self._accounts.items()))
+            if len(self._accounts) <= self.max_size and now - last_used <= self.idle_timeout:
+                break
+            del self._accounts[key]
+            evicted.append(account)
+        return evicted
+
 
 class TradingAccountFactory:
-    def __init__(self):
+    def __init__(self, max_pool_size=DEFAULT_POOL_SIZE, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 token_refresher: 'TokenRefreshScheduler' = None, snapshot_store: 'SnapshotStore' = None):
         self._creators = {}
-    
+        self.token_refresher = token_refresher
+        self.snapshot_store = snapshot_store # new pooled accounts are restored from it before logging in
+        self.pool = AccountRegistry(max_pool_size, idle_timeout, on_evict=self._untrack)
+        self._pool_locks = [threading.Lock() for _ in range(POOL_LOCK_STRIPES)]
+        self._creating = {} # key -> asyncio.Future of the async account being created
+
     def register_brokerage(self, brokerage, creator):
+        "creator is a callable or a 'package.module:attribute' path, imported the first time the brokerage is used"
         self._creators[brokerage] = creator
 
-    def get_trading_account(self, brokerage: str, *args, **kwargs) -> BaseTradingAccount:
+    def get_creator(self, brokerage: str):
         if brokerage not in self._creators:
             raise ValueError(f"Brokerage {brokerage} is not supported yet!")
-        return self._creators[brokerage](*args, **kwargs)
-    
+        creator = self._creators[brokerage]
+        if isinstance(creator, str):
+            module_name, _, attribute = creator.partition(":")
+            creator = self._creators[brokerage] = getattr(importlib.import_module(module_name), attribute)
+        return creator
+
+    def get_trading_account(self, brokerage: str, *args, **kwargs) -> 'BaseTradingAccount':
+        return self.get_creator(brokerage)(*args, **kwargs)
+
+    def account_key(self, brokerage: str, *args, **kwargs):
+        arguments = inspect.signature(self.get_creator(brokerage)).bind_partial(*args, **kwargs).arguments
+        return (brokerage, arguments.get("username"), arguments.get("trading_account_id"))
+
+    def _track(self, account):
+        # Pooled accounts that can renew their token proactively are handed to the refresh scheduler
+        if self.token_refresher is not None and hasattr(account, "refresh_access_token"):
+            self.token_refresher.add_account(account)
+
+    def _untrack(self, account):
+        if self.token_refresher is not None:
+            self.token_refresher.remove_account(account)
+
+    def _restore(self, account):
+        if self.snapshot_store is not None:
+            self.snapshot_store.restore(account)
+
+    def _key_lock(self, key):
+        # Striped, a lock per key would never be freed when the registry evicts it
+        return self._pool_locks[hash(key) % POOL_LOCK_STRIPES]
+
+    def get_pooled_trading_account(self, brokerage: str, *args, **kwargs) -> 'BaseTradingAccount':
+        """Return the live, logged in account for (brokerage, username, trading_account_id), creating it on first use.
+
+        The instance and its keep-alive connections are shared by every caller asking for the same key. On checkout a
+        pooled account only goes through ensure_session(), which renews an expired token but does not probe the
+        server: a token revoked early is caught by the 401 of the next request, which logs in again.
+        """
+        key = self.account_key(brokerage, *args, **kwargs)
+        with self._key_lock(key):
+            account = self.pool.get(key)
+            if account is not None:
+                try:
+                    account.ensure_session()
+                    return account
+                except Exception as e:
+                    logger.warning(f"Pooled account {key} failed health check, recreating: {e!r}")
+                    self.pool.remove(key)
+            account = self.get_trading_account(brokerage, *args, **kwargs)
+            self._restore(account)
+            account.ensure_session()
+            self.pool.put(key, account)
+            self._track(account)
+            return account
+
+    async def aget_pooled_trading_account(self, brokerage: str, *args, **kwargs):
+        "get_pooled_trading_account for the async accounts, must be called from the owning event loop"
+        import asyncio
+        key = self.account_key(brokerage, *args, **kwargs)
+        account = self.pool.get(key)
+        if account is not None:
+            try:
+                await account.ensure_session()
+                return account
+            except Exception as e:
+                logger.warning(f"Pooled account {key} failed health check, recreating: {e!r}")
+                self.pool.remove(key)
+        # Single-flight: concurrent checkouts of a key share one creation instead of each logging in, and the
+        # second pool.put closing the account already handed to the first caller
+        creating = self._creating.get(key)
+        if creating is not None:
+            return await asyncio.shield(creating)
+        future = self._creating[key] = asyncio.get_running_loop().create_future()
+        try:
+            account = self.get_trading_account(brokerage, *args, **kwargs)
+            self._restore(account)
+            await account.ensure_session()
+            self.pool.put(key, account)
+            self._track(account)
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                # Retrieve it so an exception nobody else waited on is not reported as never retrieved
+                future.exception()
+            raise
+        finally:
+            del self._creating[key]
+        future.set_result(account)
+        return account
+
+    def evict(self, brokerage: str, username, trading_account_id=None):
+        self.pool.remove((brokerage, username, trading_account_id))
+
+    def save_snapshots(self) -> int:
+        "Write the state of every pooled account to snapshot_store, e.g. periodically and before shutdown"
+        if self.snapshot_store is None:
+            return 0
+        return self.snapshot_store.save_accounts(self.pool.accounts())
+
+    def rehydrate(self, specs, **kwargs) -> 'WarmUpReport':
+        """Recreate the pooled accounts of (brokerage, kwargs) specs at startup from snapshot_store: accounts with a
+        fresh token do not log in again. kwargs go to warmup.warm_up, portfolios are not fetched unless prefetch"""
+        from .warmup import warm_up
+        if self.snapshot_store is not None:
+            self.snapshot_store.preload()
+        return warm_up(specs, factory=self, **{"prefetch": False, **kwargs})
+
+    async def arehydrate(self, specs, **kwargs) -> 'WarmUpReport':
+        "rehydrate for the async accounts"
+        from .warmup import async_warm_up
+        if self.snapshot_store is not None:
+            self.snapshot_store.preload()
+        return await async_warm_up(specs, factory=self, **{"prefetch": False, **kwargs})
+
+# Brokerage modules (and aiohttp for the async ones) are only imported when first used
 trading_account_factory = TradingAccountFactory()
-trading_account_factory.register_brokerage('BSC', BSCTradingAccount)
-trading_account_factory.register_brokerage("CTS", CTSTradingAccount)
\ No newline at end of file
+trading_account_factory.register_brokerage('BSC', "trading_account.bsc_trading_account:BSCTradingAccount")
+trading_account_factory.register_brokerage("CTS", "trading_account.cts_trading_account:CTSTradingAccount")
+
+async_trading_account_factory = TradingAccountFactory()
+async_trading_account_factory.register_brokerage(
+    'BSC', "trading_account.async_bsc_trading_account:AsyncBSCTradingAccount"
+)
+async_trading_account_factory.register_brokerage(
+    "CTS", "trading_account.async_cts_trading_account:AsyncCTSTradingAccount"
+)
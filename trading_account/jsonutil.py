@@ -0,0 +1,48 @@
+"""JSON codec of the brokerage clients: orjson when it is installed, else the standard library.
+
+Parse a response once with loads(resp.content) and pass the result around, instead of calling resp.json() again.
+"""
+import json
+
+try:
+    import orjson
+except ImportError: # optional speedup
+    orjson = None
+
+
+def _orjson_loads(data):
+    try:
+        return orjson.loads(data)
+    except orjson.JSONDecodeError:
+        # NaN/Infinity and integers above 64 bits, which orjson refuses but the brokerages may send
+        return json.loads(data)
+
+
+def _orjson_dumps(obj) -> str:
+    return orjson.dumps(obj).decode()
+
+
+_loads = _orjson_loads if orjson is not None else json.loads
+_dumps = _orjson_dumps if orjson is not None else json.dumps
+
+
+def loads(data):
+    "Decode a JSON document from bytes or str"
+    return _loads(data)
+
+
+def dumps(obj) -> str:
+    return _dumps(obj)
+
+
+def backend() -> str:
+    if _loads is _orjson_loads:
+        return "orjson"
+    return "json" if _loads is json.loads else getattr(_loads, "__module__", "custom")
+
+
+def set_backend(loads=None, dumps=None):
+    "Plug in another codec (e.g. a streaming or SIMD decoder), None restores the default"
+    global _loads, _dumps
+    _loads = loads or (_orjson_loads if orjson is not None else json.loads)
+    _dumps = dumps or (_orjson_dumps if orjson is not None else json.dumps)
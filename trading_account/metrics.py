@@ -0,0 +1,215 @@
+import bisect
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlencode, urlsplit
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REQUEST_SECONDS = "brokerage_request_seconds"
+REQUEST_BYTES = "brokerage_request_bytes_total"
+RESPONSE_BYTES = "brokerage_response_bytes_total"
+RETRIES = "brokerage_retries_total"
+RELOGINS = "brokerage_relogins_total"
+LOGIN_SECONDS = "brokerage_login_seconds"
+OTP_SECONDS = "brokerage_otp_seconds"
+CACHE_REQUESTS = "trading_account_cache_requests_total"
+
+_id_segment = re.compile(r"^[^/]*\d[^/]*$")
+
+
+def endpoint_label(url: str) -> str:
+    "URL path with ids replaced, e.g. /accounts/{id}/ordersHistory, so labels stay low cardinality"
+    path = urlsplit(url).path
+    return "/".join("{id}" if _id_segment.match(segment) else segment for segment in path.split("/"))
+
+
+def body_size(data) -> int:
+    "Bytes sent for a request body, form fields are encoded the way requests and aiohttp send them"
+    if isinstance(data, str):
+        data = data.encode()
+    elif isinstance(data, (dict, list, tuple)):
+        data = urlencode(data, doseq=True).encode()
+    if isinstance(data, (bytes, bytearray)):
+        return len(data)
+    return 0
+
+
+def record_request(metrics, brokerage, method, url, data, status, response_bytes, retries, elapsed):
+    endpoint = endpoint_label(url)
+    metrics.observe(REQUEST_SECONDS, elapsed, brokerage=brokerage, endpoint=endpoint, method=method, status=status)
+    metrics.increment(REQUEST_BYTES, body_size(data), brokerage=brokerage, endpoint=endpoint)
+    metrics.increment(RESPONSE_BYTES, response_bytes, brokerage=brokerage, endpoint=endpoint)
+    if retries:
+        metrics.increment(RETRIES, retries, brokerage=brokerage, endpoint=endpoint)
+
+
+class MetricsExporter:
+    "No-op exporter, the default: instrumented code checks enabled before measuring anything"
+    enabled = False
+
+    def observe(self, name: str, value: float, **labels):
+        pass
+
+    def increment(self, name: str, value: float = 1, **labels):
+        pass
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+
+def _key(name, labels) -> tuple:
+    # Label values as text, so keys of a mixed None/str label still sort
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class InMemoryExporter(MetricsExporter):
+    "Keeps counters and histograms in the process, read them with snapshot()"
+    enabled = True
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counters = {} # (name, labels) -> value
+        self._histograms = {} # (name, labels) -> _Histogram
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(self.buckets)
+            histogram.observe(value)
+
+    def increment(self, name: str, value: float = 1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def counter(self, name: str, **labels) -> float:
+        "Sum of the counter over every label set matching labels"
+        wanted = set(_key(name, labels)[1])
+        with self._lock:
+            return sum(
+                value for (n, key_labels), value in self._counters.items() if n == name and wanted <= set(key_labels)
+            )
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counters": {key: value for key, value in self._counters.items()},
+                "histograms": {
+                    key: {"count": h.count, "sum": h.sum, "buckets": dict(zip(h.buckets + (float("inf"),), h.counts))}
+                    for key, h in self._histograms.items()
+                },
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+def _labels_text(labels, extra=()) -> str:
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    escaped = (
+        f'{k}="' + str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"' for k, v in items
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+class PrometheusExporter(InMemoryExporter):
+    "InMemoryExporter that renders the Prometheus text exposition format, e.g. for a /metrics handler"
+    def render(self) -> str:
+        lines = []
+        snapshot = self.snapshot()
+        typed = set()
+        for (name, labels), value in sorted(snapshot["counters"].items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_labels_text(labels)} {value}")
+        for (name, labels), histogram in sorted(snapshot["histograms"].items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, count in histogram["buckets"].items():
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append(f"{name}_bucket{_labels_text(labels, [('le', le)])} {cumulative}")
+            lines.append(f"{name}_sum{_labels_text(labels)} {histogram['sum']}")
+            lines.append(f"{name}_count{_labels_text(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+
+class LoggingExporter(MetricsExporter):
+    "Logs every measurement, for debugging a single account"
+    enabled = True
+
+    def __init__(self, level=logging.INFO, log=logger):
+        self.level = level
+        self.log = log
+
+    def observe(self, name: str, value: float, **labels):
+        self.log.log(self.level, f"{name} {value:.6f} {labels}")
+
+    def increment(self, name: str, value: float = 1, **labels):
+        self.log.log(self.level, f"{name} +{value} {labels}")
+
+
+class MultiExporter(MetricsExporter):
+    enabled = True
+
+    def __init__(self, *exporters: MetricsExporter):
+        self.exporters = [exporter for exporter in exporters if exporter.enabled]
+
+    def observe(self, name: str, value: float, **labels):
+        for exporter in self.exporters:
+            exporter.observe(name, value, **labels)
+
+    def increment(self, name: str, value: float = 1, **labels):
+        for exporter in self.exporters:
+            exporter.increment(name, value, **labels)
+
+
+_exporter = MetricsExporter()
+
+
+def get_exporter() -> MetricsExporter:
+    return _exporter
+
+
+def set_exporter(exporter: MetricsExporter = None):
+    "Install the process-wide exporter, None restores the no-op default"
+    global _exporter
+    _exporter = exporter or MetricsExporter()
@@ -0,0 +1,215 @@
+import dataclasses
+import logging
+import os
+import threading
+import uuid
+from typing import Iterable, List
+
+from .datatypes import Order
+from .db import get_engine, sqlite_uri
+from .token_store import token_db_uri
+from .write_behind import WriteBehindQueue
+
+# SQLAlchemy is imported on first use, importing this module stays cheap
+
+logger = logging.getLogger(__name__)
+
+ORDER_FIELDS = tuple(f.name for f in dataclasses.fields(Order))
+# A row keeps the client id it was inserted with
+UPDATE_FIELDS = tuple(name for name in ORDER_FIELDS if name != "client_order_id")
+
+_order_table = None
+
+
+def order_table():
+    global _order_table
+    if _order_table is None:
+        from sqlalchemy import Boolean, Column, DateTime, Float, Integer, MetaData, String, Table, Text
+        _order_table = Table(
+            Order.__table_name__,
+            MetaData(),
+            Column("row_id", Integer, primary_key=True, autoincrement=True),
+            Column("id", String(64), index=True), # broker order id, None for orders rejected before reaching it
+            Column("copy_from_order_id", String(64), index=True),
+            Column("trading_account_id", String(64), index=True),
+            Column("symbol", String(16)),
+            Column("quantity", Float),
+            Column("portfolio_proportion", Float),
+            Column("trade_type", String(8)),
+            Column("order_type", String(8)),
+            Column("price", Float),
+            Column("avg_matched_price", Float),
+            Column("matched_quantity", Float),
+            Column("created_at", DateTime),
+            Column("matched_at", DateTime),
+            Column("type", String(8)),
+            Column("status", String(16)),
+            Column("revived", Boolean),
+            Column("reject_reason", Text),
+            Column("client_order_id", String(32), unique=True),
+        )
+    return _order_table
+
+
+def assign_client_order_id(order: Order) -> str:
+    "Gives the order the id of its row on first save, so saving it again after the broker id is known updates that row"
+    if order.client_order_id is None:
+        order.client_order_id = uuid.uuid4().hex
+    return order.client_order_id
+
+
+def order_key(order: Order):
+    # An order is identified by its broker id, or while it has none (rejected orders) by its client id
+    if order.id is not None:
+        return (order.trading_account_id, order.id)
+    return order.client_order_id
+
+
+def order_row(order: Order) -> dict:
+    return {name: getattr(order, name) for name in ORDER_FIELDS}
+
+
+class OrderStore:
+    "Batched persistence of Order rows into copy_trading_order"
+    def __init__(self, uri: str = None, create_table=False):
+        self.engine = get_engine(uri or os.environ.get("ORDER_DB_URI") or token_db_uri())
+        if create_table:
+            self.create_table()
+
+    def create_table(self):
+        order_table().metadata.create_all(self.engine)
+
+    def save_many(self, orders: Iterable[Order]) -> int:
+        """Upsert orders in one transaction: one select, one executemany update and one multi-row insert.
+
+        Returns the number of rows written, the last state of an order repeated in the batch wins.
+        """
+        from sqlalchemy import bindparam, or_, select, update
+        by_client_id = {}
+        for order in orders:
+            # Copies of one object queued by the write-behind store share its client id, the last one wins
+            client_id = assign_client_order_id(order)
+            by_client_id.pop(client_id, None)
+            by_client_id[client_id] = order
+        # Different objects for the same broker order (e.g. reloaded from the order history) are one row too
+        latest = {}
+        for order in by_client_id.values():
+            key = order_key(order)
+            client_ids = latest[key][1] if key in latest else []
+            latest[key] = (order, client_ids + [order.client_order_id])
+        if not latest:
+            return 0
+        table = order_table()
+        account_ids = {order.trading_account_id for order, _ in latest.values()}
+        ids = {order.id for order, _ in latest.values() if order.id is not None}
+        with self.engine.begin() as conn:
+            conditions = [table.c.client_order_id.in_(list(by_client_id))]
+            if ids:
+                conditions.append(table.c.trading_account_id.in_(account_ids) & table.c.id.in_(ids))
+            rows = conn.execute(
+                select(table.c.row_id, table.c.trading_account_id, table.c.id, table.c.client_order_id)
+                .where(or_(*conditions))
+            ).all()
+            row_by_client_id = {row[3]: row[0] for row in rows if row[3] is not None}
+            row_by_id = {(row[1], row[2]): row[0] for row in rows if row[2] is not None}
+            updates = []
+            inserts = []
+            for order, client_ids in latest.values():
+                # The row saved before the broker gave the order an id, then the row of the same broker order
+                # saved from another object
+                row_id = next((row_by_client_id[c] for c in client_ids if c in row_by_client_id), None)
+                if row_id is None and order.id is not None:
+                    row_id = row_by_id.get((order.trading_account_id, order.id))
+                if row_id is None:
+                    inserts.append(order_row(order))
+                else:
+                    values = {f"b_{name}": getattr(order, name) for name in UPDATE_FIELDS}
+                    updates.append({"b_row_id": row_id, **values})
+            if updates:
+                conn.execute(
+                    update(table)
+                    .where(table.c.row_id == bindparam("b_row_id"))
+                    .values({name: bindparam(f"b_{name}") for name in UPDATE_FIELDS}),
+                    updates,
+                )
+            if inserts:
+                conn.execute(table.insert(), inserts)
+        return len(latest)
+
+    def save(self, order: Order):
+        self.save_many([order])
+
+    def load(self, trading_account_id: str = None, copy_from_order_id: str = None) -> List[Order]:
+        from sqlalchemy import select
+        table = order_table()
+        query = select(*[table.c[name] for name in ORDER_FIELDS]).order_by(table.c.row_id)
+        if trading_account_id is not None:
+            query = query.where(table.c.trading_account_id == trading_account_id)
+        if copy_from_order_id is not None:
+            query = query.where(table.c.copy_from_order_id == copy_from_order_id)
+        with self.engine.connect() as conn:
+            return [Order(**dict(zip(ORDER_FIELDS, row))) for row in conn.execute(query)]
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLiteOrderStore(OrderStore):
+    "Local stand-in for the MySQL database, in memory by default"
+    def __init__(self, path: str = ":memory:"):
+        super().__init__(sqlite_uri(path), create_table=True)
+
+
+class WriteBehindOrderStore:
+    """Queues order writes for a background writer that upserts them in batches.
+
+    An order is copied when queued, so later changes to the object are only persisted by saving it again.
+    save() blocks while max_size orders wait to be written.
+    """
+    def __init__(self, store: OrderStore, max_batch=1000, flush_interval=0.5, max_size=100000):
+        self.store = store
+        self.queue = WriteBehindQueue(store.save_many, max_batch, flush_interval, max_size, name="order-store-writer")
+
+    def save(self, order: Order, block=True, timeout=None):
+        # The client id goes on the caller's object, the queued copy and later saves of the object share it
+        assign_client_order_id(order)
+        self.queue.put(dataclasses.replace(order), block=block, timeout=timeout)
+
+    def save_many(self, orders: Iterable[Order]):
+        for order in orders:
+            self.save(order)
+
+    def load(self, trading_account_id: str = None, copy_from_order_id: str = None) -> List[Order]:
+        "Reads what was already written, call flush() first to include the queued orders"
+        return self.store.load(trading_account_id, copy_from_order_id)
+
+    def create_table(self):
+        self.store.create_table()
+
+    def flush(self):
+        self.queue.flush()
+
+    def close(self):
+        self.queue.close()
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_default_order_store() -> WriteBehindOrderStore:
+    "Write-behind store over ORDER_DB_URI (the TOKEN_DB_* database by default), built on first use"
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = WriteBehindOrderStore(OrderStore())
+        return _default_store
+
+
+def set_default_order_store(store):
+    global _default_store
+    with _default_store_lock:
+        _default_store = store
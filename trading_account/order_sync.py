@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+from typing import List
+
+from .datatypes import Order
+
+SEEN_RETENTION = timedelta(days=1) # how long an order fingerprint is kept after its last update
+
+
+def order_fingerprint(order: Order):
+    return (order.status, order.quantity, order.price, order.matched_quantity, order.avg_matched_price)
+
+
+class OrderSyncState:
+    "Per-account watermark (latest lastModified/updDateTime seen) and the fingerprint of every order seen since"
+    def __init__(self, watermark: datetime = None):
+        self.watermark = watermark
+        self._seen = {} # order id -> (fingerprint, updated_at)
+
+    def since(self, default: datetime) -> datetime:
+        return self.watermark or default
+
+    def update(self, orders: List[Order], updated_at: List[datetime]) -> List[Order]:
+        "Record a fetched page and return only the orders that are new or changed since the last sync"
+        changed = []
+        watermark = self.watermark
+        for order, order_updated_at in zip(orders, updated_at):
+            fingerprint = order_fingerprint(order)
+            previous = self._seen.get(order.id)
+            if previous is None or previous[0] != fingerprint:
+                changed.append(order)
+            self._seen[order.id] = (fingerprint, order_updated_at)
+            if watermark is None or order_updated_at > watermark:
+                watermark = order_updated_at
+        self.watermark = watermark
+        if watermark is not None:
+            cutoff = watermark - SEEN_RETENTION
+            for order_id in [k for k, (_, t) in self._seen.items() if t < cutoff]:
+                del self._seen[order_id]
+        return changed
+
+    def reset(self):
+        self.watermark = None
+        self._seen.clear()
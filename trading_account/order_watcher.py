@@ -0,0 +1,222 @@
+import asyncio
+import heapq
+import inspect
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Dict, List, Literal
+
+from .base_trading_account import BaseTradingAccount
+from .datatypes import Order
+
+logger = logging.getLogger(__name__)
+
+FAST_INTERVAL = 1.0 # seconds between polls while an account has placing orders
+IDLE_INTERVAL = 5.0 # first poll interval once an account has no placing orders
+MAX_INTERVAL = 30.0
+BACKOFF = 2.0
+
+
+@dataclass
+class OrderEvent:
+    kind: Literal['fill', 'partial_fill', 'cancel', 'reject']
+    trading_account_id: str
+    order: Order
+    previous: Order = None # last known state of the order, None when first seen
+    detected_at: datetime = field(default_factory=datetime.now)
+
+
+def order_events(order: Order, previous: Order = None) -> List[OrderEvent]:
+    previous_status = previous.status if previous else 'placing'
+    previous_matched = previous.matched_quantity if previous else 0
+    if order.status == 'rejected' and previous_status != 'rejected':
+        return [OrderEvent('reject', order.trading_account_id, order, previous)]
+    if order.status == 'cancelled' and previous_status != 'cancelled':
+        return [OrderEvent('cancel', order.trading_account_id, order, previous)]
+    if order.matched_quantity > previous_matched or (order.status == 'matched' and previous_status != 'matched'):
+        kind = 'fill' if order.status == 'matched' else 'partial_fill'
+        return [OrderEvent(kind, order.trading_account_id, order, previous)]
+    return []
+
+
+class _WatchedAccount:
+    def __init__(self, account: BaseTradingAccount):
+        self.account = account
+        self.orders: Dict[str, Order] = {} # last known state of every order that was placing
+        self.interval = FAST_INTERVAL
+        self.polling = False
+        self.primed = False # the first poll only records the current state, past fills are not reported
+        self.seq = None # seq of the live schedule entry, older heap entries are skipped
+
+    @property
+    def has_open_orders(self):
+        return any(order.status == 'placing' for order in self.orders.values())
+
+
+def _check_account(account):
+    if inspect.iscoroutinefunction(account.sync_orders):
+        raise TypeError(f"OrderWatcher polls from threads, {type(account).__name__} is an async account")
+
+
+class OrderWatcher:
+    """Polls many accounts from one scheduler thread and emits fill/cancel/reject events.
+
+    Accounts with placing orders are polled every fast_interval, the others back off from idle_interval up to
+    max_interval. Each poll is one account.sync_orders() call, so only changed orders are transferred.
+    Only sync accounts can be watched, async ones are rejected with a TypeError.
+    """
+    def __init__(self, fast_interval=FAST_INTERVAL, idle_interval=IDLE_INTERVAL, max_interval=MAX_INTERVAL,
+                 backoff=BACKOFF, max_workers=32):
+        self.fast_interval = fast_interval
+        self.idle_interval = idle_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self._accounts: Dict[int, _WatchedAccount] = {}
+        self._schedule = [] # heap of (due, seq, account key)
+        self._seq = itertools.count()
+        self._callbacks: List[Callable[[OrderEvent], None]] = []
+        self._iterators = [] # (loop, queue) of the running events() iterators
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="order-watcher")
+        self._thread = None
+        self._running = False
+
+    def add_account(self, account: BaseTradingAccount):
+        _check_account(account)
+        with self._condition:
+            if id(account) in self._accounts:
+                return
+            self._accounts[id(account)] = _WatchedAccount(account)
+            self._push(id(account), 0)
+
+    def remove_account(self, account: BaseTradingAccount):
+        with self._condition:
+            self._accounts.pop(id(account), None)
+
+    def watch_order(self, account: BaseTradingAccount, order: Order):
+        "Register an order we just placed so its account is polled at the fast rate right away"
+        _check_account(account)
+        with self._condition:
+            watched = self._accounts.get(id(account))
+            if watched is None:
+                watched = self._accounts[id(account)] = _WatchedAccount(account)
+                self._push(id(account), 0)
+            if order.id is not None:
+                watched.orders.setdefault(order.id, order)
+            if watched.interval > self.fast_interval:
+                watched.interval = self.fast_interval
+                self._push(id(account), self.fast_interval)
+
+    def subscribe(self, callback: Callable[[OrderEvent], None]):
+        self._callbacks.append(callback)
+
+    def unsubscribe(self, callback: Callable[[OrderEvent], None]):
+        self._callbacks.remove(callback)
+
+    async def events(self):
+        "Async iterator over the events, for consumers running on an event loop"
+        iterator = (asyncio.get_running_loop(), asyncio.Queue())
+        self._iterators.append(iterator)
+        try:
+            while True:
+                event = await iterator[1].get()
+                if event is None: # stop() was called
+                    return
+                yield event
+        finally:
+            self._iterators.remove(iterator)
+
+    def start(self):
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name="order-watcher-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, wait=True):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread is not None and wait:
+            self._thread.join()
+        self._executor.shutdown(wait=wait)
+        for loop, queue in list(self._iterators):
+            loop.call_soon_threadsafe(queue.put_nowait, None)
+
+    def poll(self, account: BaseTradingAccount) -> List[OrderEvent]:
+        "Poll one account now and return (and emit) the events found"
+        _check_account(account)
+        with self._condition:
+            watched = self._accounts.get(id(account)) or _WatchedAccount(account)
+        changed = account.sync_orders()
+        events = []
+        with self._condition:
+            for order in changed:
+                previous = watched.orders.get(order.id)
+                if watched.primed or previous is not None:
+                    events += order_events(order, previous)
+                if order.status == 'placing':
+                    watched.orders[order.id] = order
+                else:
+                    watched.orders.pop(order.id, None)
+            watched.primed = True
+        for event in events:
+            self._emit(event)
+        return events
+
+    def _push(self, key, delay):
+        # Must hold self._condition
+        seq = next(self._seq)
+        self._accounts[key].seq = seq
+        heapq.heappush(self._schedule, (time.monotonic() + delay, seq, key))
+        self._condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and (not self._schedule or self._schedule[0][0] > time.monotonic()):
+                    timeout = self._schedule[0][0] - time.monotonic() if self._schedule else None
+                    self._condition.wait(timeout)
+                if not self._running:
+                    return
+                _, seq, key = heapq.heappop(self._schedule)
+                watched = self._accounts.get(key)
+                # Superseded entries are dropped, a running poll reschedules the account when it finishes
+                if watched is None or watched.seq != seq or watched.polling:
+                    continue
+                watched.polling = True
+            self._executor.submit(self._poll, key, watched)
+
+    def _poll(self, key, watched: _WatchedAccount):
+        failed = False
+        try:
+            self.poll(watched.account)
+        except Exception as e:
+            failed = True
+            logger.error(f"Polling orders of {watched.account.trading_account_id} failed: {e!r}")
+        with self._condition:
+            watched.polling = False
+            if self._accounts.get(key) is not watched:
+                return
+            if watched.has_open_orders and not failed:
+                watched.interval = self.fast_interval
+            elif watched.interval < self.idle_interval:
+                watched.interval = self.idle_interval
+            else:
+                watched.interval = min(watched.interval * self.backoff, self.max_interval)
+            if self._running:
+                self._push(key, watched.interval)
+
+    def _emit(self, event: OrderEvent):
+        for loop, queue in list(self._iterators):
+            loop.call_soon_threadsafe(queue.put_nowait, event)
+        for callback in list(self._callbacks):
+            try:
+                callback(event)
+            except Exception as e:
+                logger.error(f"Order event callback {callback} failed: {e!r}")
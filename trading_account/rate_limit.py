@@ -0,0 +1,176 @@
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+ORDER = 'order' # place/cancel and everything on the order path
+QUERY = 'query' # portfolio, history and other reads
+LANES = (ORDER, QUERY)
+
+DEFAULT_RATE = 10.0 # requests per second, for a host configured without a rate
+DEFAULT_BURST = 20
+DEFAULT_ORDER_RESERVE = 2 # tokens queries may not take, so an order arriving during a sweep finds one ready
+
+
+def host_of(url: str) -> str:
+    "Hostname of a url or of a bare host[:port], limits apply to every port of a host"
+    parts = urlsplit(url if "//" in url else f"//{url}")
+    return parts.hostname or url
+
+
+def request_priority(method: str) -> str:
+    return QUERY if method.upper() in ('GET', 'HEAD', 'OPTIONS') else ORDER
+
+
+class LaneStats:
+    __slots__ = ('requests', 'waited', 'total_wait', 'max_wait', 'waiting')
+
+    def __init__(self):
+        self.requests = 0
+        self.waited = 0 # requests that had to queue
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.waiting = 0 # currently queued
+
+    def as_dict(self) -> dict:
+        return {
+            'requests': self.requests,
+            'waited': self.waited,
+            'avg_wait': self.total_wait / self.requests if self.requests else 0.0,
+            'max_wait': self.max_wait,
+            'waiting': self.waiting,
+        }
+
+
+class TokenBucket:
+    """Token bucket shared by every request to one host, with strict priority of the order lane.
+
+    A query only gets a token when no order is waiting and more than order_reserve tokens are left,
+    so orders wait at most one refill interval (1 / rate) no matter how many queries are queued.
+    """
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST, order_reserve=DEFAULT_ORDER_RESERVE):
+        self.rate = rate
+        self.burst = burst
+        self.order_reserve = min(order_reserve, burst - 1)
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._condition = threading.Condition()
+        self.stats = {lane: LaneStats() for lane in LANES}
+
+    def _take(self, lane) -> float:
+        # Must hold self._condition. Returns 0 when a token was taken, else the time to wait for one
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        needed = 1 if lane == ORDER else 1 + self.order_reserve
+        if lane == QUERY and self.stats[ORDER].waiting:
+            return 1 / self.rate
+        if self._tokens >= needed:
+            self._tokens -= 1
+            return 0
+        return (needed - self._tokens) / self.rate
+
+    def _record(self, lane, waited: float, queued: bool):
+        stats = self.stats[lane]
+        stats.requests += 1
+        if queued:
+            stats.waited += 1
+            stats.total_wait += waited
+            stats.max_wait = max(stats.max_wait, waited)
+
+    def acquire(self, lane=QUERY) -> float:
+        "Block until the request may be sent, returns the time spent waiting"
+        started = time.monotonic()
+        with self._condition:
+            delay = queued = self._take(lane)
+            if delay:
+                self.stats[lane].waiting += 1
+                try:
+                    while delay:
+                        self._condition.wait(delay)
+                        delay = self._take(lane)
+                finally:
+                    self.stats[lane].waiting -= 1
+                    # A query blocked on this order may go now
+                    self._condition.notify_all()
+            waited = time.monotonic() - started
+            self._record(lane, waited, bool(queued))
+        return waited
+
+    async def aacquire(self, lane=QUERY) -> float:
+        "acquire() for coroutines, sleeps on the event loop instead of blocking it"
+        import asyncio
+        started = time.monotonic()
+        with self._condition:
+            delay = queued = self._take(lane)
+            if delay:
+                self.stats[lane].waiting += 1
+        if delay:
+            try:
+                while delay:
+                    await asyncio.sleep(delay)
+                    with self._condition:
+                        delay = self._take(lane)
+            finally:
+                with self._condition:
+                    self.stats[lane].waiting -= 1
+                    self._condition.notify_all()
+        waited = time.monotonic() - started
+        with self._condition:
+            self._record(lane, waited, bool(queued))
+        return waited
+
+
+class RateLimiter:
+    """One TokenBucket per brokerage hostname, created on first use with the limits configured for it.
+
+    Limiting is opt-in: requests to a host that was not configured are not limited, unless the limiter was
+    created with default limits (rate=...) for every host.
+    """
+    def __init__(self, rate=None, burst=DEFAULT_BURST, order_reserve=DEFAULT_ORDER_RESERVE):
+        self.defaults = (rate, burst, order_reserve) if rate is not None else None
+        self._limits: Dict[str, tuple] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, host: str, rate=DEFAULT_RATE, burst=DEFAULT_BURST, order_reserve=DEFAULT_ORDER_RESERVE):
+        "Limit requests to host (a hostname or url, the port is ignored), rate=None removes the limit"
+        host = host_of(host)
+        with self._lock:
+            if rate is None:
+                self._limits.pop(host, None)
+            else:
+                self._limits[host] = (rate, burst, order_reserve)
+            self._buckets.pop(host, None)
+
+    def bucket(self, url: str) -> Optional[TokenBucket]:
+        "Bucket of the host of url, None when it is not limited"
+        host = host_of(url)
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            limits = self._limits.get(host, self.defaults)
+            if limits is None:
+                return None
+            with self._lock:
+                bucket = self._buckets.get(host)
+                if bucket is None:
+                    bucket = self._buckets[host] = TokenBucket(*limits)
+        return bucket
+
+    def acquire(self, url: str, lane=QUERY) -> float:
+        bucket = self.bucket(url)
+        return bucket.acquire(lane) if bucket is not None else 0.0
+
+    async def aacquire(self, url: str, lane=QUERY) -> float:
+        bucket = self.bucket(url)
+        return await bucket.aacquire(lane) if bucket is not None else 0.0
+
+    def stats(self) -> dict:
+        "Queue-wait metrics per host and lane"
+        return {
+            host: {lane: stats.as_dict() for lane, stats in bucket.stats.items()}
+            for host, bucket in list(self._buckets.items())
+        }
+
+
+rate_limiter = RateLimiter() # shared by every account of the process, configure() the hosts to limit
@@ -0,0 +1,140 @@
+import logging
+from datetime import datetime
+from typing import Callable, Dict, List, Union
+
+from .columnar import PortfolioFrame
+from .datatypes import Order, Portfolio, LOT_SIZE, hose_tick_size
+
+logger = logging.getLogger(__name__)
+
+
+def master_weights(master: Portfolio) -> Dict[str, float]:
+    "Share of the master's total assets held in each symbol"
+    weights = {}
+    if not master.total_assets:
+        return weights
+    for allocation in master.stock_allocations or ():
+        weights[allocation.symbol] = weights.get(allocation.symbol, 0) + allocation.current_value / master.total_assets
+    return weights
+
+
+def rebalance(
+    master: Portfolio,
+    followers: Union[Dict[str, Portfolio], PortfolioFrame],
+    prices: Dict[str, float] = None,
+    lot_size: int = LOT_SIZE,
+    copy_from_order_id: Union[str, Dict[str, str]] = None,
+    order_type: str = 'LO',
+    liquidate: bool = True,
+    cash_buffer: float = 0,
+    tick_size: Callable[[float], float] = hose_tick_size,
+) -> Dict[str, List[Order]]:
+    """Orders moving every follower to the master's stock weights, computed for all followers in one NumPy pass.
+
+    followers maps trading_account_id to Portfolio (or is a PortfolioFrame). prices maps symbol to price (ĐVT: Nghìn
+    đồng); a missing price is taken from the master's current_value / quantity, else the followers' average, rounded
+    to the nearest tick_size(price) so the limit order is valid, and a symbol without any price is left untouched.
+    Sells are capped by available_quantity. Buys of a follower are scaled down together to fit
+    available_cash * (1 - cash_buffer), since sale proceeds settle later. All quantities are rounded down to
+    lot_size. With liquidate, symbols the master does not hold are sold.
+    copy_from_order_id is the master order id, or symbol -> master order id.
+
+    Returns trading_account_id -> sells then buys, only for followers that have something to trade.
+    """
+    import numpy as np
+
+    frame = followers if isinstance(followers, PortfolioFrame) else PortfolioFrame.from_portfolios(followers)
+    if not len(frame):
+        return {}
+    weights = master_weights(master)
+    symbols = list(dict.fromkeys(list(weights) + (frame.symbol if liquidate else [])))
+    if not symbols:
+        return {}
+    index = {symbol: i for i, symbol in enumerate(symbols)}
+    accounts, width = len(frame), len(symbols)
+
+    # Allocations -> (follower, symbol) matrices
+    rows = np.array(frame.allocation_account, dtype=np.intp)
+    cols = np.fromiter((index.get(symbol, -1) for symbol in frame.symbol), dtype=np.intp, count=len(frame.symbol))
+    value = np.array(frame.current_value, dtype=np.float64)
+    total_assets = np.array(frame.total_cash, dtype=np.float64) + np.bincount(rows, value, minlength=accounts)
+    held = cols >= 0
+    rows, cols, value = rows[held], cols[held], value[held]
+    cells = rows * width + cols
+
+    def matrix(column):
+        values = np.array(column, dtype=np.float64)[held]
+        return np.bincount(cells, values, minlength=accounts * width).reshape(accounts, width)
+
+    quantity = matrix(frame.quantity)
+    available_quantity = matrix(frame.available_quantity)
+
+    # One price per symbol: given, else the master's, else the followers' average
+    price = np.full(width, np.nan)
+    for allocation in master.stock_allocations or ():
+        if allocation.quantity:
+            price[index[allocation.symbol]] = allocation.current_value / allocation.quantity
+    held_quantity = np.bincount(cols, np.array(frame.quantity, dtype=np.float64)[held], minlength=width)
+    held_value = np.bincount(cols, value, minlength=width)
+    average = np.divide(held_value, held_quantity, out=np.full(width, np.nan), where=held_quantity > 0)
+    price = np.where(np.isnan(price), average, price)
+    # Valuations are not on the price grid of the exchange
+    derived = np.isfinite(price) & (price > 0)
+    ticks = np.array([tick_size(p) if ok else 1.0 for p, ok in zip(price.tolist(), derived.tolist())])
+    price = np.where(derived, np.round(np.round(price / ticks) * ticks, 6), price)
+    for symbol, symbol_price in (prices or {}).items():
+        if symbol in index:
+            price[index[symbol]] = symbol_price
+    priced = np.isfinite(price) & (price > 0)
+    price = np.where(priced, price, 0)
+
+    target_weight = np.array([weights.get(symbol, 0) for symbol in symbols])
+    target = np.divide(
+        target_weight * total_assets[:, None], price, out=np.zeros((accounts, width)), where=priced
+    )
+    delta = np.where(priced, target - quantity, 0)
+
+    sell = np.floor(np.minimum(np.clip(-delta, 0, None), available_quantity) / lot_size) * lot_size
+    buy = np.floor(np.clip(delta, 0, None) / lot_size) * lot_size
+    cost = buy @ price
+    budget = np.clip(np.array(frame.available_cash, dtype=np.float64) * (1 - cash_buffer), 0, None)
+    scale = np.divide(budget, cost, out=np.ones(accounts), where=cost > budget)
+    buy = np.floor(buy * scale[:, None] / lot_size) * lot_size
+
+    now = datetime.now()
+    prices_ = price.tolist()
+    if isinstance(copy_from_order_id, dict):
+        copied_from = [copy_from_order_id.get(symbol) for symbol in symbols]
+    else:
+        copied_from = [copy_from_order_id] * width
+    orders: Dict[str, List[Order]] = {}
+    for trade_type, traded in (('sell', sell), ('buy', buy)):
+        order_rows, order_cols = np.nonzero(traded)
+        order_quantity = traded[order_rows, order_cols]
+        proportion = np.divide(
+            order_quantity * price[order_cols], total_assets[order_rows],
+            out=np.zeros(len(order_rows)), where=total_assets[order_rows] > 0,
+        )
+        for row, col, qty, portfolio_proportion in zip(
+            order_rows.tolist(), order_cols.tolist(), order_quantity.astype(np.int64).tolist(), proportion.tolist()
+        ):
+            trading_account_id = frame.account_ids[row]
+            order = Order(
+                symbol=symbols[col],
+                quantity=qty,
+                trading_account_id=trading_account_id,
+                portfolio_proportion=portfolio_proportion,
+                trade_type=trade_type,
+                order_type=order_type,
+                price=prices_[col],
+                copy_from_order_id=copied_from[col],
+                type='limit',
+                created_at=now,
+            )
+            account_orders = orders.get(trading_account_id)
+            if account_orders is None:
+                orders[trading_account_id] = [order]
+            else:
+                account_orders.append(order)
+    logger.debug(f"Rebalanced {accounts} followers over {width} symbols into {sum(map(len, orders.values()))} orders")
+    return orders
@@ -0,0 +1,244 @@
+import logging
+import threading
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Literal, Union
+
+from .datatypes import Order, LOT_SIZE
+
+logger = logging.getLogger(__name__)
+
+ISSUES = ('missing', 'partial', 'rejected', 'over_filled')
+
+
+@dataclass
+class CopyStatus:
+    "State of the copies of one master order on one follower"
+    kind: Literal['ok', 'missing', 'partial', 'rejected', 'over_filled']
+    master_order_id: str
+    trading_account_id: str
+    expected_quantity: float = None # quantity the follower should have bought/sold, None if not known
+    placed_quantity: float = 0 # of the copies not rejected
+    matched_quantity: float = 0
+    target_quantity: float = 0 # quantity that should be matched by now, given how much of the master is matched
+    copies: List[Order] = field(default_factory=list)
+
+
+@dataclass
+class ReconciliationReport:
+    missing: List[CopyStatus]
+    partial: List[CopyStatus]
+    rejected: List[CopyStatus]
+    over_filled: List[CopyStatus]
+
+    @property
+    def issues(self) -> List[CopyStatus]:
+        return self.missing + self.partial + self.rejected + self.over_filled
+
+    def summary(self) -> str:
+        return ", ".join(f"{len(getattr(self, kind))} {kind}" for kind in ISSUES)
+
+
+class _Expectation:
+    __slots__ = ('quantity', 'copies')
+
+    def __init__(self, quantity):
+        self.quantity = quantity
+        self.copies: Dict[str, Order] = {} # broker id (None for a copy rejected before reaching it) -> latest state
+
+
+class Reconciler:
+    """Matches follower orders to the master orders they copy, and reports the followers whose copy is missing,
+    partially matched, rejected or over-filled.
+
+    Every order is looked up in hash indexes instead of scanning the followers' order lists:
+      - by id: the master orders, and the master each known copy belongs to (order() gives the latest state)
+      - by copy_from_order_id: master id -> follower -> copies
+      - by (trading_account_id, symbol, trade_type): followers still waiting for a copy. Broker listings
+        (get_current_orders, sync_orders) carry no copy_from_order_id, an unknown order there is taken as the copy
+        of the oldest master of the same symbol and side the follower has none for yet, e.g. one whose
+        place_order timed out after reaching the broker.
+    update() touches only the orders it is given and report() only re-evaluates the (master, follower) pairs they
+    changed, so feeding order snapshots of 10k followers stays linear. It can be fed from an OrderWatcher:
+    watcher.subscribe(lambda event: reconciler.update([event.order])).
+
+    A follower should have matched as large a share of its copy as the master has matched of the master order,
+    rounded down to lot_size; keep the master state current by passing its snapshots to update() as well.
+    """
+    def __init__(self, lot_size: int = LOT_SIZE):
+        self.lot_size = lot_size
+        self.masters: Dict[str, Order] = {}
+        self.expected: Dict[str, Dict[str, _Expectation]] = {} # master id -> follower -> copies
+        self.copy_of: Dict[str, tuple] = {} # broker id of a copy -> (master id, follower)
+        # (follower, symbol, trade_type) -> ids of the masters it had no copy of yet, oldest first
+        self._waiting = defaultdict(deque)
+        self._kinds: Dict[tuple, str] = {} # (master id, follower) -> kind of its last evaluated status
+        self._issues = {kind: {} for kind in ISSUES} # kind -> (master id, follower) -> CopyStatus
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def expect(self, master_order: Order, followers: Union[Iterable[str], Dict[str, float]]):
+        """Register the followers that must copy master_order, optionally with the quantity each should trade.
+
+        Without a quantity, the quantity of the follower's copies is expected.
+        """
+        if master_order.id is None:
+            raise ValueError("The master order has no id yet")
+        quantities = followers if isinstance(followers, dict) else dict.fromkeys(followers)
+        with self._lock:
+            self.masters[master_order.id] = master_order
+            expected = self.expected.setdefault(master_order.id, {})
+            master_id, symbol, trade_type = master_order.id, master_order.symbol, master_order.trade_type
+            waiting, dirty = self._waiting, self._dirty
+            for trading_account_id, quantity in quantities.items():
+                expectation = expected.get(trading_account_id)
+                if expectation is None:
+                    expected[trading_account_id] = _Expectation(quantity)
+                    waiting[(trading_account_id, symbol, trade_type)].append(master_id)
+                elif quantity is not None:
+                    expectation.quantity = quantity
+                dirty.add((master_id, trading_account_id))
+
+    def expect_fan_out(self, master_order: Order, results):
+        "expect() the followers of a fan_out/async_fan_out and record the copies it placed"
+        results = list(results)
+        placed = [result.order for result in results if result.order is not None]
+        # A follower without an order and without an error had less than a lot to trade, nothing is expected of it
+        self.expect(master_order, {
+            **{result.trading_account_id: None for result in results if result.order is None and result.error},
+            **{order.trading_account_id: order.quantity for order in placed},
+        })
+        self.update(placed)
+
+    def update(self, orders: Iterable[Order]):
+        "Take in the latest state of orders (placed copies, broker listings, master snapshots, an OrderBatch)"
+        with self._lock:
+            for order in orders:
+                self._update(order)
+
+    def _update(self, order: Order):
+        # Must hold self._lock
+        if order.id is not None and order.id in self.masters:
+            self.masters[order.id] = order
+            # Every follower's target follows the master's fill
+            self._dirty.update((order.id, follower) for follower in self.expected[order.id])
+            return
+        known = self.copy_of.get(order.id) if order.id is not None else None
+        master_id = known[0] if known is not None else None
+        if master_id is None and order.copy_from_order_id in self.expected:
+            master_id = order.copy_from_order_id
+        if master_id is None and order.id is not None:
+            master_id = self._claim(order)
+        if master_id is None:
+            return
+        expectation = self.expected[master_id].get(order.trading_account_id)
+        if expectation is None:
+            # A copy nobody asked for, expect its own quantity so it shows up if it goes wrong
+            expectation = self.expected[master_id][order.trading_account_id] = _Expectation(None)
+        if order.id is not None:
+            self.copy_of[order.id] = (master_id, order.trading_account_id)
+            expectation.copies.pop(None, None) # saved before the broker gave it an id
+        expectation.copies[order.id] = order
+        self._dirty.add((master_id, order.trading_account_id))
+
+    def _claim(self, order: Order):
+        # Oldest master of the same symbol and side this follower still waits on a copy of
+        waiting = self._waiting.get((order.trading_account_id, order.symbol, order.trade_type))
+        while waiting:
+            master_id = waiting[0]
+            expectation = self.expected.get(master_id, {}).get(order.trading_account_id)
+            if expectation is not None and not expectation.copies:
+                return master_id
+            waiting.popleft()
+        return None
+
+    def order(self, order_id: str) -> Order:
+        "Latest state of a known master order or copy, None if unknown"
+        with self._lock:
+            if order_id in self.masters:
+                return self.masters[order_id]
+            known = self.copy_of.get(order_id)
+            if known is None:
+                return None
+            return self.expected[known[0]][known[1]].copies.get(order_id)
+
+    def forget(self, master_order_id: str):
+        "Drop a reconciled master order and its copies"
+        with self._lock:
+            master = self.masters.pop(master_order_id, None)
+            for trading_account_id, expectation in self.expected.pop(master_order_id, {}).items():
+                waiting = self._waiting.get((trading_account_id, master.symbol, master.trade_type))
+                if waiting is not None and master_order_id in waiting:
+                    waiting.remove(master_order_id)
+                    if not waiting:
+                        del self._waiting[(trading_account_id, master.symbol, master.trade_type)]
+                for order_id in expectation.copies:
+                    self.copy_of.pop(order_id, None)
+                key = (master_order_id, trading_account_id)
+                self._dirty.discard(key)
+                kind = self._kinds.pop(key, 'ok')
+                if kind != 'ok':
+                    del self._issues[kind][key]
+
+    def _fill(self, master_id) -> float:
+        "Share of the master order matched so far"
+        master = self.masters[master_id]
+        if master.status == 'matched':
+            return 1.0
+        return min(master.matched_quantity / master.quantity, 1.0) if master.quantity else 0.0
+
+    def _classify(self, expectation: _Expectation, fill):
+        # (kind, placed, matched, target), the hot loop of report(): no CopyStatus for the copies that are fine
+        copies = expectation.copies
+        if not copies:
+            return 'missing', 0, 0, 0
+        if len(copies) == 1:
+            order = next(iter(copies.values()))
+            if order.status == 'rejected':
+                return 'rejected', 0, 0, 0
+            placed, matched = order.quantity, order.matched_quantity
+        else:
+            live = [order for order in copies.values() if order.status != 'rejected']
+            if not live:
+                return 'rejected', 0, 0, 0
+            placed = sum(order.quantity for order in live)
+            matched = sum(order.matched_quantity for order in live)
+        expected = placed if expectation.quantity is None else expectation.quantity
+        target = expected * fill // self.lot_size * self.lot_size
+        if matched > expected:
+            return 'over_filled', placed, matched, target
+        if matched < target:
+            return 'partial', placed, matched, target
+        return 'ok', placed, matched, target
+
+    def _status(self, master_id, trading_account_id, fill) -> CopyStatus:
+        expectation = self.expected[master_id][trading_account_id]
+        kind, placed, matched, target = self._classify(expectation, fill)
+        return CopyStatus(kind, master_id, trading_account_id, expectation.quantity, placed, matched, target,
+                          list(expectation.copies.values()))
+
+    def report(self) -> ReconciliationReport:
+        "Followers whose copies need attention, re-evaluating only the pairs changed since the last report"
+        with self._lock:
+            fills = {}
+            kinds, issues = self._kinds, self._issues
+            for key in self._dirty:
+                master_id, trading_account_id = key
+                fill = fills.get(master_id)
+                if fill is None:
+                    fill = fills[master_id] = self._fill(master_id)
+                kind = self._classify(self.expected[master_id][trading_account_id], fill)[0]
+                previous = kinds.get(key, 'ok')
+                kinds[key] = kind
+                if previous != 'ok':
+                    del issues[previous][key]
+                if kind != 'ok':
+                    issues[kind][key] = self._status(master_id, trading_account_id, fill)
+            self._dirty.clear()
+            report = ReconciliationReport(*[list(issues[kind].values()) for kind in ISSUES])
+        logger.debug(f"Reconciled {len(self._kinds)} copies: {report.summary()}")
+        return report
+
+    def status(self, master_order_id: str, trading_account_id: str) -> CopyStatus:
+        with self._lock:
+            return self._status(master_order_id, trading_account_id, self._fill(master_order_id))
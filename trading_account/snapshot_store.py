@@ -0,0 +1,233 @@
+import logging
+import threading
+import time
+from datetime import date, datetime
+from typing import Dict, Iterable, Optional
+
+from .cache import PORTFOLIO_CACHE_TTL
+from .datatypes import Portfolio, StockAllocation
+from .db import get_engine, sqlite_uri
+from .jsonutil import dumps, loads
+
+# SQLAlchemy is imported on first use, importing this module stays cheap
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAX_AGE = 12 * 3600 # seconds, older snapshots (e.g. from the previous session) are ignored
+TOKEN_RESTORE_MARGIN = 60 # seconds, a token expiring sooner is not restored
+AUTOSAVE_INTERVAL = 30.0 # seconds
+
+_snapshot_table = None
+
+
+def snapshot_table():
+    global _snapshot_table
+    if _snapshot_table is None:
+        from sqlalchemy import Column, Float, MetaData, String, Table, Text
+        _snapshot_table = Table(
+            "account_snapshot",
+            MetaData(),
+            Column("key", String(200), primary_key=True), # brokerage:username:trading_account_id
+            Column("state", Text), # JSON, see account_state
+            Column("saved_at", Float), # POSIX time
+        )
+    return _snapshot_table
+
+
+def snapshot_key(account) -> str:
+    return f"{account.brokerage}:{account.username}:{account.trading_account_id}"
+
+
+# Deadlines are kept as time.monotonic() by the accounts, which does not survive a restart
+
+def wall_deadline(monotonic_deadline: Optional[float]) -> Optional[float]:
+    return None if monotonic_deadline is None else time.time() + monotonic_deadline - time.monotonic()
+
+
+def monotonic_deadline(wall: Optional[float]) -> Optional[float]:
+    return None if wall is None else time.monotonic() + wall - time.time()
+
+
+def portfolio_to_dict(portfolio: Portfolio) -> dict:
+    return {
+        "total_cash": portfolio.total_cash,
+        "total_loan": portfolio.total_loan,
+        "available_cash": portfolio.available_cash,
+        "stock_allocations": [
+            [a.symbol, a.quantity, a.available_quantity, a.avg_buy_price, a.current_value]
+            for a in portfolio.stock_allocations or ()
+        ],
+    }
+
+
+def portfolio_from_dict(data: dict) -> Portfolio:
+    return Portfolio(
+        total_cash=data["total_cash"],
+        total_loan=data["total_loan"],
+        available_cash=data["available_cash"],
+        stock_allocations=[StockAllocation(*allocation) for allocation in data["stock_allocations"]],
+    )
+
+
+def account_state(account) -> dict:
+    "What BaseTradingAccount/AsyncBaseTradingAccount.export_state return, times are wall clock"
+    portfolio = account.portfolio_cache.peek()
+    watermark = account.order_sync.watermark
+    return {
+        "session": account.export_session(),
+        "portfolio": portfolio_to_dict(portfolio) if portfolio is not None else None,
+        "portfolio_age": account.portfolio_cache.age if portfolio is not None else None,
+        "watermark": watermark.timestamp() if watermark is not None else None,
+    }
+
+
+def restore_account_state(account, state: dict):
+    "Counterpart of account_state, every part is optional"
+    if state.get("session"):
+        account.restore_session(state["session"])
+    if state.get("portfolio"):
+        account.portfolio_cache.set(portfolio_from_dict(state["portfolio"]), age=state.get("portfolio_age") or 0)
+    if state.get("watermark") is not None:
+        account.order_sync.watermark = datetime.fromtimestamp(state["watermark"])
+
+
+class SnapshotStore:
+    """Local SQLite store of the tokens, last portfolio and order watermark of every account, so a restarted
+    process resumes without logging in and fetching everything again.
+
+    Staleness rules applied by restore():
+      - a snapshot older than max_age is ignored
+      - an access token expiring within token_margin is dropped, the refresh token is kept while it is valid
+        (the account refreshes on first use, or logs in if it cannot)
+      - a portfolio older than portfolio_ttl is dropped, a younger one is cached with its real age
+      - an order watermark is only restored on the day it was saved
+    """
+    def __init__(self, path: str, max_age=SNAPSHOT_MAX_AGE, token_margin=TOKEN_RESTORE_MARGIN,
+                 portfolio_ttl=PORTFOLIO_CACHE_TTL):
+        # path of the SQLite file, it must outlive the process (":memory:" only makes sense in tests)
+        self.engine = get_engine(sqlite_uri(path))
+        self.max_age = max_age
+        self.token_margin = token_margin
+        self.portfolio_ttl = portfolio_ttl
+        self._preloaded: Dict[str, tuple] = None # key -> (state, saved_at), set by preload()
+        self._autosave = None
+        snapshot_table().metadata.create_all(self.engine)
+
+    def save_many(self, states: Dict[str, dict]) -> int:
+        "Replace the snapshots of the given keys in one transaction"
+        if not states:
+            return 0
+        now = time.time()
+        rows = [{"key": key, "state": dumps(state), "saved_at": now} for key, state in states.items()]
+        with self.engine.begin() as conn:
+            conn.execute(snapshot_table().insert().prefix_with("OR REPLACE"), rows)
+        if self._preloaded is not None:
+            for key, state in states.items():
+                self._preloaded[key] = (state, now)
+        return len(rows)
+
+    def save_accounts(self, accounts: Iterable) -> int:
+        states = {}
+        for account in accounts:
+            try:
+                states[snapshot_key(account)] = account.export_state()
+            except Exception as e:
+                logger.warning(f"Snapshot of {account.username} failed: {e!r}")
+        return self.save_many(states)
+
+    def load_all(self) -> Dict[str, tuple]:
+        "key -> (state, saved_at) of every snapshot not older than max_age"
+        from sqlalchemy import select
+        table = snapshot_table()
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                select(table.c.key, table.c.state, table.c.saved_at)
+                .where(table.c.saved_at >= time.time() - self.max_age)
+            ).all()
+        return {key: (loads(state), saved_at) for key, state, saved_at in rows}
+
+    def load(self, key: str) -> Optional[tuple]:
+        if self._preloaded is not None:
+            return self._preloaded.get(key)
+        from sqlalchemy import select
+        table = snapshot_table()
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                select(table.c.state, table.c.saved_at)
+                .where(table.c.key == key, table.c.saved_at >= time.time() - self.max_age)
+            ).first()
+        return (loads(row[0]), row[1]) if row else None
+
+    def preload(self) -> int:
+        "Read every snapshot with one query, so restoring thousands of accounts at startup does not hit the file"
+        self._preloaded = self.load_all()
+        return len(self._preloaded)
+
+    def delete(self, key: str):
+        from sqlalchemy import delete
+        table = snapshot_table()
+        with self.engine.begin() as conn:
+            conn.execute(delete(table).where(table.c.key == key))
+        if self._preloaded is not None:
+            self._preloaded.pop(key, None)
+
+    def fresh_state(self, state: dict, saved_at: float) -> dict:
+        "The parts of a snapshot still usable now, see the staleness rules"
+        now = time.time()
+        if now - saved_at > self.max_age:
+            return {}
+        fresh = {}
+        session = state.get("session")
+        if session:
+            expires_at, refresh_expires_at = session.get("expires_at"), session.get("refresh_expires_at")
+            token_ok = session.get("access_token") and (expires_at is None or expires_at - self.token_margin > now)
+            refresh_ok = session.get("refresh_token") and (
+                refresh_expires_at is None or refresh_expires_at - self.token_margin > now
+            )
+            if token_ok or refresh_ok:
+                fresh["session"] = session
+        age = state.get("portfolio_age")
+        if state.get("portfolio") and age is not None and age + now - saved_at < self.portfolio_ttl:
+            fresh["portfolio"] = state["portfolio"]
+            fresh["portfolio_age"] = age + now - saved_at
+        watermark = state.get("watermark")
+        if watermark is not None and date.fromtimestamp(watermark) == date.today():
+            fresh["watermark"] = watermark
+        return fresh
+
+    def restore(self, account) -> bool:
+        "Rehydrate an account from its snapshot, True if anything was restored"
+        snapshot = self.load(snapshot_key(account))
+        if snapshot is None:
+            return False
+        state = self.fresh_state(*snapshot)
+        if not state:
+            return False
+        try:
+            account.restore_state(state)
+        except Exception as e:
+            logger.warning(f"Restoring the snapshot of {account.username} failed: {e!r}")
+            return False
+        return True
+
+    def start_autosave(self, factory, interval: float = AUTOSAVE_INTERVAL):
+        "Save the snapshots of every pooled account of factory each interval, until stop_autosave()"
+        stopped = threading.Event()
+
+        def run():
+            while not stopped.wait(interval):
+                try:
+                    factory.save_snapshots()
+                except Exception as e:
+                    logger.warning(f"Saving account snapshots failed: {e!r}")
+
+        self._autosave = stopped
+        threading.Thread(target=run, name="snapshot-autosave", daemon=True).start()
+
+    def stop_autosave(self):
+        if self._autosave is not None:
+            self._autosave.set()
+            self._autosave = None
+
+    def close(self):
+        self.stop_autosave()
@@ -0,0 +1,155 @@
+import asyncio
+import heapq
+import inspect
+import itertools
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+REFRESH_MARGIN = 120.0 # seconds before expiry at which a token is refreshed at the latest
+REFRESH_JITTER = 300.0 # refreshes are spread over this many seconds before the margin
+RETRY_INTERVAL = 15.0 # first retry delay after a failed refresh, doubled on each failure
+RECHECK_INTERVAL = 60.0 # how often accounts without a known expiry (not logged in yet) are looked at again
+
+
+class _TrackedAccount:
+    def __init__(self, account, loop=None):
+        self.account = account
+        self.loop = loop # event loop owning an async account
+        self.expires_at = None # token deadline the live schedule entry was computed from
+        self.failures = 0
+        self.refreshing = False
+        self.seq = None # seq of the live schedule entry, older heap entries are skipped
+
+
+class TokenRefreshScheduler:
+    """Refreshes the access token of every tracked account shortly before it expires, using its refresh_token.
+
+    Accounts must expose token_expires_at (time.monotonic() deadline, None if unknown), refresh_token and
+    refresh_access_token(). Each refresh is scheduled at a random point of the jitter window ending margin
+    seconds before expiry, so tokens issued together at market open are not all renewed in the same second.
+    A failed refresh is retried with backoff until the token expires, the reactive re-login on 401 stays in place.
+    """
+    def __init__(self, margin=REFRESH_MARGIN, jitter=REFRESH_JITTER, retry_interval=RETRY_INTERVAL,
+                 recheck_interval=RECHECK_INTERVAL, max_workers=8):
+        self.margin = margin
+        self.jitter = jitter
+        self.retry_interval = retry_interval
+        self.recheck_interval = recheck_interval
+        self._accounts: Dict[int, _TrackedAccount] = {}
+        self._schedule = [] # heap of (due, seq, account key)
+        self._seq = itertools.count()
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="token-refresher")
+        self._thread = None
+        self._running = False
+        self.refreshed = 0
+        self.failed = 0
+
+    def __len__(self):
+        return len(self._accounts)
+
+    def add_account(self, account, loop: asyncio.AbstractEventLoop = None):
+        "Track an account, async accounts need the loop they run on"
+        if loop is None and inspect.iscoroutinefunction(account.refresh_access_token):
+            loop = asyncio.get_running_loop()
+        with self._condition:
+            if id(account) in self._accounts:
+                return
+            tracked = self._accounts[id(account)] = _TrackedAccount(account, loop)
+            self._schedule_next(id(account), tracked)
+
+    def remove_account(self, account):
+        with self._condition:
+            self._accounts.pop(id(account), None)
+
+    def start(self):
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name="token-refresher-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, wait=True):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread is not None and wait:
+            self._thread.join()
+        self._executor.shutdown(wait=wait)
+
+    def refresh_due(self, expires_at, now):
+        latest = expires_at - self.margin
+        # Never spread into the first half of the token lifetime, a short-lived token would be refreshed in a loop
+        window = min(self.jitter, max(latest - now, 0) / 2)
+        return max(now, latest - random.uniform(0, window))
+
+    def _schedule_next(self, key, tracked: _TrackedAccount):
+        # Must hold self._condition
+        now = time.monotonic()
+        tracked.expires_at = tracked.account.token_expires_at
+        if tracked.expires_at is None or not tracked.account.refresh_token or tracked.expires_at <= now:
+            due = now + self.recheck_interval
+        elif tracked.failures:
+            due = now + min(self.retry_interval * 2 ** (tracked.failures - 1), max(tracked.expires_at - now, 0))
+        else:
+            due = self.refresh_due(tracked.expires_at, now)
+        self._push(key, tracked, due)
+
+    def _push(self, key, tracked: _TrackedAccount, due):
+        # Must hold self._condition
+        tracked.seq = next(self._seq)
+        heapq.heappush(self._schedule, (due, tracked.seq, key))
+        self._condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and (not self._schedule or self._schedule[0][0] > time.monotonic()):
+                    timeout = self._schedule[0][0] - time.monotonic() if self._schedule else None
+                    self._condition.wait(timeout)
+                if not self._running:
+                    return
+                _, seq, key = heapq.heappop(self._schedule)
+                tracked = self._accounts.get(key)
+                if tracked is None or tracked.seq != seq or tracked.refreshing:
+                    continue
+                account = tracked.account
+                if account.token_expires_at is None or not account.refresh_token:
+                    self._schedule_next(key, tracked)
+                    continue
+                if account.token_expires_at != tracked.expires_at and not tracked.failures:
+                    # Renewed meanwhile (login after a 401, another refresh), plan against the new deadline
+                    self._schedule_next(key, tracked)
+                    continue
+                tracked.refreshing = True
+            self._executor.submit(self._refresh, key, tracked)
+
+    def _refresh(self, key, tracked: _TrackedAccount):
+        account = tracked.account
+        try:
+            result = account.refresh_access_token()
+            if inspect.isawaitable(result):
+                asyncio.run_coroutine_threadsafe(result, tracked.loop).result()
+            failed = False
+        except Exception as e:
+            failed = True
+            logger.warning(f"Proactive token refresh of {account.username} failed: {e!r}")
+        with self._condition:
+            tracked.refreshing = False
+            if failed:
+                self.failed += 1
+                expired = account.token_expires_at is not None and account.token_expires_at <= time.monotonic()
+                # Past expiry the next request re-logs in on 401, keep trying only every recheck_interval
+                tracked.failures = 0 if expired else tracked.failures + 1
+            else:
+                self.refreshed += 1
+                tracked.failures = 0
+            if self._accounts.get(key) is tracked and self._running:
+                self._schedule_next(key, tracked)
@@ -0,0 +1,263 @@
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import quote
+
+from .db import get_engine, sqlite_uri
+from .write_behind import WriteBehindQueue
+
+# SQLAlchemy is imported on first use of a SQL store, importing this module stays cheap
+
+logger = logging.getLogger(__name__)
+
+_token_table = None
+
+
+def token_table():
+    global _token_table
+    if _token_table is None:
+        from sqlalchemy import Boolean, Column, DateTime, MetaData, String, Table, Text
+        _token_table = Table(
+            "bscTokenTable",
+            MetaData(),
+            Column("account_id", String(64), primary_key=True),
+            Column("bsc_account", String(64), index=True),
+            Column("access_token", Text),
+            Column("refresh_token", Text),
+            Column("is_valid", Boolean),
+            Column("Time", DateTime),
+        )
+    return _token_table
+
+
+def token_db_uri() -> str:
+    return f'mysql+mysqlconnector://{os.environ["TOKEN_DB_USERNAME"]}:{quote(os.environ["TOKEN_DB_PASSWORD"])}@{os.environ["TOKEN_DB_HOST"]}/portfolioDataDb'
+
+
+@dataclass
+class TokenRecord:
+    account_id: str # trading account (tiểu khoản) the token is valid for
+    bsc_account: str # login username
+    access_token: str
+    refresh_token: str
+    is_valid: bool = True
+    updated_at: datetime = None
+
+
+class TokenStore:
+    def save_many(self, records: List[TokenRecord]):
+        raise NotImplementedError
+
+    def invalidate(self, bsc_account: str):
+        raise NotImplementedError
+
+    def load_all(self) -> Dict[str, TokenRecord]:
+        "Latest valid token of every login, keyed by bsc_account"
+        raise NotImplementedError
+
+    def load(self, bsc_account: str) -> Optional[TokenRecord]:
+        return self.load_all().get(bsc_account)
+
+    def save(self, bsc_account: str, account_ids: Iterable[str], access_token: str, refresh_token: str):
+        now = datetime.now()
+        self.save_many([
+            TokenRecord(account_id, bsc_account, access_token, refresh_token, True, now) for account_id in account_ids
+        ])
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class MemoryTokenStore(TokenStore):
+    def __init__(self):
+        self._records: Dict[str, TokenRecord] = {}
+        self._lock = threading.Lock()
+
+    def save_many(self, records: List[TokenRecord]):
+        with self._lock:
+            for record in records:
+                self._records[record.account_id] = record
+
+    def invalidate(self, bsc_account: str):
+        now = datetime.now()
+        with self._lock:
+            for record in self._records.values():
+                if record.bsc_account == bsc_account:
+                    record.is_valid = False
+                    record.updated_at = now
+
+    def load_all(self) -> Dict[str, TokenRecord]:
+        with self._lock:
+            records = sorted(
+                (r for r in self._records.values() if r.is_valid), key=lambda r: r.updated_at or datetime.min
+            )
+        return {record.bsc_account: record for record in records}
+
+
+class SQLTokenStore(TokenStore):
+    def __init__(self, uri: str = None, create_table=False):
+        self.engine = get_engine(uri or token_db_uri())
+        self._preloaded: Dict[str, TokenRecord] = {}
+        if create_table:
+            token_table().metadata.create_all(self.engine)
+
+    def save_many(self, records: List[TokenRecord]):
+        if not records:
+            return
+        # Keep the last write for each account, then update existing rows and insert the missing ones in one
+        # transaction. Does not rely on a unique key on account_id, which the production table may not have.
+        latest = {record.account_id: record for record in records}
+        rows = [
+            {
+                "b_account_id": r.account_id,
+                "bsc_account": r.bsc_account,
+                "access_token": r.access_token,
+                "refresh_token": r.refresh_token,
+                "is_valid": r.is_valid,
+                "Time": r.updated_at or datetime.now(),
+            }
+            for r in latest.values()
+        ]
+        from sqlalchemy import bindparam, select, update
+        table = token_table()
+        with self.engine.begin() as conn:
+            existing = set(conn.execute(
+                select(table.c.account_id).where(table.c.account_id.in_(list(latest)))
+            ).scalars())
+            updates = [row for row in rows if row["b_account_id"] in existing]
+            inserts = [
+                {**{k: v for k, v in row.items() if k != "b_account_id"}, "account_id": row["b_account_id"]}
+                for row in rows if row["b_account_id"] not in existing
+            ]
+            if updates:
+                conn.execute(
+                    update(table)
+                    .where(table.c.account_id == bindparam("b_account_id"))
+                    .values(
+                        bsc_account=bindparam("bsc_account"),
+                        access_token=bindparam("access_token"),
+                        refresh_token=bindparam("refresh_token"),
+                        is_valid=bindparam("is_valid"),
+                        Time=bindparam("Time"),
+                    ),
+                    updates,
+                )
+            if inserts:
+                conn.execute(table.insert(), inserts)
+        for record in latest.values():
+            if record.bsc_account in self._preloaded:
+                self._preloaded[record.bsc_account] = record
+
+    def invalidate(self, bsc_account: str):
+        from sqlalchemy import update
+        table = token_table()
+        with self.engine.begin() as conn:
+            conn.execute(
+                update(table).where(table.c.bsc_account == bsc_account).values(is_valid=False, Time=datetime.now())
+            )
+        self._preloaded.pop(bsc_account, None)
+
+    def load_all(self) -> Dict[str, TokenRecord]:
+        from sqlalchemy import select
+        table = token_table()
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                select(table.c.account_id, table.c.bsc_account, table.c.access_token, table.c.refresh_token,
+                       table.c.is_valid, table.c.Time)
+                .where(table.c.is_valid.is_(True))
+                .order_by(table.c.Time)
+            ).all()
+        return {row[1]: TokenRecord(*row) for row in rows}
+
+    def load(self, bsc_account: str) -> Optional[TokenRecord]:
+        if bsc_account in self._preloaded:
+            return self._preloaded[bsc_account]
+        from sqlalchemy import select
+        table = token_table()
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                select(table.c.account_id, table.c.bsc_account, table.c.access_token, table.c.refresh_token,
+                       table.c.is_valid, table.c.Time)
+                .where(table.c.bsc_account == bsc_account, table.c.is_valid.is_(True))
+                .order_by(table.c.Time.desc())
+                .limit(1)
+            ).first()
+        return TokenRecord(*row) if row else None
+
+    def preload(self) -> int:
+        "Bulk load every valid token with one query, so account construction at startup does not hit the DB"
+        self._preloaded = self.load_all()
+        return len(self._preloaded)
+
+
+class SQLiteTokenStore(SQLTokenStore):
+    "Local stand-in for the MySQL token table, in memory by default"
+    def __init__(self, path: str = ":memory:"):
+        super().__init__(sqlite_uri(path), create_table=True)
+
+
+class WriteBehindTokenStore(TokenStore):
+    "Queues token writes for a background batch writer so saving a token never blocks the request path"
+    def __init__(self, store: TokenStore, max_batch=500, flush_interval=0.5, max_size=10000):
+        self.store = store
+        self.queue = WriteBehindQueue(self._write, max_batch, flush_interval, max_size, name="token-store-writer")
+
+    def _write(self, batch):
+        records = []
+        for item in batch:
+            if isinstance(item, TokenRecord):
+                records.append(item)
+                continue
+            # Invalidation: write what was queued before it first to keep the order
+            self.store.save_many(records)
+            records = []
+            self.store.invalidate(item[1])
+        self.store.save_many(records)
+
+    def save_many(self, records: List[TokenRecord]):
+        for record in records:
+            self.queue.put(record)
+
+    def invalidate(self, bsc_account: str):
+        self.queue.put(("invalidate", bsc_account))
+
+    def load_all(self) -> Dict[str, TokenRecord]:
+        return self.store.load_all()
+
+    def load(self, bsc_account: str) -> Optional[TokenRecord]:
+        return self.store.load(bsc_account)
+
+    def preload(self) -> int:
+        return self.store.preload()
+
+    def flush(self):
+        self.queue.flush()
+
+    def close(self):
+        self.queue.close()
+        self.store.close()
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_default_token_store() -> TokenStore:
+    "Write-behind store over the TOKEN_DB_* MySQL database, built on first use"
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = WriteBehindTokenStore(SQLTokenStore())
+        return _default_store
+
+
+def set_default_token_store(store: TokenStore):
+    global _default_store
+    with _default_store_lock:
+        _default_store = store
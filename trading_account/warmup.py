@@ -0,0 +1,286 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+WARM_UP_WORKERS = 32 # accounts warmed at the same time
+KEEP_ALIVE_INTERVAL = 20.0 # seconds, well below the idle timeout after which servers drop keep-alive connections
+
+
+@dataclass
+class WarmUpResult:
+    brokerage: str
+    username: str
+    trading_account_id: str = None
+    account: object = None # the warmed account, None if it could not be created
+    error: Exception = None
+    elapsed: float = 0 # seconds from the start of the warm-up until this account finished
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+@dataclass
+class WarmUpReport:
+    results: List[WarmUpResult]
+    elapsed: float = 0
+    keep_alive: object = None # KeepAlive thread (sync) or asyncio.Task (async) holding the connections open
+
+    @property
+    def warmed(self) -> list:
+        return [result.account for result in self.results if result.ok]
+
+    @property
+    def failed(self) -> List[WarmUpResult]:
+        return [result for result in self.results if not result.ok]
+
+    def summary(self) -> str:
+        failed = self.failed
+        text = f"Warmed {len(self.results) - len(failed)}/{len(self.results)} accounts in {self.elapsed:.1f}s"
+        if failed:
+            text += ", failed: " + ", ".join(
+                f"{result.brokerage}:{result.trading_account_id or result.username} ({result.error!r})"
+                for result in failed
+            )
+        return text
+
+
+def _describe(item):
+    # item is an account or a (brokerage, kwargs) spec as used by worker_runtime
+    if isinstance(item, tuple):
+        brokerage, kwargs = item
+        return WarmUpResult(brokerage, kwargs.get("username"), kwargs.get("trading_account_id"))
+    return WarmUpResult(item.brokerage, item.username, item.trading_account_id, account=item)
+
+
+def _pool_key(factory, item):
+    # Pool key of a spec, None for a live account (not pooled) or a spec _warm will report as failing
+    if not isinstance(item, tuple):
+        return None
+    try:
+        return factory.account_key(item[0], **item[1])
+    except Exception:
+        return None
+
+
+def _reserve(pool, keys):
+    # Grow the pool so warming the last specs does not evict the first ones
+    pool.reserve(len(pool) + len({key for key in keys if key is not None and key not in pool}))
+
+
+def _seconds_until(until: datetime):
+    return None if until is None else max((until - datetime.now()).total_seconds(), 0)
+
+
+def _warm(item, factory, prefetch, started_at):
+    # Returns (account, error, elapsed) instead of filling the WarmUpResult, a late finisher must not change the report
+    account = None if isinstance(item, tuple) else item
+    try:
+        if account is None:
+            # get_pooled_trading_account logs in, the account then serves every later caller of the factory
+            account = factory.get_pooled_trading_account(item[0], **item[1])
+        else:
+            account.ensure_session()
+        if prefetch:
+            account.portfolio_cache.set(account.fetch_current_portfolio())
+        error = None
+    except Exception as e:
+        error = e
+    return account, error, time.perf_counter() - started_at
+
+
+def _record(results: List[WarmUpResult], outcomes, until, started_at, pool, keys) -> WarmUpReport:
+    for result, outcome, key in zip(results, outcomes, keys):
+        if outcome is None:
+            result.error = TimeoutError(f"Not warmed by {until}")
+            result.elapsed = time.perf_counter() - started_at
+        else:
+            result.account, result.error, result.elapsed = outcome
+            # Only an account still pooled serves the later callers of the factory
+            if result.error is None and key is not None and not pool.touch(key, result.account):
+                result.error = RuntimeError("Evicted from the account pool during the warm-up")
+        if result.error is not None:
+            logger.warning(f"Warm-up of {result.brokerage} account {result.username} failed: {result.error!r}")
+    report = WarmUpReport(results, elapsed=time.perf_counter() - started_at)
+    logger.info(report.summary())
+    return report
+
+
+def warm_up(
+    accounts,
+    factory=None,
+    until: datetime = None,
+    max_workers: int = WARM_UP_WORKERS,
+    prefetch: bool = True,
+    keep_alive_interval: float = KEEP_ALIVE_INTERVAL,
+) -> WarmUpReport:
+    """Log in (or reuse a stored / refreshed token), open connections and prime the portfolio cache of every account
+    ahead of the session open, e.g. a few minutes before 9:00 ATO or 14:30 ATC.
+
+    accounts holds live accounts and/or (brokerage, kwargs) specs, created through factory.get_pooled_trading_account
+    (default trading_account_factory) so later callers get the warmed instance. Accounts not warmed by until are
+    reported with a TimeoutError. The pool grows to hold every spec, an account evicted anyway is reported failed.
+    Until that time a KeepAlive thread pings every account (account.ping(), one cheap request) each
+    keep_alive_interval, which keeps the pooled connections open and the accounts from idling out of the pool. The
+    prefetch opens one connection per account, the others are opened by the first requests that need them.
+    """
+    if factory is None:
+        from .factory import trading_account_factory as factory
+    items = list(accounts)
+    results = [_describe(item) for item in items]
+    keys = [_pool_key(factory, item) for item in items]
+    _reserve(factory.pool, keys)
+    started_at = time.perf_counter()
+    executor = ThreadPoolExecutor(max_workers=min(len(items), max_workers) or 1, thread_name_prefix="warm-up")
+    try:
+        futures = [executor.submit(_warm, item, factory, prefetch, started_at) for item in items]
+        wait(futures, timeout=_seconds_until(until))
+    finally:
+        executor.shutdown(wait=False)
+    outcomes = [future.result() if future.done() else None for future in futures]
+    report = _record(results, outcomes, until, started_at, factory.pool, keys)
+    if until is not None and prefetch and report.warmed:
+        warmed = [(result.account, key) for result, key in zip(results, keys) if result.ok]
+        report.keep_alive = KeepAlive([account for account, _ in warmed], until, keep_alive_interval, max_workers,
+                                      pool=factory.pool, keys=[key for _, key in warmed])
+        report.keep_alive.start()
+    return report
+
+
+class KeepAlive:
+    """Pings every account each interval until the given time, so connections are not idle.
+
+    keys holds the pool key of each account (None if not pooled): the entry is touched on every ping so the pool's
+    idle timeout keeps the account, and an account that left the pool is no longer pinged.
+    """
+    def __init__(self, accounts, until: datetime, interval: float = KEEP_ALIVE_INTERVAL,
+                 max_workers: int = WARM_UP_WORKERS, pool=None, keys=None):
+        self.accounts = list(accounts)
+        self.keys = list(keys) if keys is not None else [None] * len(self.accounts)
+        self.pool = pool
+        self.until = until
+        self.interval = interval
+        self.max_workers = max_workers
+        self.pings = 0
+        self.failures = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="warm-up-keep-alive", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, wait=True):
+        self._stopped.set()
+        if wait and self._thread.is_alive():
+            self._thread.join()
+
+    def _ping(self, account, key) -> bool:
+        # Returns False once the account left the pool, which closed it
+        if key is not None and not self.pool.touch(key, account):
+            logger.debug(f"Keep-alive of {account.username} stopped, the account left the pool")
+            return False
+        try:
+            account.ping()
+            self.pings += 1
+        except Exception as e:
+            # The next order re-logs in on 401, nothing to repair here
+            self.failures += 1
+            logger.debug(f"Keep-alive of {account.username} failed: {e!r}")
+        return True
+
+    def _run(self):
+        with ThreadPoolExecutor(max_workers=min(len(self.accounts), self.max_workers) or 1,
+                                thread_name_prefix="warm-up-keep-alive") as executor:
+            while True:
+                remaining = _seconds_until(self.until)
+                if self._stopped.wait(min(self.interval, remaining)) or remaining <= self.interval:
+                    return
+                pooled = list(executor.map(self._ping, self.accounts, self.keys))
+                self.accounts = [account for account, ok in zip(self.accounts, pooled) if ok]
+                self.keys = [key for key, ok in zip(self.keys, pooled) if ok]
+
+
+async def _async_warm(item, factory, prefetch, started_at, semaphore):
+    account = None if isinstance(item, tuple) else item
+    try:
+        async with semaphore:
+            if account is None:
+                account = await factory.aget_pooled_trading_account(item[0], **item[1])
+            else:
+                await account.ensure_session()
+            if prefetch:
+                account.portfolio_cache.set(await account.fetch_current_portfolio())
+        error = None
+    except Exception as e:
+        error = e
+    return account, error, time.perf_counter() - started_at
+
+
+async def async_warm_up(
+    accounts,
+    factory=None,
+    until: datetime = None,
+    max_concurrency: int = WARM_UP_WORKERS,
+    prefetch: bool = True,
+    keep_alive_interval: float = KEEP_ALIVE_INTERVAL,
+) -> WarmUpReport:
+    "warm_up for async accounts (default async_trading_account_factory), keep_alive is a task cancelled at until"
+    if factory is None:
+        from .factory import async_trading_account_factory as factory
+    items = list(accounts)
+    results = [_describe(item) for item in items]
+    keys = [_pool_key(factory, item) for item in items]
+    _reserve(factory.pool, keys)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    started_at = time.perf_counter()
+    tasks = [
+        asyncio.ensure_future(_async_warm(item, factory, prefetch, started_at, semaphore))
+        for item in items
+    ]
+    done = set()
+    if tasks:
+        done, pending = await asyncio.wait(tasks, timeout=_seconds_until(until))
+        for task in pending:
+            task.cancel()
+    outcomes = [task.result() if task in done else None for task in tasks]
+    report = _record(results, outcomes, until, started_at, factory.pool, keys)
+    if until is not None and prefetch and report.warmed:
+        warmed = [(result.account, key) for result, key in zip(results, keys) if result.ok]
+        report.keep_alive = asyncio.ensure_future(async_keep_alive(
+            [account for account, _ in warmed], until, keep_alive_interval, max_concurrency,
+            pool=factory.pool, keys=[key for _, key in warmed],
+        ))
+    return report
+
+
+async def async_keep_alive(accounts, until: datetime, interval: float = KEEP_ALIVE_INTERVAL,
+                           max_concurrency: int = WARM_UP_WORKERS, pool=None, keys=None):
+    "KeepAlive for async accounts, run as a task"
+    semaphore = asyncio.Semaphore(max_concurrency)
+    pinged = list(zip(accounts, keys if keys is not None else [None] * len(accounts)))
+
+    async def ping(account, key):
+        if key is not None and not pool.touch(key, account):
+            logger.debug(f"Keep-alive of {account.username} stopped, the account left the pool")
+            return False
+        try:
+            async with semaphore:
+                await account.ping()
+        except Exception as e:
+            logger.debug(f"Keep-alive of {account.username} failed: {e!r}")
+        return True
+
+    while True:
+        remaining = _seconds_until(until)
+        await asyncio.sleep(min(interval, remaining))
+        if remaining <= interval:
+            return
+        pooled = await asyncio.gather(*[ping(account, key) for account, key in pinged])
+        pinged = [entry for entry, ok in zip(pinged, pooled) if ok]
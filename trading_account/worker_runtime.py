@@ -0,0 +1,314 @@
+import bisect
+import hashlib
+import importlib
+import itertools
+import logging
+import multiprocessing
+import os
+import pickle
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List
+
+from .errors import ShardCrashedError
+
+logger = logging.getLogger(__name__)
+
+RING_REPLICAS = 128 # virtual nodes per shard on the hash ring
+SHARD_THREADS = 16 # commands of one shard running at the same time (network bound)
+DEFAULT_FACTORY = "trading_account.factory:trading_account_factory"
+
+
+def stable_hash(value: str) -> int:
+    # hash() is salted per process, the ring must place an account identically in every process and run
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+def shard_key(brokerage: str, username, trading_account_id=None) -> str:
+    return f"{brokerage}:{trading_account_id or username}"
+
+
+class HashRing:
+    "Consistent hashing: adding or removing a shard only moves the accounts of that shard"
+    def __init__(self, shard_ids: List[int], replicas=RING_REPLICAS):
+        self.shard_ids = list(shard_ids)
+        points = sorted(
+            (stable_hash(f"shard-{shard_id}-{replica}"), shard_id)
+            for shard_id in self.shard_ids for replica in range(replicas)
+        )
+        self._hashes = [point[0] for point in points]
+        self._owners = [point[1] for point in points]
+
+    def owner(self, key: str) -> int:
+        i = bisect.bisect(self._hashes, stable_hash(key)) % len(self._hashes)
+        return self._owners[i]
+
+
+def _resolve(path: str):
+    module_name, _, attribute = path.partition(":")
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+def _picklable(error: Exception) -> Exception:
+    try:
+        pickle.loads(pickle.dumps(error))
+        return error
+    except Exception:
+        return RuntimeError(repr(error))
+
+
+def _shard_main(conn, shard_id, factory_path, brokerages, threads):
+    "Entry point of a shard process: owns the accounts (and their sessions) routed to it"
+    factory = _resolve(factory_path)
+    for brokerage, creator in brokerages.items():
+        factory.register_brokerage(brokerage, creator)
+    specs = {} # account key -> (brokerage, kwargs)
+    send_lock = threading.Lock()
+    executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix=f"shard-{shard_id}")
+
+    def reply(request_id, ok, result):
+        with send_lock:
+            try:
+                conn.send((request_id, ok, result))
+            except Exception as e: # unpicklable result
+                conn.send((request_id, False, RuntimeError(f"Cannot send result back: {e!r}")))
+
+    def call(request_id, key, method, args, kwargs):
+        try:
+            brokerage, account_kwargs = specs[key]
+            account = factory.get_pooled_trading_account(brokerage, **account_kwargs)
+            reply(request_id, True, getattr(account, method)(*args, **kwargs))
+        except Exception as e:
+            reply(request_id, False, _picklable(e))
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        request_id, command, key, payload = message
+        if command == "add":
+            specs[key] = payload
+            reply(request_id, True, None)
+        elif command == "remove":
+            spec = specs.pop(key, None)
+            if spec is not None:
+                factory.evict(spec[0], spec[1].get("username"), spec[1].get("trading_account_id"))
+            reply(request_id, True, None)
+        elif command == "ping":
+            reply(request_id, True, (os.getpid(), len(specs)))
+        else:
+            method, args, kwargs = payload
+            executor.submit(call, request_id, key, method, args, kwargs)
+    executor.shutdown(wait=True)
+    factory.pool.clear()
+
+
+class _Shard:
+    def __init__(self, shard_id):
+        self.shard_id = shard_id
+        self.process = None
+        self.conn = None
+        self.send_lock = threading.Lock()
+        self.pending: Dict[int, Future] = {}
+        self.reader = None
+        self.stopping = False
+        self.restarts = 0
+
+
+class WorkerRuntime:
+    """Shards accounts over worker processes by a consistent hash of brokerage and account id.
+
+    Each shard process creates its accounts through the account factory and keeps their sessions. Commands
+    are sent over a Pipe to the owning shard and answered with a concurrent.futures.Future. A shard that dies
+    is restarted and its accounts re-registered (they log in again on the next command).
+    """
+    def __init__(self, processes: int = None, factory: str = DEFAULT_FACTORY, brokerages: dict = None,
+                 threads=SHARD_THREADS, start_method="spawn"):
+        self.processes = processes or os.cpu_count() or 1
+        self.factory = factory
+        self.brokerages = brokerages or {} # extra brokerage -> creator registrations, must be picklable
+        self.threads = threads
+        self._context = multiprocessing.get_context(start_method)
+        self._shards: Dict[int, _Shard] = {}
+        self._ring = None
+        self._accounts: Dict[str, tuple] = {} # account key -> (brokerage, kwargs)
+        self._owners: Dict[str, int] = {}
+        self._request_ids = itertools.count()
+        self._lock = threading.RLock()
+        self._running = False
+
+    def start(self):
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            for shard_id in range(self.processes):
+                self._start_shard(_Shard(shard_id))
+            self._ring = HashRing(list(self._shards))
+
+    def stop(self, timeout=10):
+        with self._lock:
+            self._running = False
+            shards = list(self._shards.values())
+            self._shards.clear()
+        for shard in shards:
+            self._stop_shard(shard, timeout)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def add_account(self, brokerage: str, username, trading_account_id=None, **kwargs) -> str:
+        "Register an account on its shard, returns the key used to route its commands"
+        key = shard_key(brokerage, username, trading_account_id)
+        spec = (brokerage, {"username": username, "trading_account_id": trading_account_id, **kwargs})
+        with self._lock:
+            self._accounts[key] = spec
+            owner = self._owners[key] = self._ring.owner(key)
+            future = self._send(self._shards[owner], "add", key, spec)
+        future.result()
+        return key
+
+    def remove_account(self, key: str):
+        with self._lock:
+            self._accounts.pop(key, None)
+            owner = self._owners.pop(key, None)
+            future = self._send(self._shards[owner], "remove", key, None) if owner is not None else None
+        if future is not None:
+            future.result()
+
+    def call(self, key: str, method: str, *args, **kwargs) -> Future:
+        "Run account.<method>(*args, **kwargs) in the owning shard"
+        with self._lock:
+            if key not in self._owners:
+                raise KeyError(f"Account {key} is not registered")
+            return self._send(self._shards[self._owners[key]], "call", key, (method, args, kwargs))
+
+    def place_order(self, key: str, order) -> Future:
+        return self.call(key, "place_order", order)
+
+    def cancel_order(self, key: str, order) -> Future:
+        return self.call(key, "cancel_order", order)
+
+    def get_current_portfolio(self, key: str) -> Future:
+        return self.call(key, "get_current_portfolio")
+
+    def owner(self, key: str) -> int:
+        return self._owners[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = {shard_id: 0 for shard_id in self._shards}
+            for owner in self._owners.values():
+                counts[owner] += 1
+            return {
+                shard_id: {"accounts": counts[shard_id], "pending": len(shard.pending), "restarts": shard.restarts}
+                for shard_id, shard in self._shards.items()
+            }
+
+    def resize(self, processes: int):
+        "Change the number of shards, moving only the accounts whose owner changes on the ring"
+        with self._lock:
+            for shard_id in range(self.processes, processes):
+                self._start_shard(_Shard(shard_id))
+            self.processes = processes
+            self._ring = HashRing(list(range(processes)))
+            futures = self._rebalance()
+            removed = [self._shards.pop(shard_id) for shard_id in list(self._shards) if shard_id >= processes]
+        for future in futures:
+            future.result()
+        for shard in removed:
+            self._stop_shard(shard)
+
+    def _rebalance(self) -> List[Future]:
+        # Must hold self._lock
+        futures = []
+        for key, spec in self._accounts.items():
+            owner = self._ring.owner(key)
+            previous = self._owners.get(key)
+            if owner == previous:
+                continue
+            if previous in self._shards:
+                futures.append(self._send(self._shards[previous], "remove", key, None))
+            futures.append(self._send(self._shards[owner], "add", key, spec))
+            self._owners[key] = owner
+        return futures
+
+    def _start_shard(self, shard: _Shard):
+        # Must hold self._lock
+        parent_conn, child_conn = self._context.Pipe()
+        shard.process = self._context.Process(
+            target=_shard_main,
+            args=(child_conn, shard.shard_id, self.factory, self.brokerages, self.threads),
+            name=f"trading-account-shard-{shard.shard_id}",
+            daemon=True,
+        )
+        shard.process.start()
+        child_conn.close()
+        shard.conn = parent_conn
+        shard.reader = threading.Thread(target=self._read, args=(shard, parent_conn), daemon=True,
+                                        name=f"shard-{shard.shard_id}-reader")
+        shard.reader.start()
+        self._shards[shard.shard_id] = shard
+
+    def _stop_shard(self, shard: _Shard, timeout=10):
+        shard.stopping = True
+        try:
+            with shard.send_lock:
+                shard.conn.send(None)
+        except Exception:
+            pass
+        shard.process.join(timeout)
+        if shard.process.is_alive():
+            shard.process.terminate()
+
+    def _send(self, shard: _Shard, command, key, payload) -> Future:
+        future = Future()
+        request_id = next(self._request_ids)
+        shard.pending[request_id] = future
+        try:
+            with shard.send_lock:
+                shard.conn.send((request_id, command, key, payload))
+        except Exception as e:
+            shard.pending.pop(request_id, None)
+            future.set_exception(ShardCrashedError(f"Shard {shard.shard_id} is not reachable: {e!r}"))
+        return future
+
+    def _read(self, shard: _Shard, conn):
+        while True:
+            try:
+                request_id, ok, result = conn.recv()
+            except (EOFError, OSError):
+                break
+            future = shard.pending.pop(request_id, None)
+            if future is None:
+                continue
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+        self._on_exit(shard, conn)
+
+    def _on_exit(self, shard: _Shard, conn):
+        for request_id in list(shard.pending):
+            future = shard.pending.pop(request_id, None)
+            if future is not None and not future.done():
+                future.set_exception(ShardCrashedError(f"Shard {shard.shard_id} exited before answering"))
+        if shard.stopping:
+            return
+        shard.process.join(5) # reap it, and get its exit code
+        with self._lock:
+            if not self._running or self._shards.get(shard.shard_id) is not shard or shard.conn is not conn:
+                return
+            logger.error(f"Shard {shard.shard_id} exited with code {shard.process.exitcode}, restarting")
+            shard.restarts += 1
+            self._start_shard(shard)
+            for key, owner in self._owners.items():
+                if owner == shard.shard_id:
+                    self._send(shard, "add", key, self._accounts[key])
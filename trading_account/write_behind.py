@@ -0,0 +1,103 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+import weakref
+from typing import Callable, List
+
+logger = logging.getLogger(__name__)
+
+EXIT_FLUSH_TIMEOUT = 30.0 # seconds the interpreter waits at exit for each queue to be written
+
+_open_queues = weakref.WeakSet()
+
+
+@atexit.register
+def _close_open_queues():
+    # The writer threads are daemons, without this the items still queued at exit are lost
+    for write_queue in list(_open_queues):
+        try:
+            write_queue.close(timeout=EXIT_FLUSH_TIMEOUT)
+        except Exception as e:
+            logger.error(f"Flushing {write_queue._thread.name} at exit failed: {e!r}")
+
+
+class WriteBehindQueue:
+    """Bounded in-process queue drained in batches by a background thread.
+
+    A batch is flushed once it holds max_batch items or flush_interval seconds after its first item.
+    put() blocks while the queue holds max_size items (backpressure), or raises queue.Full after timeout.
+    close() writes what is still queued and stops the thread. Queues still open at interpreter exit are closed by an
+    atexit hook, call close() yourself when the process ends some other way (os._exit, a killed worker).
+    """
+    def __init__(self, flush: Callable[[List], None], max_batch=500, flush_interval=1.0, max_size=10000,
+                 retries=3, name="write-behind"):
+        self._flush = flush
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self._queue = queue.Queue(maxsize=max_size)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+        _open_queues.add(self)
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def put(self, item, block=True, timeout=None):
+        if self._closed:
+            raise RuntimeError("WriteBehindQueue is closed")
+        self._queue.put(item, block=block, timeout=timeout)
+
+    def flush(self):
+        "Block until every item put so far has been written"
+        self._queue.join()
+
+    def close(self, timeout: float = None):
+        "Write the queued items and stop the writer thread, waiting at most timeout seconds"
+        if self._closed:
+            return
+        self._closed = True
+        _open_queues.discard(self)
+        self._queue.put(None)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.error(f"{self._thread.name} did not finish writing within {timeout}s, {len(self)} items left")
+
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.task_done()
+                    stop = True
+                    break
+                batch.append(item)
+            self._write(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    def _write(self, batch):
+        for attempt in range(self.retries + 1):
+            try:
+                self._flush(batch)
+                return
+            except Exception as e:
+                if attempt == self.retries:
+                    logger.error(f"Dropping {len(batch)} queued writes after {attempt + 1} attempts: {e!r}")
+                    return
+                logger.warning(f"Write of {len(batch)} queued items failed, retrying: {e!r}")
+                time.sleep(min(0.1 * 2 ** attempt, 2))